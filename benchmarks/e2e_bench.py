@@ -0,0 +1,338 @@
+"""
+End-to-end benchmark of the agent loop against a mock backend, no real LLM needed.
+
+Starts a mock chat completions server (see mock_backend.py) that answers every prompt with
+the rounds of tool calls in `--script`, then plain text. The tools are stubs: `lookup` sleeps
+on a worker thread and `fetch` is async and sleeps on the event loop, both for
+`--tool-latency` seconds. `--conversations` conversations of `--turns` prompts each are run,
+`--concurrency` at a time, either through the web server's /prompt (or /prompt/stream with
+`--stream`, where tools start as soon as their arguments are complete unless
+`--no-prefetch` is given, or as background jobs polled on /jobs/{job_id} with `--background`) served by
+uvicorn, or through `tool_calling.run_turn` like the CLI, one thread
+per conversation in flight. Completions are routed between `--backends` mock servers, plus
+`--dead-backends` that refuse connections to exercise failover.
+
+Every stage of the loop is timed with the spans in ai_function_agent.tracing (inference,
+tool, validation, context_window, conversation_load, conversation_save, serialization and
+turn) and reported as p50/p95/p99 along with the latency of whole turns as the client sees
+them and the throughput. `--save` writes the results to a JSON file, and `--baseline`
+compares them against one saved earlier: any percentile more than `--tolerance` (a fraction)
+and `--slack` milliseconds slower, or a throughput more than `--tolerance` lower, is a
+regression and the benchmark exits with status 1.
+
+Usage: python benchmarks/e2e_bench.py --mode server --concurrency 8 --conversations 32 --turns 2 [--stream] [--save results.json | --baseline results.json]
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import socket
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import uvicorn
+
+from ai_function_agent.router import create_router
+from ai_function_agent.tracing import Span, tracer
+from mock_backend import MockBackend
+
+PERCENTILES = {"p50": 0.5, "p95": 0.95, "p99": 0.99}
+
+
+def lookup() -> str:
+    time.sleep(args.tool_latency)
+    return "Looked it up."
+
+
+async def fetch() -> str:
+    await asyncio.sleep(args.tool_latency)
+    return "Fetched it."
+
+
+def stub_spec(name: str, description: str) -> dict:
+    return {
+        "type": "function",
+        "function": {
+            "name": name,
+            "description": description,
+            "parameters": {"type": "object", "properties": {}, "required": []},
+        },
+    }
+
+
+# Both only read, so they may be started before a streamed reply is done
+STUB_TOOLS = [
+    (lookup, stub_spec("lookup", "Looks something up."), {"side_effect_free": True}),
+    (fetch, stub_spec("fetch", "Fetches something."), {"side_effect_free": True}),
+]
+
+
+class SpanRecorder:
+    """Tracer listener keeping the duration of every span by name, spans end on several threads"""
+
+    def __init__(self):
+        self.durations: dict[str, list[float]] = defaultdict(list)
+        self.lock = threading.Lock()
+
+    def __call__(self, span: Span):
+        with self.lock:
+            self.durations[span.name].append(span.duration)
+
+
+def unused_url() -> str:
+    """A URL nothing listens on, for a backend that's down"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    return f"http://127.0.0.1:{port}/v1"
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def summarize(durations: list[float]) -> dict:
+    summary = {"count": len(durations)}
+    for name, fraction in PERCENTILES.items():
+        summary[name] = percentile(durations, fraction) * 1000
+    return summary
+
+
+async def server_conversation(http: httpx.AsyncClient, n: int, latencies: list):
+    conversation_id = None
+    for turn in range(args.turns):
+        params = {"prompt": f"Turn {turn} of conversation {n}"}
+        if conversation_id is not None:
+            params["conversation_id"] = conversation_id
+        start = time.perf_counter()
+        if args.stream:
+            async with http.stream("POST", "/prompt/stream", params=params) as response:
+                response.raise_for_status()
+                event = None
+                async for line in response.aiter_lines():
+                    if line.startswith("event: "):
+                        event = line[len("event: "):]
+                    elif event == "start" and line.startswith("data: "):
+                        conversation_id = json.loads(line[len("data: "):])["conversation_id"]
+        elif args.background:
+            response = await http.post("/prompt", params=dict(params, background="true"))
+            response.raise_for_status()
+            job = response.json()
+            while job["status"] in ("queued", "running"):
+                await asyncio.sleep(args.poll_interval)
+                response = await http.get(f"/jobs/{job['job_id']}")
+                response.raise_for_status()
+                job = response.json()
+            if job["status"] != "done":
+                raise RuntimeError(f"Job {job['job_id']} {job['status']}: {job['error']}")
+            conversation_id = job["conversation_id"]
+        else:
+            response = await http.post("/prompt", params=params)
+            response.raise_for_status()
+            conversation_id = response.json()["conversation_id"]
+        latencies.append(time.perf_counter() - start)
+
+
+async def run_server(router_config: dict, latencies: list):
+    from ai_function_agent import server
+
+    server.router = create_router(router_config)
+    server.tool_prefetcher.enabled = not args.no_prefetch
+    for function, spec, options in STUB_TOOLS:
+        server.tool_registry.register(function, spec, options)
+
+    # Serve the app for real, the in-memory ASGI transport buffers whole responses
+    web_server = uvicorn.Server(
+        uvicorn.Config(server.app, host="127.0.0.1", port=0, log_level="warning")
+    )
+    serve_task = asyncio.create_task(web_server.serve())
+    while not web_server.started:
+        await asyncio.sleep(0.05)
+    host, port = web_server.servers[0].sockets[0].getsockname()[:2]
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def conversation(n: int):
+        async with semaphore:
+            await server_conversation(http, n, latencies)
+
+    async with httpx.AsyncClient(
+        base_url=f"http://{host}:{port}",
+        timeout=None,
+        limits=httpx.Limits(max_connections=args.concurrency),
+    ) as http:
+        await asyncio.gather(*(conversation(n) for n in range(args.conversations)))
+
+    web_server.should_exit = True
+    await serve_task
+
+
+def run_cli(router_config: dict, latencies: list):
+    from ai_function_agent import tool_calling
+    from ai_function_agent.prompts import system_message, user_message
+
+    tool_calling.setup()
+    tool_calling.router = create_router(router_config)
+    for function, spec, options in STUB_TOOLS:
+        tool_calling.tool_registry.register(function, spec, options)
+
+    def conversation(n: int):
+        messages = [system_message]
+        for turn in range(args.turns):
+            messages.append(user_message(f"Turn {turn} of conversation {n}"))
+            start = time.perf_counter()
+            tool_calling.run_turn(messages, f"bench-{n}")
+            latencies.append(time.perf_counter() - start)
+
+    # The CLI prints every tool call and reply, keep them out of the report
+    with contextlib.redirect_stdout(io.StringIO()):
+        with ThreadPoolExecutor(args.concurrency) as pool:
+            list(pool.map(conversation, range(args.conversations)))
+
+
+def compare(results: dict, baseline: dict) -> list[str]:
+    """Returns a line for every stage percentile and the throughput that regressed"""
+    regressions = []
+    for stage, base in baseline["stages"].items():
+        current = results["stages"].get(stage)
+        if current is None:
+            continue
+        for name in PERCENTILES:
+            limit = base[name] * (1 + args.tolerance) + args.slack
+            if current[name] > limit:
+                regressions.append(
+                    f"{stage} {name}: {current[name]:.2f}ms, baseline {base[name]:.2f}ms"
+                )
+    if results["throughput"] < baseline["throughput"] * (1 - args.tolerance):
+        regressions.append(
+            f"throughput: {results['throughput']:.1f} turns/s, "
+            f"baseline {baseline['throughput']:.1f} turns/s"
+        )
+    return regressions
+
+
+def main():
+    script = [names.split(",") for names in args.script.split(";") if names]
+    backends = [
+        MockBackend(latency=args.latency, script=script).start() for _ in range(args.backends)
+    ]
+    router_config = {
+        "model_name": "mock",
+        "api_key": "EMPTY",
+        "backends": [{"api_url": backend.url} for backend in backends]
+        + [{"api_url": unused_url()} for _ in range(args.dead_backends)],
+    }
+    recorder = SpanRecorder()
+    tracer.add_listener(recorder)
+    latencies = []
+    start = time.perf_counter()
+    if args.mode == "server":
+        asyncio.run(run_server(router_config, latencies))
+    else:
+        run_cli(router_config, latencies)
+    wall_time = time.perf_counter() - start
+    tracer.remove_listener(recorder)
+    for backend in backends:
+        backend.stop()
+
+    settings = {
+        name: getattr(args, name)
+        for name in (
+            "mode",
+            "stream",
+            "background",
+            "no_prefetch",
+            "concurrency",
+            "conversations",
+            "turns",
+            "latency",
+            "backends",
+            "dead_backends",
+            "tool_latency",
+            "script",
+        )
+    }
+    results = {
+        "settings": settings,
+        "stages": {name: summarize(durations) for name, durations in recorder.durations.items()},
+        "client_turn": summarize(latencies),
+        "throughput": len(latencies) / wall_time,
+    }
+
+    print(f"{'stage':<20} {'count':>7} {'p50':>10} {'p95':>10} {'p99':>10}")
+    stages = sorted(results["stages"].items()) + [("turn (client)", results["client_turn"])]
+    for name, summary in stages:
+        print(
+            f"{name:<20} {summary['count']:>7} {summary['p50']:>8.2f}ms "
+            f"{summary['p95']:>8.2f}ms {summary['p99']:>8.2f}ms"
+        )
+    print(f"\nBackend requests:    {[backend.requests for backend in backends]}")
+    print(f"Wall time:           {wall_time:.2f}s")
+    print(f"Throughput:          {results['throughput']:.1f} turns/s")
+
+    if args.save:
+        with open(args.save, "w") as fp:
+            json.dump(results, fp, indent=4)
+        print(f"Results saved to {args.save}")
+
+    if args.baseline:
+        with open(args.baseline, "r") as fp:
+            baseline = json.load(fp)
+        if baseline["settings"] != settings:
+            print(f"Warning: the baseline was run with different settings: {baseline['settings']}")
+        regressions = compare(results, baseline)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) against {args.baseline}:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print(f"\nNo regressions against {args.baseline}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--mode", choices=["server", "cli"], default="server")
+    parser.add_argument(
+        "--stream", action="store_true", help="Use the streaming /prompt/stream route"
+    )
+    parser.add_argument(
+        "--background",
+        action="store_true",
+        help="Run turns as background jobs and poll /jobs/{job_id} until they finish",
+    )
+    parser.add_argument("--poll-interval", type=float, default=0.02)
+    parser.add_argument(
+        "--no-prefetch",
+        action="store_true",
+        help="Don't start tools before streamed replies are done",
+    )
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--conversations", type=int, default=32)
+    parser.add_argument("--turns", type=int, default=2)
+    parser.add_argument("--latency", type=float, default=0.05, help="Backend latency in seconds")
+    parser.add_argument("--backends", type=int, default=1, help="Mock backends to route between")
+    parser.add_argument(
+        "--dead-backends", type=int, default=0, help="Backends that refuse connections, to fail over from"
+    )
+    parser.add_argument("--tool-latency", type=float, default=0.02)
+    parser.add_argument(
+        "--script",
+        default="lookup,fetch;lookup",
+        help="Tool calls asked for in each round, rounds separated by ';' and tools by ','",
+    )
+    parser.add_argument("--save", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", help="Compare against results saved with --save")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument(
+        "--slack", type=float, default=1.0, help="Milliseconds any stage may slow down regardless"
+    )
+    args = parser.parse_args()
+    main()
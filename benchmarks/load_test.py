@@ -0,0 +1,114 @@
+"""
+Load test for the `/prompt` endpoint of the web server.
+
+Starts a mock backend, points the server's client at it and registers a stub `wait` tool
+that sleeps to stand in for a slow search. Then it fires a batch of concurrent
+conversations and compares the wall time against running them one after another.
+If the server overlaps conversations, the speedup should be close to the concurrency.
+
+Usage: python benchmarks/load_test.py --conversations 16 --latency 0.5 --tool-latency 0.5 [--stream]
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+import uvicorn
+
+from ai_function_agent import server
+from ai_function_agent.router import create_router
+from mock_backend import MockBackend
+
+
+def wait() -> str:
+    time.sleep(args.tool_latency)
+    return "Done waiting."
+
+
+wait_spec = {
+    "type": "function",
+    "function": {
+        "name": "wait",
+        "description": "Waits for a bit.",
+        "parameters": {"type": "object", "properties": {}, "required": []},
+    },
+}
+
+
+async def run_conversation(http: httpx.AsyncClient, n: int) -> tuple[float, float]:
+    """Returns the time until the first content reached the client and the total time"""
+    start = time.perf_counter()
+    params = {"prompt": f"Load test {n}"}
+    if not args.stream:
+        response = await http.post("/prompt", params=params)
+        response.raise_for_status()
+        total = time.perf_counter() - start
+        return total, total
+
+    first_content = None
+    async with http.stream("POST", "/prompt/stream", params=params) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if first_content is None and line in (
+                "event: reasoning",
+                "event: content",
+            ):
+                first_content = time.perf_counter() - start
+    return first_content, time.perf_counter() - start
+
+
+async def run_load_test():
+    backend = MockBackend(latency=args.latency, tool_name="wait").start()
+    server.router = create_router(
+        {"api_url": backend.url, "api_key": "EMPTY", "model_name": "mock"}
+    )
+    server.tool_registry.register(wait, wait_spec)
+
+    # Serve the app for real, the in-memory ASGI transport buffers whole responses
+    web_server = uvicorn.Server(
+        uvicorn.Config(server.app, host="127.0.0.1", port=args.port, log_level="warning")
+    )
+    serve_task = asyncio.create_task(web_server.serve())
+    while not web_server.started:
+        await asyncio.sleep(0.05)
+
+    async with httpx.AsyncClient(
+        base_url=f"http://127.0.0.1:{args.port}",
+        timeout=None,
+        limits=httpx.Limits(max_connections=args.conversations),
+    ) as http:
+        start = time.perf_counter()
+        results = await asyncio.gather(
+            *(run_conversation(http, n) for n in range(args.conversations))
+        )
+        first_content, latencies = zip(*results)
+        wall_time = time.perf_counter() - start
+
+    web_server.should_exit = True
+    await serve_task
+    backend.stop()
+
+    # Two inference rounds and one tool call per conversation
+    serial_time = args.conversations * (2 * args.latency + args.tool_latency)
+    print(f"Conversations:        {args.conversations}")
+    print(f"Backend requests:     {backend.requests}")
+    print(f"Wall time:            {wall_time:.2f}s")
+    print(f"Serial time:          {serial_time:.2f}s")
+    print(f"Speedup:              {serial_time / wall_time:.1f}x")
+    print(f"Latency p50:          {statistics.median(latencies):.2f}s")
+    print(f"Latency max:          {max(latencies):.2f}s")
+    print(f"First content p50:    {statistics.median(first_content):.2f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--conversations", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--tool-latency", type=float, default=0.5)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument(
+        "--stream", action="store_true", help="Use the streaming /prompt/stream route"
+    )
+    args = parser.parse_args()
+    asyncio.run(run_load_test())
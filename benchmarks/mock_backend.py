@@ -0,0 +1,246 @@
+"""
+A tiny OpenAI-compatible chat completions server for benchmarking the agent without a real LLM.
+
+Every completion waits `latency` seconds before answering. If the request offers a tool named
+`tool_name` and the last message isn't a tool result, the mock asks for that tool first,
+otherwise it replies with plain text. Requests with `stream=True` get the same reply as
+server-sent chunks, one word at a time (and a usage chunk if `stream_options` asks for it).
+With `record` every request body is kept in `bodies`.
+
+A `script` replaces `tool_name` with several rounds of tool calls: the n-th reply since the
+last user message asks for all the tools in `script[n]` at once (those the request offers),
+and the first reply past the end of the script is plain text.
+"""
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class MockHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # The default backlog of 5 makes concurrent clients wait on TCP retries
+    request_queue_size = 128
+
+
+class MockBackend:
+    def __init__(
+        self,
+        latency: float = 0.5,
+        tool_name: str = None,
+        port: int = 0,
+        record: bool = False,
+        script: list[list[str]] = None,
+    ):
+        self.latency = latency
+        self.tool_name = tool_name
+        self.script = script
+        self.record = record
+        self.bodies = []
+        self.requests = 0
+        self._lock = threading.Lock()
+        self.server = MockHTTPServer(("127.0.0.1", port), self._make_handler())
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "MockBackend":
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def completion(self, body: dict) -> dict:
+        with self._lock:
+            self.requests += 1
+        time.sleep(self.latency)
+        message, finish_reason = self.reply(body)
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "mock"),
+            "choices": [
+                {"index": 0, "message": message, "finish_reason": finish_reason}
+            ],
+            "usage": self.usage(body, message),
+        }
+
+    def completion_chunks(self, body: dict):
+        """Streams the same reply as `completion` as chat.completion.chunk objects, one word at a time"""
+        with self._lock:
+            self.requests += 1
+        message, finish_reason = self.reply(body)
+        chunk_id = f"chatcmpl-{uuid.uuid4().hex}"
+
+        def chunk(delta: dict, finish_reason: str = None) -> dict:
+            return {
+                "id": chunk_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": body.get("model", "mock"),
+                "choices": [
+                    {"index": 0, "delta": delta, "finish_reason": finish_reason}
+                ],
+            }
+
+        words = (message.get("content") or "").split()
+        tool_calls = message.get("tool_calls") or []
+        # Spread the latency over the reply like a real backend would, a tool call's arguments
+        # are complete a while before the reply is
+        delay = self.latency / (len(words) + len(tool_calls) + 1)
+        time.sleep(delay)
+        yield chunk({"role": "assistant", "reasoning_content": "Thinking..."})
+        for n, word in enumerate(words):
+            time.sleep(delay)
+            yield chunk({"content": word if n == 0 else " " + word})
+        for n, tool_call in enumerate(tool_calls):
+            time.sleep(delay)
+            yield chunk(
+                {
+                    "tool_calls": [
+                        {
+                            "index": n,
+                            "id": tool_call["id"],
+                            "type": "function",
+                            "function": {"name": tool_call["function"]["name"]},
+                        }
+                    ]
+                }
+            )
+            yield chunk(
+                {
+                    "tool_calls": [
+                        {
+                            "index": n,
+                            "function": {
+                                "arguments": tool_call["function"]["arguments"]
+                            },
+                        }
+                    ]
+                }
+            )
+        yield chunk({}, finish_reason)
+        if (body.get("stream_options") or {}).get("include_usage"):
+            usage_chunk = chunk({})
+            usage_chunk["choices"] = []
+            usage_chunk["usage"] = self.usage(body, message)
+            yield usage_chunk
+
+    def usage(self, body: dict, message: dict) -> dict:
+        """Rough token counts, about four characters to a token"""
+        prompt_tokens = len(json.dumps(body.get("messages", []))) // 4
+        completion_tokens = len(json.dumps(message)) // 4
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+
+    def tools_to_call(self, messages: list[dict], tool_names: list[str]) -> list[str]:
+        if self.script is None:
+            if self.tool_name in tool_names and messages and messages[-1].get("role") != "tool":
+                return [self.tool_name]
+            return []
+        # Count the replies since the last user message to know which round this is
+        round = 0
+        for message in reversed(messages):
+            if message.get("role") == "user":
+                break
+            round += message.get("role") == "assistant"
+        if round >= len(self.script):
+            return []
+        return [name for name in self.script[round] if name in tool_names]
+
+    def reply(self, body: dict) -> tuple[dict, str]:
+        tool_names = [t["function"]["name"] for t in body.get("tools") or []]
+        calls = self.tools_to_call(body.get("messages", []), tool_names)
+        if calls:
+            message = {
+                "role": "assistant",
+                "content": None,
+                "tool_calls": [
+                    {
+                        "id": f"call_{uuid.uuid4().hex[:8]}",
+                        "type": "function",
+                        "function": {"name": name, "arguments": "{}"},
+                    }
+                    for name in calls
+                ],
+            }
+            finish_reason = "tool_calls"
+        else:
+            message = {"role": "assistant", "content": "Mock response."}
+            finish_reason = "stop"
+        return message, finish_reason
+
+    def _make_handler(self):
+        backend = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, status: int, data: dict):
+                payload = json.dumps(data).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_GET(self):
+                if self.path.rstrip("/").endswith("/models"):
+                    self._send_json(
+                        200, {"object": "list", "data": [{"id": "mock", "object": "model"}]}
+                    )
+                else:
+                    self._send_json(404, {"error": "not found"})
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                if backend.record:
+                    with backend._lock:
+                        backend.bodies.append(body)
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self._send_json(404, {"error": "not found"})
+                elif body.get("stream"):
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/event-stream")
+                    self.send_header("Connection", "close")
+                    self.end_headers()
+                    for chunk in backend.completion_chunks(body):
+                        self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                        self.wfile.flush()
+                    self.wfile.write(b"data: [DONE]\n\n")
+                    self.close_connection = True
+                else:
+                    self._send_json(200, backend.completion(body))
+
+        return Handler
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--tool-name", default=None)
+    args = parser.parse_args()
+
+    backend = MockBackend(args.latency, args.tool_name, args.port)
+    print(f"Mock backend listening on {backend.url}")
+    try:
+        backend.server.serve_forever()
+    except KeyboardInterrupt:
+        backend.stop()
@@ -0,0 +1,144 @@
+"""
+Prefix cache benchmark for the prompts the web server sends to its backend.
+
+Runs a few conversations of several turns each through the server against a mock backend
+that records every request, interleaving the conversations the way concurrent users would.
+The recorded prompts are then replayed through a model of llama.cpp's prompt cache: the
+server has `--slots` slots that each keep the last prompt they processed, and a request only
+skips the part of its prompt that starts with exactly the same characters as its slot's.
+Without `id_slot` a request goes to the slot sharing the longest prefix with it (if that's
+at least half of the slot's prompt), otherwise to the least recently used one.
+
+Reports how much of the prompts could be reused and how many requests extended the previous
+prompt of their slot in full. `--volatile-system-prompt` emulates how prompts used to be
+built, with the date in the system prompt of each conversation (taken when its worker
+started) instead of in the user messages.
+
+Usage: python benchmarks/prefix_cache_bench.py --conversations 8 --turns 6 --slots 4 [--hints]
+"""
+import argparse
+import asyncio
+import json
+import os
+from datetime import datetime, timedelta
+
+import httpx
+
+from ai_function_agent import prompts, server
+from ai_function_agent.router import create_router
+from mock_backend import MockBackend
+
+
+def wait() -> str:
+    return "Done waiting."
+
+
+wait_spec = {
+    "type": "function",
+    "function": {
+        "name": "wait",
+        "description": "Waits for a bit.",
+        "parameters": {"type": "object", "properties": {}, "required": []},
+    },
+}
+
+
+def render(body: dict) -> str:
+    """Stands in for the chat template, the system prompt, then the tools, then the rest"""
+    messages = body["messages"]
+    parts = [json.dumps(messages[0]), json.dumps(body.get("tools"))]
+    parts += [json.dumps(message) for message in messages[1:]]
+    return "\n".join(parts)
+
+
+class SlotCache:
+    def __init__(self, slots: int):
+        self.prompts = [""] * slots
+        self.last_used = [0] * slots
+        self.clock = 0
+
+    def process(self, prompt: str, id_slot: int | None) -> tuple[int, bool]:
+        """Returns how many characters of the prompt were reused and if the slot's prompt was all reused"""
+        self.clock += 1
+        if id_slot is None:
+            shared = [len(os.path.commonprefix([cached, prompt])) for cached in self.prompts]
+            best = max(range(len(self.prompts)), key=lambda n: shared[n])
+            if not self.prompts[best] or shared[best] < len(self.prompts[best]) / 2:
+                best = min(range(len(self.prompts)), key=lambda n: self.last_used[n])
+            id_slot = best
+        cached = self.prompts[id_slot]
+        reused = len(os.path.commonprefix([cached, prompt]))
+        self.prompts[id_slot] = prompt
+        self.last_used[id_slot] = self.clock
+        return reused, bool(cached) and reused == len(cached)
+
+
+async def run_conversations(args):
+    backend = MockBackend(latency=0, tool_name="wait", record=True).start()
+    server.router = create_router(
+        {"api_url": backend.url, "api_key": "EMPTY", "model_name": "mock"}
+    )
+    server.tool_registry.register(wait, wait_spec)
+    server.cache_hints = prompts.CacheHints("llama.cpp" if args.hints else None, args.slots)
+    if args.volatile_system_prompt:
+        server.user_message = lambda prompt: {"role": "user", "content": prompt}
+
+    conversation_ids = [None] * args.conversations
+    started = datetime.today()
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+        for turn in range(args.turns):
+            for n in range(args.conversations):
+                if conversation_ids[n] is None and args.volatile_system_prompt:
+                    # A different worker (or a restart) for every conversation
+                    date = (started + timedelta(seconds=n)).strftime("%Y-%m-%d %H:%M:%S")
+                    server.system_message = {
+                        "role": "system",
+                        "content": f"{prompts.SYSTEM_PROMPT}\nThe current date is {date}",
+                    }
+                params = {"prompt": f"Turn {turn} of conversation {n}, please wait for a bit."}
+                if conversation_ids[n] is not None:
+                    params["conversation_id"] = conversation_ids[n]
+                response = await http.post("/prompt", params=params)
+                response.raise_for_status()
+                conversation_ids[n] = response.json()["conversation_id"]
+    backend.stop()
+    return backend.bodies
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--conversations", type=int, default=8)
+    parser.add_argument("--turns", type=int, default=6)
+    parser.add_argument("--slots", type=int, default=4)
+    parser.add_argument(
+        "--hints", action="store_true", help="Send llama.cpp's cache_prompt and id_slot hints"
+    )
+    parser.add_argument(
+        "--volatile-system-prompt",
+        action="store_true",
+        help="Put the date in the system prompt like older versions did",
+    )
+    args = parser.parse_args()
+
+    bodies = asyncio.run(run_conversations(args))
+    cache = SlotCache(args.slots)
+    total = reused = full_hits = 0
+    for body in bodies:
+        prompt = render(body)
+        prompt_reused, full_hit = cache.process(prompt, body.get("id_slot"))
+        total += len(prompt)
+        reused += prompt_reused
+        full_hits += full_hit
+
+    print(f"Requests:            {len(bodies)}")
+    print(f"Prompt characters:   {total}")
+    print(f"Reused from cache:   {reused} ({reused / total:.1%})")
+    print(f"Processed:           {total - reused}")
+    print(f"Full prefix hits:    {full_hits} of {len(bodies)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+Retrieval benchmark for recall_memory: vector search alone, BM25 alone and the two fused with
+reciprocal rank fusion, over a synthetic corpus of memories.
+
+Every memory belongs to a topic and mentions a unique name and order number. Embedding 100k
+memories with the real model would take hours, so vectors are synthetic too: a memory's vector
+is its topic's vector plus some noise. Two kinds of queries are asked about a random memory:
+
+- semantic: no shared words to match on, and a vector close to the memory's own
+- exact: the memory's order number, and a vector that only knows the topic (like an embedding
+  of "order 48213" would), so only the words can tell the memory apart from its topic
+
+Reports recall@k for each kind of query and the search latency of each method, including
+fetching the texts from the document store.
+
+Usage: python benchmarks/retrieval_bench.py --memories 100000 --queries 1000 --k 5
+"""
+import argparse
+import random
+import statistics
+import tempfile
+import time
+
+import numpy as np
+
+from ai_function_agent.memory_docstore import DocumentStore
+from ai_function_agent.memory_index import MemoryIndex
+from ai_function_agent.memory_lexical import BM25Index, reciprocal_rank_fusion
+
+NAMES = ["Alice", "Bob", "Carmen", "Dmitri", "Esther", "Farid", "Grace", "Hiro", "Ines", "Jonas"]
+THINGS = ["laptop", "bicycle", "camera", "kettle", "monitor", "guitar", "tent", "drill"]
+TOPIC_WORDS = ["shipping", "warranty", "refund", "repair", "delivery", "invoice", "upgrade"]
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    return vectors / np.linalg.norm(vectors, axis=-1, keepdims=True)
+
+
+def build_corpus(args, rng: np.random.Generator):
+    topics = normalize(rng.standard_normal((args.topics, args.dim)).astype(np.float32))
+    doc_topics = rng.integers(0, args.topics, args.memories)
+    vectors = normalize(
+        topics[doc_topics]
+        + args.noise * rng.standard_normal((args.memories, args.dim)).astype(np.float32)
+    )
+    texts = []
+    for n in range(args.memories):
+        topic = doc_topics[n]
+        texts.append(
+            f"{NAMES[n % len(NAMES)]} asked about the {TOPIC_WORDS[topic % len(TOPIC_WORDS)]} "
+            f"of their {THINGS[topic % len(THINGS)]}, order number {100000 + n}"
+        )
+    return topics, doc_topics, vectors, texts
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--memories", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--dim", type=int, default=128)
+    parser.add_argument("--topics", type=int, default=500)
+    parser.add_argument("--noise", type=float, default=0.5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    random.seed(args.seed)
+    directory = tempfile.mkdtemp()
+    topics, doc_topics, vectors, texts = build_corpus(args, rng)
+    names = [f"memory_{n}.txt" for n in range(args.memories)]
+
+    start = time.perf_counter()
+    index = MemoryIndex(directory, ndim=args.dim, view=True, compact_every=args.memories + 1)
+    batch = 10000
+    for n in range(0, args.memories, batch):
+        index.add(names[n : n + batch], vectors[n : n + batch])
+    index.compact()
+    vector_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    lexical = BM25Index()
+    for name, text in zip(names, texts):
+        lexical.add(name, text)
+    lexical_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    store = DocumentStore(directory)
+    store.add_many(list(zip(names, texts)))
+    store_time = time.perf_counter() - start
+    print(
+        f"Indexed {args.memories} memories: vectors {vector_time:.1f}s, "
+        f"BM25 {lexical_time:.1f}s, document store {store_time:.1f}s"
+    )
+
+    queries = []
+    for target in random.sample(range(args.memories), args.queries):
+        if len(queries) % 2 == 0:
+            vector = vectors[target] + 0.1 * rng.standard_normal(args.dim).astype(np.float32)
+            queries.append(("semantic", target, "what happened with that", normalize(vector)))
+        else:
+            vector = topics[doc_topics[target]] + args.noise * rng.standard_normal(args.dim)
+            vector = normalize(vector.astype(np.float32))
+            queries.append(("exact", target, f"order {100000 + target}", vector))
+
+    candidates = max(args.k, 20)
+    methods = {
+        "vector": lambda text, vector: [
+            name for name, _ in index.search_documents(vector, args.k)
+        ],
+        "bm25": lambda text, vector: [name for name, _ in lexical.search(text, args.k)],
+        "hybrid": lambda text, vector: [
+            name
+            for name, _ in reciprocal_rank_fusion(
+                [
+                    [name for name, _ in index.search_documents(vector, candidates)],
+                    [name for name, _ in lexical.search(text, candidates)],
+                ],
+                args.k,
+            )
+        ],
+    }
+
+    print(f"\n{'method':<8} {'semantic':>9} {'exact':>9} {'overall':>9} {'p50':>9} {'p99':>9}")
+    for method, search in methods.items():
+        hits = {"semantic": [], "exact": []}
+        latencies = []
+        for kind, target, text, vector in queries:
+            start = time.perf_counter()
+            found = search(text, vector)
+            [store.get(name) for name in found]
+            latencies.append(time.perf_counter() - start)
+            hits[kind].append(names[target] in found)
+        recall = {kind: sum(values) / len(values) for kind, values in hits.items()}
+        overall = statistics.mean(hits["semantic"] + hits["exact"])
+        print(
+            f"{method:<8} {recall['semantic']:>9.3f} {recall['exact']:>9.3f} {overall:>9.3f} "
+            f"{percentile(latencies, 0.5) * 1000:>7.2f}ms {percentile(latencies, 0.99) * 1000:>7.2f}ms"
+        )
+    print(f"\nrecall@{args.k} over {args.queries} queries")
+    index.close()
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
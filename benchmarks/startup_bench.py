@@ -0,0 +1,76 @@
+"""
+Startup benchmark for the CLI (`ai-function-agent`) and the web server (`ai-webserver`).
+
+Each run is a fresh interpreter that imports the entry point module and runs its setup, which
+is everything they do before asking for the first prompt or accepting the first request. Runs
+once with the tool modules loaded lazily (the default) and once with every tool module imported
+up front, which is how they were loaded before. Reports the time to import, the whole process
+time and the peak RSS.
+
+Usage: python benchmarks/startup_bench.py --runs 5
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+ENTRY_POINTS = {
+    "ai-function-agent": "ai_function_agent.tool_calling",
+    "ai-webserver": "ai_function_agent.server",
+}
+
+RUN_CODE = """
+import importlib, json, resource, time
+start = time.perf_counter()
+from ai_function_agent.tool_registry import ToolRegistry
+ToolRegistry.lazy = {lazy}
+module = importlib.import_module("{module}")
+# The CLI builds its router and tools when main() starts, not on import
+if hasattr(module, "setup"):
+    module.setup()
+elapsed = time.perf_counter() - start
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+print(json.dumps({{"import": elapsed, "rss": rss}}))
+"""
+
+
+def run_once(module: str, lazy: bool) -> dict:
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-c", RUN_CODE.format(module=module, lazy=lazy)],
+        capture_output=True,
+        text=True,
+    )
+    total = time.perf_counter() - start
+    if result.returncode != 0:
+        error = result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "unknown"
+        return {"error": error}
+    stats = json.loads(result.stdout.strip().splitlines()[-1])
+    stats["total"] = total
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'entry point':<20} {'tools':<6} {'import':>9} {'process':>9} {'peak RSS':>10}")
+    for name, module in ENTRY_POINTS.items():
+        for lazy in (False, True):
+            runs = [run_once(module, lazy) for _ in range(args.runs)]
+            label = "lazy" if lazy else "eager"
+            errors = [run["error"] for run in runs if "error" in run]
+            if errors:
+                print(f"{name:<20} {label:<6} failed: {errors[0]}")
+                continue
+            import_time = statistics.median(run["import"] for run in runs)
+            total = statistics.median(run["total"] for run in runs)
+            rss = statistics.median(run["rss"] for run in runs)
+            print(f"{name:<20} {label:<6} {import_time:>8.2f}s {total:>8.2f}s {rss:>7.0f} MB")
+
+
+if __name__ == "__main__":
+    main()
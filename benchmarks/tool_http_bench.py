@@ -0,0 +1,160 @@
+"""
+Benchmark for the network tools against a local stub of the APIs they call.
+
+The stub answers like open-meteo's forecast API after `--latency` seconds, and counts the TCP
+connections it accepts. It can also fail the first `--fail-first` requests with a 503 to
+exercise the retries.
+
+Runs `--calls` get_weather calls, `--concurrency` at a time, through the shared pooled client,
+and the same number of one-off `requests.get` calls like the tool used to make.
+
+Usage: python benchmarks/tool_http_bench.py --calls 200 --concurrency 8 --latency 0.01
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from ai_function_agent import tool_http
+from ai_function_agent.tool_http import http_client
+from ai_function_agent.tool_registry import ToolModule
+
+SYSTEM_FUNCTIONS = os.path.join(os.path.dirname(tool_http.__file__), "functions", "system")
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, latency: float, fail_first: int):
+        self.latency = latency
+        self.fail_first = fail_first
+        self.connections = 0
+        self.requests = 0
+        self.lock = threading.Lock()
+        super().__init__(("127.0.0.1", 0), StubHandler)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address
+        return f"http://{host}:{port}"
+
+    def get_request(self):
+        with self.lock:
+            self.connections += 1
+        return super().get_request()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # The headers and body go out in separate writes, without this every reply on a kept alive
+    # connection waits for the client's delayed ACK
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def respond(self, status: int, body: bytes, content_type: str):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def handle_request(self) -> bool:
+        """Counts the request and sleeps, returns False if it should fail"""
+        with self.server.lock:
+            self.server.requests += 1
+            fail = self.server.requests <= self.server.fail_first
+        time.sleep(self.server.latency)
+        if fail:
+            self.respond(503, b"overloaded", "text/plain")
+        return not fail
+
+    def do_GET(self):
+        if self.handle_request():
+            current = {"time": "2025-01-01T12:00", "temperature_2m": 21.5, "wind_speed_10m": 7.2}
+            self.respond(200, json.dumps({"current": current}).encode(), "application/json")
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+async def run_pooled(get_weather, calls: int, concurrency: int) -> list[float]:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def call() -> float:
+        async with semaphore:
+            start = time.perf_counter()
+            await get_weather("43.65", "-79.38")
+            return time.perf_counter() - start
+
+    return await asyncio.gather(*(call() for _ in range(calls)))
+
+
+def run_unpooled(url: str, calls: int, concurrency: int) -> list[float]:
+    import requests
+
+    def call() -> float:
+        start = time.perf_counter()
+        requests.get(f"{url}?latitude=43.65&longitude=-79.38&current=temperature_2m").json()
+        return time.perf_counter() - start
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        return list(pool.map(lambda _: call(), range(calls)))
+
+
+def report(name: str, latencies: list[float], wall_time: float, stub: StubServer):
+    print(
+        f"{name:<10} {len(latencies) / wall_time:>8.0f}/s {statistics.median(latencies) * 1000:>8.2f}ms "
+        f"{percentile(latencies, 0.99) * 1000:>8.2f}ms {stub.connections:>12}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.01)
+    parser.add_argument("--fail-first", type=int, default=0)
+    args = parser.parse_args()
+
+    weather = ToolModule(os.path.join(SYSTEM_FUNCTIONS, "get_weather.py")).load()
+    http_client.configure(backoff=0.05, per_host=args.concurrency)
+
+    print(f"{'client':<10} {'calls/s':>10} {'p50':>10} {'p99':>10} {'connections':>12}")
+    stub = StubServer(args.latency, args.fail_first)
+    threading.Thread(target=stub.serve_forever, daemon=True).start()
+    weather.API_URL = f"{stub.url}/v1/forecast"
+    loop = asyncio.new_event_loop()
+    start = time.perf_counter()
+    latencies = loop.run_until_complete(
+        run_pooled(weather.get_weather, args.calls, args.concurrency)
+    )
+    report("pooled", latencies, time.perf_counter() - start, stub)
+    print(f"           {http_client.stats()}")
+    stub.shutdown()
+
+    try:
+        stub = StubServer(args.latency, 0)
+        threading.Thread(target=stub.serve_forever, daemon=True).start()
+        start = time.perf_counter()
+        latencies = run_unpooled(f"{stub.url}/v1/forecast", args.calls, args.concurrency)
+        report("requests", latencies, time.perf_counter() - start, stub)
+        stub.shutdown()
+    except ImportError:
+        print("requests isn't installed, skipping the unpooled comparison")
+
+    loop.run_until_complete(http_client.aclose())
+
+
+if __name__ == "__main__":
+    main()
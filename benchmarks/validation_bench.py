@@ -0,0 +1,92 @@
+"""
+Microbenchmark for tool call argument validation.
+
+Compares the old path, where `print_func_calls`, `is_valid_tool_call` and `execute_functions`
+each parsed the arguments and `is_valid_tool_call` inspected the function's signature every
+time, against the validator the ToolRegistry compiles once per tool.
+
+Usage: python benchmarks/validation_bench.py --calls 100000
+"""
+import argparse
+import inspect
+import json
+import timeit
+
+from ai_function_agent.tool_validation import ArgumentValidator
+
+
+def ddg_search(query: str, results: int = 3) -> list[dict]:
+    pass
+
+
+ddg_search_spec = {
+    "type": "function",
+    "function": {
+        "name": "ddg_search",
+        "description": "Searches the internet using duck duck go.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "query": {"type": "string", "description": "The search query to look for"},
+                "results": {"type": "number", "description": "The number of (max) results to get"},
+            },
+            "required": ["query"],
+        },
+    },
+}
+
+arguments = json.dumps({"query": "cat food", "results": 5})
+
+
+def legacy_is_valid_tool_call(fnc, arguments: str) -> bool:
+    fn_args = json.loads(arguments)
+    params = inspect.signature(fnc).parameters
+    fnc_args = params.keys()
+    model_args = fn_args.keys()
+    extra = [arg for arg in model_args if arg not in fnc_args]
+    if len(extra) != 0:
+        return False
+    missing = fnc_args - model_args
+    if len(missing) == 0:
+        return list(params.keys()) == list(fn_args.keys())
+    for key in missing:
+        param = params.get(key)
+        if param.default == inspect.Parameter.empty:
+            return False
+    return True
+
+
+def legacy_path():
+    # print_func_calls, then execute_functions validating and parsing again
+    legacy_is_valid_tool_call(ddg_search, arguments)
+    if legacy_is_valid_tool_call(ddg_search, arguments):
+        json.loads(arguments)
+
+
+validator = ArgumentValidator("ddg_search", ddg_search, ddg_search_spec)
+
+
+def compiled_path():
+    validator.validate(arguments)
+
+
+def compile_and_validate():
+    ArgumentValidator("ddg_search", ddg_search, ddg_search_spec).validate(arguments)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--calls", type=int, default=100000)
+    args = parser.parse_args()
+
+    results = {}
+    for name, fn in [
+        ("legacy (3 parses + signature)", legacy_path),
+        ("compiled validator", compiled_path),
+        ("compile + validate", compile_and_validate),
+    ]:
+        seconds = min(timeit.repeat(fn, number=args.calls, repeat=3))
+        results[name] = seconds
+        print(f"{name:32} {seconds / args.calls * 1e6:8.2f} us/call")
+    speedup = results["legacy (3 parses + signature)"] / results["compiled validator"]
+    print(f"\nCompiled validator is {speedup:.1f}x faster per call")
@@ -0,0 +1,68 @@
+import json
+import os
+
+__location__ = os.path.dirname(os.path.realpath(__file__))
+
+join_path = lambda x: os.path.join(__location__, x)
+
+
+config_path = join_path("config.json")
+
+# Written out the first time either the CLI or the web server starts
+DEFAULT_CONFIG = {
+    "model_name": "Qwen",
+    "api_url": "http://localhost:8080/v1",
+    "api_key": "EMPTY",
+    "load_user_funcs": False,
+    "max_connections": 32,
+    "tool_workers": 8,
+    "heavy_tool_workers": 1,
+    "tool_timeout": 120,
+    "tool_prefetch": True,
+    "context_window": {
+        "max_tokens": 16384,
+        "tokenizer": None,
+        "max_tool_result_tokens": 2048,
+        "keep_tool_turns": 2,
+        "summarize": True,
+        "summary_tokens": 512,
+    },
+    "prompt_cache": {"hints": None, "slots": 1},
+    "tool_http": {"timeout": 10, "retries": 2, "backoff": 0.5, "per_host": 4},
+    "memory": {"duplicate_threshold": 0.95},
+    "memory_service": {"enabled": False, "host": "127.0.0.1", "port": 8770},
+    "image_gen": {
+        "pipeline": "lumina",
+        "idle_timeout": 300,
+        "max_batch_size": 4,
+        "batch_wait": 0.25,
+    },
+    "conversation_store": "jsonl",
+    "conversation_cache": {
+        "max_conversations": 256,
+        "max_mb": 64,
+        "flush_interval": 1.0,
+    },
+    "web_server": {"host": "127.0.0.1", "port": 8000, "reload": False},
+    "metrics": {"enabled": True},
+    "scheduler": {"max_concurrent": 4, "max_queue": 64},
+    "jobs": {"ttl": 3600, "max_jobs": 1000},
+    "router": {"failure_threshold": 3, "cooldown": 30, "health_interval": 15},
+}
+
+
+def load_config() -> dict:
+    """Loads the user's config file, creating it from the defaults if it doesn't exist yet"""
+    if not os.path.exists(config_path):
+        # User's config file doesn't exist, create one
+        with open(config_path, "w") as fp:
+            json.dump(DEFAULT_CONFIG, fp, indent=4)
+        print(f"\nNEW CONFIG FILE CREATED FOR EDITING: {config_path}")
+        return json.loads(json.dumps(DEFAULT_CONFIG))
+    with open(config_path, "r") as fp:
+        return json.load(fp)
+
+
+# Shared by the CLI, the web server and the tool modules. Importing this module only reads the
+# config, so tools can use it without starting either entry point's clients and threads
+config = load_config()
@@ -0,0 +1,385 @@
+import json
+import threading
+from collections import OrderedDict
+from typing import Awaitable, Callable
+
+# Roughly what a chat template adds around every message (role, start and end tokens)
+MESSAGE_OVERHEAD = 4
+# Without a tokenizer, assume a token is about this many bytes of UTF-8
+BYTES_PER_TOKEN = 4
+# Once messages have to be cut, cut down to this fraction of the budget, so the next few
+# rounds fit without cutting (and summarizing) again and the start of the prompt stays the same
+LOW_WATER = 0.6
+# How many truncated tool results to keep around
+TRUNCATED_CACHE_SIZE = 256
+SUMMARY_PROMPT = (
+    "Summarize the conversation below for yourself, so you can carry on with it without "
+    "seeing it. Keep every fact, name, number, decision and open task, drop small talk and "
+    "raw tool output. Reply with the summary only."
+)
+
+
+def first_message(messages: list) -> int:
+    """Index of the first message after the system prompt, which is always sent"""
+    return 1 if messages and messages[0].get("role") == "system" else 0
+
+
+class TokenCounter:
+    """
+    Counts tokens with the chat model's tokenizer (a fast `tokenizers` backed one loaded
+    through transformers), or estimates them from the text's length without one.
+
+    Counts are remembered per text, keyed by its hash and length rather than the text itself
+    so the cache doesn't keep old conversations alive. A conversation is re-counted on every
+    round of every turn, so after the first time only new messages are ever tokenized.
+    """
+
+    def __init__(self, tokenizer_name: str | None = None, max_cached: int = 16384):
+        self.tokenizer_name = tokenizer_name
+        self.max_cached = max_cached
+        self.lock = threading.Lock()
+        self.counts: OrderedDict[tuple[int, int], int] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._tokenizer = None
+        self._loaded = False
+
+    @property
+    def tokenizer(self):
+        if not self._loaded:
+            with self.lock:
+                if not self._loaded and self.tokenizer_name:
+                    try:
+                        from transformers import AutoTokenizer
+
+                        self._tokenizer = AutoTokenizer.from_pretrained(self.tokenizer_name)
+                    except Exception as e:
+                        print(f"Could not load tokenizer {self.tokenizer_name}, estimating tokens instead: {e}")
+                self._loaded = True
+        return self._tokenizer
+
+    def encode(self, text: str) -> list[int]:
+        return self.tokenizer.encode(text, add_special_tokens=False)
+
+    def count(self, text: str) -> int:
+        key = (hash(text), len(text))
+        with self.lock:
+            count = self.counts.get(key)
+            if count is not None:
+                self.counts.move_to_end(key)
+                self.hits += 1
+                return count
+            self.misses += 1
+        if self.tokenizer is not None:
+            count = len(self.encode(text))
+        else:
+            count = -(-len(text.encode("utf-8")) // BYTES_PER_TOKEN)
+        with self.lock:
+            self.counts[key] = count
+            while len(self.counts) > self.max_cached:
+                self.counts.popitem(last=False)
+        return count
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """The start of the text, at most max_tokens long"""
+        if self.tokenizer is not None:
+            return self.tokenizer.decode(self.encode(text)[:max_tokens])
+        data = text.encode("utf-8")[: max_tokens * BYTES_PER_TOKEN]
+        return data.decode("utf-8", errors="ignore")
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "tokenizer": self.tokenizer_name if self._tokenizer is not None else None,
+                "cached_counts": len(self.counts),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+class ContextState:
+    def __init__(self, start: int, summary: str):
+        # Messages before this index aren't sent to the model anymore
+        self.start = start
+        # Summary of the messages that were cut, empty when summarizing is off
+        self.summary = summary
+
+
+class ContextWindow:
+    """
+    Keeps what is sent to the model for each inference under `max_tokens` (tool specs
+    included), without touching the conversation that gets stored. Policies are applied in
+    order, each only when the prompt is still over the budget after the ones before it:
+
+    1. Tool results longer than `max_tool_result_tokens` are truncated, always.
+    2. Tool results from before the last `keep_tool_turns` user turns are replaced by a note.
+    3. The oldest turns are cut, and with `summarize` replaced by a rolling summary message
+       which the next cut folds into a new summary.
+
+    Where a conversation was cut and its summary are kept per conversation (the last
+    `max_conversations` of them), so the start of the prompt only changes when it is cut
+    again, which keeps the backend's prompt cache useful.
+    """
+
+    def __init__(
+        self,
+        max_tokens: int | None,
+        counter: TokenCounter,
+        max_tool_result_tokens: int | None = 2048,
+        keep_tool_turns: int = 2,
+        summarize: bool = True,
+        summary_tokens: int = 512,
+        max_conversations: int = 256,
+    ):
+        self.max_tokens = max_tokens
+        self.counter = counter
+        self.max_tool_result_tokens = max_tool_result_tokens
+        self.keep_tool_turns = keep_tool_turns
+        self.summarize = summarize
+        self.summary_tokens = summary_tokens
+        self.max_conversations = max_conversations
+        self.lock = threading.Lock()
+        self.states: OrderedDict[str, ContextState] = OrderedDict()
+        self.truncated: OrderedDict[tuple[int, int], str] = OrderedDict()
+        self.trimmed = 0
+        self.summaries = 0
+
+    def message_tokens(self, message: dict) -> int:
+        content = message.get("content") or ""
+        if not isinstance(content, str):
+            content = json.dumps(content)
+        tokens = MESSAGE_OVERHEAD + self.counter.count(content)
+        if message.get("tool_calls"):
+            tokens += self.counter.count(json.dumps(message["tool_calls"]))
+        return tokens
+
+    def truncate_result(self, message: dict) -> dict:
+        """Cuts a tool result down to max_tool_result_tokens, other messages are returned as is"""
+        limit = self.max_tool_result_tokens
+        content = message.get("content")
+        if message.get("role") != "tool" or not limit or not isinstance(content, str):
+            return message
+        # Cheap check first, no text has fewer bytes than tokens
+        if len(content.encode("utf-8")) <= limit:
+            return message
+        tokens = self.counter.count(content)
+        if tokens <= limit:
+            return message
+        # Truncating means tokenizing the whole result, only do it once per result
+        key = (hash(content), len(content))
+        with self.lock:
+            truncated = self.truncated.get(key)
+        if truncated is None:
+            truncated = (
+                self.counter.truncate(content, limit)
+                + f"\n[... truncated, {tokens - limit} more tokens not shown]"
+            )
+            with self.lock:
+                self.truncated[key] = truncated
+                while len(self.truncated) > TRUNCATED_CACHE_SIZE:
+                    self.truncated.popitem(last=False)
+        return dict(message, content=truncated)
+
+    def get_state(self, key: str | None, messages: list) -> ContextState | None:
+        if key is None:
+            return None
+        with self.lock:
+            state = self.states.get(key)
+            if state is not None:
+                self.states.move_to_end(key)
+        # A conversation shorter than where it was cut has been cleared and started over
+        if state is not None and state.start > len(messages):
+            self.forget(key)
+            return None
+        return state
+
+    def set_state(self, key: str | None, state: ContextState):
+        if key is None:
+            return
+        with self.lock:
+            self.states[key] = state
+            self.states.move_to_end(key)
+            while len(self.states) > self.max_conversations:
+                self.states.popitem(last=False)
+
+    def forget(self, key: str):
+        with self.lock:
+            self.states.pop(key, None)
+
+    def fit(
+        self, messages: list, tools: list | None = None, state: ContextState | None = None
+    ) -> tuple[list, int | None]:
+        """
+        Builds the messages to send from the conversation and where it was last cut. Also
+        returns the index the conversation has to be cut at now if it doesn't fit, else None.
+        """
+        head = messages[: first_message(messages)]
+        start = state.start if state is not None else len(head)
+        if state is not None and state.summary:
+            head.append(
+                {
+                    "role": "system",
+                    "content": f"Summary of the earlier conversation:\n{state.summary}",
+                }
+            )
+        body = [self.truncate_result(message) for message in messages[start:]]
+        if not self.max_tokens:
+            return head + body, None
+
+        budget = self.max_tokens
+        if tools:
+            budget -= self.counter.count(json.dumps(tools))
+        head_tokens = sum(self.message_tokens(message) for message in head)
+        body_tokens = [self.message_tokens(message) for message in body]
+        if head_tokens + sum(body_tokens) <= budget:
+            return head + body, None
+
+        user_turns = [n for n, message in enumerate(body) if message.get("role") == "user"]
+        if self.keep_tool_turns and len(user_turns) > self.keep_tool_turns:
+            for n in range(user_turns[-self.keep_tool_turns]):
+                if body[n].get("role") == "tool":
+                    body[n] = dict(
+                        body[n],
+                        content=f"[Output of {body[n].get('name', 'the tool')} removed to save space]",
+                    )
+                    body_tokens[n] = self.message_tokens(body[n])
+            if head_tokens + sum(body_tokens) <= budget:
+                return head + body, None
+
+        # Cut at the start of a user turn, so tool calls are never separated from their results
+        target = budget * LOW_WATER - head_tokens
+        if self.summarize and (state is None or not state.summary):
+            target -= self.summary_tokens + MESSAGE_OVERHEAD
+        remaining = [0] * (len(body) + 1)
+        for n in range(len(body) - 1, -1, -1):
+            remaining[n] = remaining[n + 1] + body_tokens[n]
+        cut = next(
+            (n for n in user_turns if n > 0 and remaining[n] <= target),
+            user_turns[-1] if user_turns else 0,
+        )
+        if cut == 0:
+            # Even the current turn alone doesn't fit, send it anyway
+            return head + body, None
+        return head + body[cut:], start + cut
+
+    def summary_batches(self, messages: list) -> list[list[dict]]:
+        """Splits messages to summarize into batches that fit in half the budget each"""
+        limit = (self.max_tokens or 8192) // 2
+        batches = [[]]
+        tokens = 0
+        for message in messages:
+            message = self.truncate_result(message)
+            message_tokens = self.message_tokens(message)
+            if batches[-1] and tokens + message_tokens > limit:
+                batches.append([])
+                tokens = 0
+            batches[-1].append(message)
+            tokens += message_tokens
+        return [batch for batch in batches if batch]
+
+    def summary_request(self, summary: str, messages: list) -> list[dict]:
+        """The messages to ask the model for a new summary with"""
+        lines = []
+        if summary:
+            lines.append(f"Summary of what came before:\n{summary}\n")
+        for message in messages:
+            role = message.get("role")
+            if role == "tool":
+                role = f"tool {message.get('name', '')}".strip()
+            content = message.get("content") or ""
+            if message.get("tool_calls"):
+                calls = ", ".join(
+                    f"{call['function']['name']}({call['function']['arguments']})"
+                    for call in message["tool_calls"]
+                )
+                content = f"{content}\n[called {calls}]".strip()
+            lines.append(f"{role}: {content}")
+        return [
+            {"role": "system", "content": SUMMARY_PROMPT},
+            {"role": "user", "content": "\n".join(lines)},
+        ]
+
+    def clean_summary(self, summary: str | None) -> str:
+        # Reasoning models can put their thinking in the content
+        return (summary or "").split("</think>")[-1].strip()
+
+    def prepare(
+        self,
+        messages: list,
+        key: str | None = None,
+        tools: list | None = None,
+        summarize: Callable[[list], str] | None = None,
+    ) -> list:
+        """
+        The messages to send for the conversation `key`. If it has to be cut, the cut off
+        messages are folded into its summary with `summarize`, which is given the messages to
+        send for a summary and returns the model's reply.
+        """
+        state = self.get_state(key, messages)
+        payload, cut = self.fit(messages, tools, state)
+        if cut is None:
+            return payload
+        summary = state.summary if state is not None else ""
+        if self.summarize and summarize is not None:
+            start = state.start if state is not None else first_message(messages)
+            try:
+                for batch in self.summary_batches(messages[start:cut]):
+                    summary = self.clean_summary(summarize(self.summary_request(summary, batch)))
+                    self.summaries += 1
+            except Exception as e:
+                print(f"Could not summarize the conversation, cutting it without: {e}")
+        return self._cut(messages, key, tools, state, cut, summary)
+
+    async def prepare_async(
+        self,
+        messages: list,
+        key: str | None = None,
+        tools: list | None = None,
+        summarize: Callable[[list], Awaitable[str]] | None = None,
+    ) -> list:
+        """Same as prepare, with a coroutine function to summarize with"""
+        state = self.get_state(key, messages)
+        payload, cut = self.fit(messages, tools, state)
+        if cut is None:
+            return payload
+        summary = state.summary if state is not None else ""
+        if self.summarize and summarize is not None:
+            start = state.start if state is not None else first_message(messages)
+            try:
+                for batch in self.summary_batches(messages[start:cut]):
+                    summary = self.clean_summary(
+                        await summarize(self.summary_request(summary, batch))
+                    )
+                    self.summaries += 1
+            except Exception as e:
+                print(f"Could not summarize the conversation, cutting it without: {e}")
+        return self._cut(messages, key, tools, state, cut, summary)
+
+    def _cut(self, messages, key, tools, state, cut, summary) -> list:
+        self.trimmed += 1
+        state = ContextState(cut, summary)
+        self.set_state(key, state)
+        payload, _ = self.fit(messages, tools, state)
+        return payload
+
+    def stats(self) -> dict:
+        return {
+            "max_tokens": self.max_tokens,
+            "conversations_cut": len(self.states),
+            "cuts": self.trimmed,
+            "summaries": self.summaries,
+            "token_counts": self.counter.stats(),
+        }
+
+
+def create_context_window(options: dict) -> ContextWindow:
+    """Makes a ContextWindow from the `context_window` section of the config"""
+    max_tool_result_tokens = options.get("max_tool_result_tokens", 2048)
+    return ContextWindow(
+        max_tokens=options.get("max_tokens", 16384),
+        counter=TokenCounter(options.get("tokenizer")),
+        max_tool_result_tokens=max_tool_result_tokens and int(max_tool_result_tokens),
+        keep_tool_turns=int(options.get("keep_tool_turns", 2)),
+        summarize=bool(options.get("summarize", True)),
+        summary_tokens=int(options.get("summary_tokens", 512)),
+    )
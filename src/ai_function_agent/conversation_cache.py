@@ -0,0 +1,188 @@
+import atexit
+import json
+import threading
+from collections import OrderedDict
+
+from ai_function_agent.conversation_store import ConversationStore
+
+
+class CachedConversation:
+    def __init__(self, messages: list, size: int):
+        self.messages = messages
+        # Approximate size in bytes, the length of the messages as json
+        self.size = size
+
+
+class ConversationCache:
+    """In-process LRU cache of conversations in front of a ConversationStore.
+
+    Conversations are evicted when there are more than `max_conversations` of them or
+    they take up more than `max_bytes`. Appends land in the cache right away and are
+    written to the store by a background thread every `flush_interval` seconds
+    (write-behind), or straight away if `flush_interval` is 0. Evicting a conversation
+    flushes it first, so the store is never behind for a conversation that isn't cached.
+    """
+
+    def __init__(
+        self,
+        store: ConversationStore,
+        max_conversations: int = 256,
+        max_bytes: int = 64 * 1024 * 1024,
+        flush_interval: float = 1.0,
+    ):
+        self.store = store
+        self.max_conversations = max_conversations
+        self.max_bytes = max_bytes
+        self.flush_interval = flush_interval
+        self.conversations: OrderedDict[str, CachedConversation] = OrderedDict()
+        self.pending: dict[str, list] = {}
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        # Serializes store reads and writes so a miss never reads a half flushed conversation
+        self._io_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._flusher = None
+
+    def get(self, conversation_id: str) -> list | None:
+        """Returns a copy of the conversation's messages, loading it from the store on a miss"""
+        messages = self.get_cached(conversation_id)
+        if messages is not None:
+            return messages
+        with self._io_lock:
+            messages = self.store.load(conversation_id)
+            if messages is None:
+                return None
+            with self._lock:
+                self.misses += 1
+                # Another request may have loaded it while we were waiting for the lock
+                if conversation_id in self.conversations:
+                    return list(self.conversations[conversation_id].messages)
+                self._insert(conversation_id, messages)
+                evicted = self._evict()
+            for evicted_id, evicted_messages in evicted:
+                self.store.append(evicted_id, evicted_messages)
+        return list(messages)
+
+    def get_cached(self, conversation_id: str) -> list | None:
+        """Returns a copy of the conversation's messages only if it's cached"""
+        with self._lock:
+            cached = self.conversations.get(conversation_id)
+            if cached is None:
+                return None
+            self.hits += 1
+            self.conversations.move_to_end(conversation_id)
+            return list(cached.messages)
+
+    def append(self, conversation_id: str, messages: list):
+        # Evicted conversations are written before anyone can miss and reload them
+        with self._io_lock:
+            # Nothing gets inserted without the io lock, so this stays true until we insert
+            with self._lock:
+                cached = self.conversations.get(conversation_id)
+            if cached is None:
+                # A new conversation, or one that was evicted during the turn
+                stored = self.store.load(conversation_id) or []
+            with self._lock:
+                if cached is None:
+                    self._insert(conversation_id, stored + messages)
+                else:
+                    cached.messages.extend(messages)
+                    size = len(json.dumps(messages))
+                    cached.size += size
+                    self.size += size
+                    self.conversations.move_to_end(conversation_id)
+                self.pending.setdefault(conversation_id, []).extend(messages)
+                evicted = self._evict()
+            for evicted_id, evicted_messages in evicted:
+                self.store.append(evicted_id, evicted_messages)
+
+        if self.flush_interval <= 0:
+            self.flush(conversation_id)
+        else:
+            self._start_flusher()
+
+    def _insert(self, conversation_id: str, messages: list):
+        cached = CachedConversation(messages, len(json.dumps(messages)))
+        self.conversations[conversation_id] = cached
+        self.size += cached.size
+
+    def _evict(self) -> list[tuple[str, list]]:
+        """Drops the least recently used conversations until we're under the limits, returns their unsaved messages"""
+        evicted = []
+        # Always keep the most recently used conversation, even if it's over the byte limit alone
+        while len(self.conversations) > 1 and (
+            len(self.conversations) > self.max_conversations
+            or self.size > self.max_bytes
+        ):
+            conversation_id, cached = self.conversations.popitem(last=False)
+            self.size -= cached.size
+            self.evictions += 1
+            pending = self.pending.pop(conversation_id, None)
+            if pending:
+                evicted.append((conversation_id, pending))
+        return evicted
+
+    def flush(self, conversation_id: str = None):
+        """Writes unsaved messages to the store, for one conversation or all of them"""
+        with self._io_lock:
+            with self._lock:
+                if conversation_id is None:
+                    pending = list(self.pending.items())
+                    self.pending.clear()
+                elif conversation_id in self.pending:
+                    pending = [(conversation_id, self.pending.pop(conversation_id))]
+                else:
+                    pending = []
+            for n, (pending_id, messages) in enumerate(pending):
+                try:
+                    self.store.append(pending_id, messages)
+                except Exception:
+                    # Put back what we couldn't write, ahead of anything appended since
+                    with self._lock:
+                        for unsaved_id, unsaved in pending[n:]:
+                            self.pending[unsaved_id] = unsaved + self.pending.get(
+                                unsaved_id, []
+                            )
+                    raise
+
+    def _start_flusher(self):
+        if self._flusher is not None:
+            return
+        with self._lock:
+            if self._flusher is not None:
+                return
+            self._flusher = threading.Thread(
+                target=self._flush_loop, name="conversation-flusher", daemon=True
+            )
+            self._flusher.start()
+            atexit.register(self.close)
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Failed to flush conversations: {e}")
+
+    def close(self):
+        """Stops the flusher and writes everything that's still pending"""
+        self._stop.set()
+        if self._flusher is not None:
+            self._flusher.join()
+        self.flush()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "conversations": len(self.conversations),
+                "bytes": self.size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "pending_conversations": len(self.pending),
+            }
@@ -0,0 +1,371 @@
+import argparse
+import glob
+import json
+import os
+import sqlite3
+import threading
+import weakref
+from collections import OrderedDict
+
+from ai_function_agent.config import config, join_path
+
+# How many conversations the jsonl store remembers having checked for a torn last line
+MAX_CHECKED = 4096
+
+
+class ConversationStore:
+    """Base class for conversation storage backends.
+
+    Conversations are only ever appended to: every turn hands `append` just the messages
+    it added. Appends to the same conversation are serialized with a per-conversation lock.
+    """
+
+    def __init__(self):
+        # A conversation's lock goes away once nobody holds on to it
+        self._locks: weakref.WeakValueDictionary[str, threading.Lock] = (
+            weakref.WeakValueDictionary()
+        )
+        self._locks_lock = threading.Lock()
+
+    def lock(self, conversation_id: str) -> threading.Lock:
+        with self._locks_lock:
+            lock = self._locks.get(conversation_id)
+            if lock is None:
+                lock = self._locks[conversation_id] = threading.Lock()
+            return lock
+
+    def load(self, conversation_id: str) -> list | None:
+        """Returns every message in the conversation, or None if it doesn't exist"""
+        raise NotImplementedError
+
+    def append(self, conversation_id: str, messages: list):
+        raise NotImplementedError
+
+    def conversation_ids(self) -> list[str]:
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+def is_safe_id(conversation_id: str) -> bool:
+    # Conversation ids end up in file names, don't let them point outside the directory
+    return bool(conversation_id) and os.path.basename(conversation_id) == conversation_id
+
+
+class JSONConversationStore(ConversationStore):
+    """The original format, one `<id>.json` file rewritten in full on every turn.
+
+    Kept around to read conversations that haven't been migrated yet.
+    """
+
+    def __init__(self, directory: str):
+        super().__init__()
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def get_path(self, conversation_id: str) -> str:
+        return os.path.join(self.directory, f"{conversation_id}.json")
+
+    def load(self, conversation_id: str) -> list | None:
+        if not is_safe_id(conversation_id):
+            return None
+        file_path = self.get_path(conversation_id)
+        if not os.path.exists(file_path):
+            return None
+        with open(file_path, "r") as f:
+            messages = json.load(f)
+            # Older versions saved the reasoning along with the messages
+            for message in messages:
+                message.pop("reasoning", "")
+            return messages
+
+    def append(self, conversation_id: str, messages: list):
+        with self.lock(conversation_id):
+            all_messages = (self.load(conversation_id) or []) + messages
+            file_path = self.get_path(conversation_id)
+            tmp_path = file_path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(all_messages, f, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, file_path)
+
+    def conversation_ids(self) -> list[str]:
+        file_paths = glob.glob(os.path.join(self.directory, "*.json"))
+        return [os.path.splitext(os.path.basename(path))[0] for path in file_paths]
+
+
+class JSONLConversationStore(ConversationStore):
+    """Append-only log per conversation, `<id>.jsonl`.
+
+    Every append writes one line holding that turn's messages with a single write, then
+    fsyncs it. A crash can only tear the last line, which is skipped when loading and cut
+    off before the next append, so a turn is either saved entirely or not at all.
+
+    Conversations older versions saved as `<id>.json` are converted the first time they're
+    loaded, the old file is left alone.
+    """
+
+    def __init__(self, directory: str):
+        super().__init__()
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.legacy = JSONConversationStore(directory)
+        # Logs we've already checked for a torn last line, the least recently appended to are
+        # forgotten (and checked again next time) past MAX_CHECKED
+        self._checked: OrderedDict[str, None] = OrderedDict()
+        self._checked_lock = threading.Lock()
+
+    def get_path(self, conversation_id: str) -> str:
+        return os.path.join(self.directory, f"{conversation_id}.jsonl")
+
+    def load(self, conversation_id: str) -> list | None:
+        if not is_safe_id(conversation_id):
+            return None
+        file_path = self.get_path(conversation_id)
+        if not os.path.exists(file_path):
+            return self.convert_legacy(conversation_id)
+        messages = []
+        with open(file_path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # Torn write from a crash, that turn was never saved
+                    break
+                messages.extend(json.loads(line))
+        return messages
+
+    def convert_legacy(self, conversation_id: str) -> list | None:
+        """Writes a conversation from its old `<id>.json` file as a log, returns its messages"""
+        messages = self.legacy.load(conversation_id)
+        if messages is None:
+            return None
+        file_path = self.get_path(conversation_id)
+        with self.lock(conversation_id):
+            # Another thread may have converted it while we were reading
+            if not os.path.exists(file_path):
+                tmp_path = file_path + ".tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write((json.dumps(messages) + "\n").encode())
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, file_path)
+                print(f"Converted conversation {conversation_id} to the jsonl store")
+        return self.load(conversation_id)
+
+    def repair(self, file_path: str):
+        """Cuts off a torn last line so the next append starts on a fresh line"""
+        with open(file_path, "rb+") as f:
+            size = f.seek(0, os.SEEK_END)
+            if size == 0:
+                return
+            f.seek(size - 1)
+            if f.read(1) == b"\n":
+                return
+            # Walk back to the end of the last complete line
+            position = size
+            while position > 0:
+                step = min(4096, position)
+                position -= step
+                f.seek(position)
+                end = f.read(step).rfind(b"\n")
+                if end != -1:
+                    f.truncate(position + end + 1)
+                    return
+            f.truncate(0)
+
+    def checked(self, conversation_id: str) -> bool:
+        with self._checked_lock:
+            if conversation_id not in self._checked:
+                return False
+            self._checked.move_to_end(conversation_id)
+            return True
+
+    def set_checked(self, conversation_id: str):
+        with self._checked_lock:
+            self._checked[conversation_id] = None
+            while len(self._checked) > MAX_CHECKED:
+                self._checked.popitem(last=False)
+
+    def append(self, conversation_id: str, messages: list):
+        if not is_safe_id(conversation_id):
+            raise ValueError(f"Invalid conversation id: {conversation_id}")
+        line = (json.dumps(messages) + "\n").encode()
+        file_path = self.get_path(conversation_id)
+        with self.lock(conversation_id):
+            if not self.checked(conversation_id):
+                if os.path.exists(file_path):
+                    self.repair(file_path)
+                self.set_checked(conversation_id)
+            with open(file_path, "ab") as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def conversation_ids(self) -> list[str]:
+        file_paths = glob.glob(os.path.join(self.directory, "*.jsonl"))
+        return [os.path.splitext(os.path.basename(path))[0] for path in file_paths]
+
+
+class SQLiteConversationStore(ConversationStore):
+    """All conversations in one SQLite database in WAL mode, one row per message.
+
+    Appends run in a single transaction so a turn is saved entirely or not at all, and
+    WAL lets readers keep going while a turn is being written.
+
+    Conversations older versions saved as `<id>.json` next to the database are copied into it
+    the first time they're loaded, the old file is left alone.
+    """
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.legacy = JSONConversationStore(os.path.dirname(path))
+        # sqlite3 connections can't be shared between threads, every thread gets its own
+        self._local = threading.local()
+        self._connections: list[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+        self.connect().execute(
+            """
+            CREATE TABLE IF NOT EXISTS messages (
+                conversation_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                message TEXT NOT NULL,
+                PRIMARY KEY (conversation_id, seq)
+            )
+            """
+        )
+
+    def connect(self) -> sqlite3.Connection:
+        db = getattr(self._local, "db", None)
+        if db is None:
+            # Autocommit mode, transactions are started explicitly in _insert. Each connection
+            # is only used by its own thread, but close() may run on any
+            db = sqlite3.connect(
+                self.path, timeout=30, isolation_level=None, check_same_thread=False
+            )
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+            with self._connections_lock:
+                self._connections.append(db)
+        return db
+
+    def load(self, conversation_id: str) -> list | None:
+        rows = (
+            self.connect()
+            .execute(
+                "SELECT message FROM messages WHERE conversation_id = ? ORDER BY seq",
+                (conversation_id,),
+            )
+            .fetchall()
+        )
+        if not rows:
+            return self.convert_legacy(conversation_id)
+        return [json.loads(row[0]) for row in rows]
+
+    def convert_legacy(self, conversation_id: str) -> list | None:
+        """Copies a conversation from its old `<id>.json` file, returns its messages"""
+        messages = self.legacy.load(conversation_id)
+        if messages is None:
+            return None
+        with self.lock(conversation_id):
+            # Only if nobody else (another thread or worker) converted it in the meantime
+            if self._insert(conversation_id, messages, only_new=True):
+                print(f"Converted conversation {conversation_id} to the sqlite store")
+        return self.load(conversation_id)
+
+    def append(self, conversation_id: str, messages: list):
+        with self.lock(conversation_id):
+            self._insert(conversation_id, messages)
+
+    def _insert(self, conversation_id: str, messages: list, only_new: bool = False) -> bool:
+        db = self.connect()
+        # IMMEDIATE takes the write lock up front so other processes can't interleave
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            (seq,) = db.execute(
+                "SELECT COALESCE(MAX(seq), -1) FROM messages WHERE conversation_id = ?",
+                (conversation_id,),
+            ).fetchone()
+            if only_new and seq != -1:
+                db.execute("ROLLBACK")
+                return False
+            db.executemany(
+                "INSERT INTO messages (conversation_id, seq, message) VALUES (?, ?, ?)",
+                [
+                    (conversation_id, seq + n + 1, json.dumps(message))
+                    for n, message in enumerate(messages)
+                ],
+            )
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        return True
+
+    def conversation_ids(self) -> list[str]:
+        rows = self.connect().execute(
+            "SELECT DISTINCT conversation_id FROM messages"
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def close(self):
+        """Closes the connection of every thread that used the store"""
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for db in connections:
+            db.close()
+        self._local = threading.local()
+
+
+def create_conversation_store(kind: str, directory: str) -> ConversationStore:
+    if kind == "jsonl":
+        return JSONLConversationStore(directory)
+    if kind == "sqlite":
+        return SQLiteConversationStore(os.path.join(directory, "conversations.db"))
+    if kind == "json":
+        return JSONConversationStore(directory)
+    raise ValueError(f"Unknown conversation store: {kind}")
+
+
+def migrate_conversations(
+    source: ConversationStore, target: ConversationStore, delete: bool = False
+) -> int:
+    """Copies every conversation in `source` that `target` doesn't have yet, returns how many were copied"""
+    migrated = 0
+    # Not target.load, which would convert the conversation itself
+    existing = set(target.conversation_ids())
+    for conversation_id in source.conversation_ids():
+        if conversation_id in existing:
+            continue
+        messages = source.load(conversation_id)
+        target.append(conversation_id, messages)
+        migrated += 1
+        if delete and isinstance(source, JSONConversationStore):
+            os.remove(source.get_path(conversation_id))
+    return migrated
+
+
+def migrate():
+    """Entry point for `ai-migrate-conversations`, moves old `<id>.json` conversations to the configured store"""
+    kind = config.get("conversation_store", "jsonl")
+
+    parser = argparse.ArgumentParser(description=migrate.__doc__)
+    parser.add_argument("--to", choices=["jsonl", "sqlite"], default=kind)
+    parser.add_argument("--dir", default=join_path("conversations"))
+    parser.add_argument(
+        "--delete", action="store_true", help="Delete the .json files once migrated"
+    )
+    args = parser.parse_args()
+
+    source = JSONConversationStore(args.dir)
+    target = create_conversation_store(args.to, args.dir)
+    migrated = migrate_conversations(source, target, delete=args.delete)
+    target.close()
+    print(f"Migrated {migrated} conversations to the {args.to} store in {args.dir}")
+
+
+if __name__ == "__main__":
+    migrate()
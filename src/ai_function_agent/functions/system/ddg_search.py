@@ -1,23 +1,30 @@
-import json
-
-searcher = None
-
 try:
     from duckduckgo_search import DDGS
-    searcher = DDGS()
 except ImportError:
+    DDGS = None
     print("No module named 'duckduckgo_search' found")
 
 
 def ddg_search(query: str, results: int = 3) -> list[dict]:
-    if searcher is not None:
-        text = searcher.text(query, max_results=results)
-        return text
-    else:
+    if DDGS is None:
         return "Cannot load the duckduckgo search module!"
+    # Plain functions run on the tool worker threads, so the search doesn't block the event
+    # loop. A DDGS session isn't thread safe, so every call gets its own
+    with DDGS() as searcher:
+        return searcher.text(query, max_results=results)
+
+
+def search_cache_key(query: str, results: int = 3) -> list:
+    return [" ".join(query.lower().split()), results]
 
 
 function = ddg_search
+function_options = {
+    "ddg_search": {
+        "cache": {"ttl": 3600, "max_size": 256, "key": "search_cache_key"},
+        "side_effect_free": True,
+    }
+}
 function_spec = {
     "type": "function",
     "function": {
@@ -1,16 +1,37 @@
-import requests
-import json
+from ai_function_agent.tool_http import http_client
 
+API_URL = "https://api.open-meteo.com/v1/forecast"
 
-def get_weather(latitude: str, longitude: str) -> dict:
-    response = requests.get(f"https://api.open-meteo.com/v1/forecast?latitude={latitude}&longitude={longitude}&current=temperature_2m,wind_speed_10m&hourly=temperature_2m,relative_humidity_2m,wind_speed_10m,weather_code")
-    data = response.json()
-    current = data["current"]
+
+async def get_weather(latitude: str, longitude: str) -> str:
+    response = await http_client.get(
+        API_URL,
+        params={
+            "latitude": latitude,
+            "longitude": longitude,
+            "current": "temperature_2m,wind_speed_10m",
+        },
+    )
+    # Errors are passed on to the model by the executor, and not cached
+    response.raise_for_status()
+    current = response.json()["current"]
     pairs = [f"{k}: {v}" for k, v in current.items()]
     return "\n".join(pairs)
 
 
+def weather_cache_key(latitude: str, longitude: str) -> list[float]:
+    # Two decimals is about a kilometre, close enough to be the same weather
+    return [round(float(latitude), 2), round(float(longitude), 2)]
+
+
 function = get_weather
+# open-meteo updates the current weather every 15 minutes
+function_options = {
+    "get_weather": {
+        "cache": {"ttl": 600, "max_size": 256, "key": "weather_cache_key"},
+        "side_effect_free": True,
+    }
+}
 function_spec = {
     "type": "function",
     "function": {
@@ -26,3 +47,9 @@ function_spec = {
         },
     },
 }
+
+
+if __name__ == "__main__":
+    import asyncio
+
+    print(asyncio.run(get_weather("43.65", "-79.38")))
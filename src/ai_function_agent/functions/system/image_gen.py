@@ -1,29 +1,31 @@
+import gc
+import json
 import os
 import random
 import time
 
-import numpy as np
-import torch
-from diffusers import Lumina2Text2ImgPipeline
+from ai_function_agent.image_jobs import ImageJobQueue, StandInPipeline
+from ai_function_agent.config import config, join_path
 
-from ai_function_agent.tool_calling import join_path
+image_config = config.get("image_gen", {})
 
 
-# Where to load the model
-if torch.cuda.is_available():
-    device = "cuda"
-    torch_dtype = torch.bfloat16
-else:
-    device = "cpu"
-    torch_dtype = torch.float32
+def load_pipeline():
+    # "stand_in" swaps the model for a tiny CPU pipeline, for trying the queue without a GPU
+    if image_config.get("pipeline") == "stand_in":
+        return StandInPipeline(delay=float(image_config.get("stand_in_delay", 0.0)))
 
+    import torch
+    from diffusers import Lumina2Text2ImgPipeline
 
-def gen_image(prompt: str, width: int = 512, height: int = 512, open: bool = True) -> str:
+    # Where to load the model
+    if torch.cuda.is_available():
+        device = "cuda"
+        torch_dtype = torch.bfloat16
+    else:
+        device = "cpu"
+        torch_dtype = torch.float32
 
-    # Clamp H and W to 1024 (subject to change)
-    height = min(height, 1024)
-    width = min(width, 1024)
-    print("Loading image generation model...")
     pipe = Lumina2Text2ImgPipeline.from_pretrained(
         "Alpha-VLLM/Lumina-Image-2.0", torch_dtype=torch_dtype
     )
@@ -33,62 +35,134 @@ def gen_image(prompt: str, width: int = 512, height: int = 512, open: bool = Tru
     pipe.enable_vae_slicing()
     pipe.enable_vae_tiling()
     pipe.enable_model_cpu_offload()
+    return pipe
+
+
+def release_memory():
+    # The queue already dropped the pipeline, collect it and give its VRAM back
+    gc.collect()
+    if image_config.get("pipeline") != "stand_in":
+        import torch
 
-    # Randomize the seed
-    MAX_SEED = np.iinfo(np.int32).max
-    seed = random.randint(0, MAX_SEED)
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
 
-    # Generate the image
-    image = pipe(
-        prompt,
-        height=height,
-        width=width,
+
+def generate(pipe, jobs) -> list[str]:
+    """Generates one image per job in a single pipeline call, the jobs all have the same size"""
+    kwargs = {}
+    if not isinstance(pipe, StandInPipeline):
+        import numpy as np
+        import torch
+
+        # Randomize the seed of every image
+        MAX_SEED = np.iinfo(np.int32).max
+        kwargs["generator"] = [
+            torch.Generator().manual_seed(random.randint(0, MAX_SEED)) for _ in jobs
+        ]
+
+    # Generate the images
+    images = pipe(
+        [job.prompt for job in jobs],
+        height=jobs[0].height,
+        width=jobs[0].width,
         guidance_scale=4.0,
         num_inference_steps=50,
         cfg_trunc_ratio=0.25,
         cfg_normalization=True,
-        generator=torch.Generator().manual_seed(seed),
-    ).images[0]
+        **kwargs,
+    ).images
 
     os.makedirs(join_path("images"), exist_ok=True)
-    f_name = join_path(f"images/image_{int(time.time())}.png")
-
-    image.save(f_name)
-
-    if open:
-        image.show()
-    return f"Image created at path: {f_name}"
-
-
-function = gen_image
-function_spec = {
-    "type": "function",
-    "function": {
-        "name": "gen_image",
-        "description": "Generates an image when requested by the user. If they did not specify a prompt, you MUST ask them for one before using this.",
-        "parameters": {
-            "type": "object",
-            "properties": {
-                "prompt": {
-                    "type": "string",
-                    "description": "The user's prompt for the image generation model",
+    paths = []
+    for job, image in zip(jobs, images):
+        f_name = join_path(f"images/image_{int(time.time())}_{job.id}.png")
+        image.save(f_name)
+        if job.show:
+            image.show()
+        paths.append(f_name)
+    return paths
+
+
+# The pipeline stays loaded between jobs and is unloaded after idle_timeout seconds without any
+image_jobs = ImageJobQueue(
+    load_pipeline,
+    generate,
+    release_memory,
+    idle_timeout=float(image_config.get("idle_timeout", 300)),
+    max_batch_size=int(image_config.get("max_batch_size", 4)),
+    batch_wait=float(image_config.get("batch_wait", 0.25)),
+)
+
+
+def gen_image(prompt: str, width: int = 512, height: int = 512, open: bool = True) -> str:
+    # Clamp H and W to 1024 (subject to change)
+    height = min(height, 1024)
+    width = min(width, 1024)
+    job = image_jobs.submit(prompt, width, height, show=open)
+    return (
+        f"Image generation job {job.id} has been queued. Images take a while to generate, "
+        "use check_image_job with this job id to see when it's done."
+    )
+
+
+def check_image_job(job_id: str) -> str:
+    job = image_jobs.get(job_id)
+    if job is None:
+        return json.dumps({"error": f"There is no image generation job with the id {job_id}"})
+    return json.dumps(job.to_dict())
+
+
+function = [gen_image, check_image_job]
+function_spec = [
+    {
+        "type": "function",
+        "function": {
+            "name": "gen_image",
+            "description": "Generates an image when requested by the user. If they did not specify a prompt, you MUST ask them for one before using this. Returns a job id to check on with check_image_job.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "prompt": {
+                        "type": "string",
+                        "description": "The user's prompt for the image generation model",
+                    },
+                    "width": {
+                        "type": "number",
+                        "description": "The user defined width of the image (or 512 if not specified)",
+                    },
+                    "height": {
+                        "type": "number",
+                        "description": "The user defined height of the image (or 512 if not specified)",
+                    }
                 },
-                "width": {
-                    "type": "number",
-                    "description": "The user defined width of the image (or 512 if not specified)",
+                "required": ["prompt"],
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "check_image_job",
+            "description": "Checks on an image generation job started with gen_image. Returns its status and, once it's done, the path of the image.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "job_id": {
+                        "type": "string",
+                        "description": "The job id gen_image returned",
+                    },
                 },
-                "height": {
-                    "type": "number",
-                    "description": "The user defined height of the image (or 512 if not specified)",
-                }
+                "required": ["job_id"],
             },
-            "required": ["prompt"],
         },
     },
-}
+]
 
 
 if __name__ == "__main__":
     while True:
         prompt = input("Image Generation Prompt: ")
-        gen_image(prompt)
+        job = image_jobs.submit(prompt, 512, 512, show=True)
+        job.wait()
+        print(json.dumps(job.to_dict(), indent=2))
@@ -0,0 +1,195 @@
+import hashlib
+import threading
+import time
+import uuid
+from typing import Callable
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class ImageJob:
+    def __init__(self, prompt: str, width: int, height: int, show: bool = False):
+        self.id = uuid.uuid4().hex[:12]
+        self.prompt = prompt
+        self.width = width
+        self.height = height
+        self.show = show
+        self.status = QUEUED
+        self.path = None
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        self._done = threading.Event()
+
+    def finish(self, path: str = None, error: str = None):
+        self.path = path
+        self.error = error
+        self.status = FAILED if error else DONE
+        self.finished = time.time()
+        self._done.set()
+
+    def wait(self, timeout: float = None) -> bool:
+        return self._done.wait(timeout)
+
+    def to_dict(self) -> dict:
+        data = {"job_id": self.id, "status": self.status, "prompt": self.prompt}
+        if self.path:
+            data["path"] = self.path
+        if self.error:
+            data["error"] = self.error
+        return data
+
+
+class ImageJobQueue:
+    """
+    Runs image generation jobs on one worker thread that keeps the pipeline loaded between jobs.
+
+    Queued jobs with the same size are generated together in one pipeline call, up to
+    `max_batch_size` of them. After the first job of a batch arrives the worker waits up to
+    `batch_wait` seconds for more. When no jobs have come in for `idle_timeout` seconds the
+    pipeline is unloaded to give the memory back.
+
+    `load_pipeline()` returns the pipeline, `generate(pipe, jobs)` returns a saved image path
+    per job and `release_memory()` frees whatever the pipeline was holding on to, once the
+    queue has dropped its reference to it.
+    """
+
+    def __init__(
+        self,
+        load_pipeline: Callable,
+        generate: Callable,
+        release_memory: Callable = None,
+        idle_timeout: float = 300,
+        max_batch_size: int = 4,
+        batch_wait: float = 0.25,
+        job_ttl: float = 3600,
+    ):
+        self.load_pipeline = load_pipeline
+        self.generate = generate
+        self.release_memory = release_memory
+        self.idle_timeout = idle_timeout
+        self.max_batch_size = max_batch_size
+        self.batch_wait = batch_wait
+        # Finished jobs are kept this long so they can still be polled
+        self.job_ttl = job_ttl
+        self.pipe = None
+        self.jobs: dict[str, ImageJob] = {}
+        self.pending: list[ImageJob] = []
+        self.batches = 0
+        self.loads = 0
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def submit(self, prompt: str, width: int, height: int, show: bool = False) -> ImageJob:
+        job = ImageJob(prompt, width, height, show)
+        with self._condition:
+            self._expire_jobs()
+            self.jobs[job.id] = job
+            self.pending.append(job)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="image-jobs", daemon=True)
+                self._thread.start()
+            self._condition.notify()
+        return job
+
+    def get(self, job_id: str) -> ImageJob | None:
+        with self._condition:
+            return self.jobs.get(job_id)
+
+    def _expire_jobs(self):
+        cutoff = time.time() - self.job_ttl
+        for job_id in [
+            job_id
+            for job_id, job in self.jobs.items()
+            if job.finished is not None and job.finished < cutoff
+        ]:
+            del self.jobs[job_id]
+
+    def _next_batch(self) -> list[ImageJob]:
+        """Waits for a job, then takes it and up to max_batch_size - 1 more of the same size"""
+        with self._condition:
+            while not self.pending:
+                if not self._condition.wait(self.idle_timeout) and not self.pending:
+                    self._unload()
+            first = self.pending[0]
+            deadline = time.monotonic() + self.batch_wait
+            while True:
+                batch = [
+                    job
+                    for job in self.pending
+                    if (job.width, job.height) == (first.width, first.height)
+                ][: self.max_batch_size]
+                remaining = deadline - time.monotonic()
+                if len(batch) >= self.max_batch_size or remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            for job in batch:
+                self.pending.remove(job)
+                job.status = RUNNING
+            return batch
+
+    def _unload(self):
+        if self.pipe is not None:
+            print("Unloading image generation model after being idle...")
+            # Nothing may hold on to the pipeline anymore or its memory can't be freed
+            self.pipe = None
+            if self.release_memory is not None:
+                self.release_memory()
+
+    def _loop(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                if self.pipe is None:
+                    print("Loading image generation model...")
+                    self.pipe = self.load_pipeline()
+                    self.loads += 1
+                paths = self.generate(self.pipe, batch)
+            except Exception as e:
+                for job in batch:
+                    job.finish(error=str(e))
+                continue
+            self.batches += 1
+            for job, path in zip(batch, paths):
+                job.finish(path=path)
+
+    def stats(self) -> dict:
+        with self._condition:
+            return {
+                "pending": len(self.pending),
+                "jobs": len(self.jobs),
+                "batches": self.batches,
+                "loads": self.loads,
+                "loaded": self.pipe is not None,
+            }
+
+
+class StandInOutput:
+    def __init__(self, images: list):
+        self.images = images
+
+
+class StandInPipeline:
+    """
+    A tiny CPU pipeline with the same call signature as the diffusers pipelines, for running
+    the job queue without a GPU or the real model. Each image is a flat colour picked from
+    the prompt, after sleeping `delay` seconds per call to stand in for denoising.
+    """
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.calls = []
+
+    def __call__(self, prompt: list[str], height: int, width: int, **kwargs) -> StandInOutput:
+        from PIL import Image
+
+        self.calls.append(len(prompt))
+        time.sleep(self.delay)
+        images = []
+        for text in prompt:
+            color = tuple(hashlib.sha256(text.encode()).digest()[:3])
+            images.append(Image.new("RGB", (width, height), color))
+        return StandInOutput(images)
@@ -0,0 +1,136 @@
+import asyncio
+import time
+import uuid
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional
+
+
+class TooManyJobsError(Exception):
+    pass
+
+
+class Job:
+    """A turn running in the background, see JobManager"""
+
+    def __init__(self, prompt: str, conversation_id: str):
+        self.id = str(uuid.uuid4())
+        self.prompt = prompt
+        self.conversation_id = conversation_id
+        # queued, running, done, failed or cancelled
+        self.status = "queued"
+        # Messages added by the turn so far, the same ones /prompt answers with
+        self.new_messages: list[dict] = []
+        self.error: Optional[str] = None
+        self.created = time.time()
+        self.finished: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+
+    @property
+    def done(self) -> bool:
+        return self.finished is not None
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "conversation_id": self.conversation_id,
+            "new_messages": list(self.new_messages),
+            "error": self.error,
+            "created": self.created,
+            "finished": self.finished,
+        }
+
+
+class JobManager:
+    """
+    Runs turns as background tasks so a long turn (several tool rounds, image generation)
+    doesn't depend on the client keeping its connection open. Jobs are polled by id and can be
+    cancelled. Finished jobs are kept `ttl` seconds for their result to be picked up, and at
+    most `max_jobs` are kept at all, dropping the oldest finished ones first. Only used from
+    the event loop.
+    """
+
+    def __init__(self, ttl: float = 3600, max_jobs: int = 1000):
+        self.ttl = ttl
+        self.max_jobs = max_jobs
+        self.jobs: OrderedDict[str, Job] = OrderedDict()
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+
+    def submit(
+        self,
+        prompt: str,
+        conversation_id: str,
+        run: Callable[[Job], Awaitable[None]],
+    ) -> Job:
+        """Starts `run(job)` as a background task, raises TooManyJobsError if there's no room"""
+        self.expire()
+        if len(self.jobs) >= self.max_jobs:
+            for finished in [job for job in self.jobs.values() if job.done]:
+                del self.jobs[finished.id]
+                if len(self.jobs) < self.max_jobs:
+                    break
+        if len(self.jobs) >= self.max_jobs:
+            raise TooManyJobsError(f"There are already {len(self.jobs)} jobs running")
+        job = Job(prompt, conversation_id)
+        self.jobs[job.id] = job
+        job.task = asyncio.get_running_loop().create_task(self._run(job, run))
+        job.task.add_done_callback(lambda task: self._cancelled_early(job))
+        return job
+
+    async def _run(self, job: Job, run: Callable[[Job], Awaitable[None]]):
+        try:
+            await run(job)
+            job.status = "done"
+            self.completed += 1
+        except asyncio.CancelledError:
+            job.status = "cancelled"
+            self.cancelled += 1
+        except Exception as e:
+            print(f"Job {job.id} failed: {e!r}")
+            job.status = "failed"
+            job.error = str(e)
+            self.failed += 1
+        finally:
+            job.finished = time.time()
+
+    def _cancelled_early(self, job: Job):
+        # A task cancelled before it ever ran never gets to the handlers in _run
+        if not job.done:
+            job.status = "cancelled"
+            job.finished = time.time()
+            self.cancelled += 1
+
+    def get(self, job_id: str) -> Optional[Job]:
+        self.expire()
+        return self.jobs.get(job_id)
+
+    async def cancel(self, job_id: str) -> Optional[Job]:
+        """Cancels the job if it's still queued or running, the turn it was running isn't saved"""
+        job = self.get(job_id)
+        if job is not None and not job.done:
+            job.task.cancel()
+            await asyncio.wait({job.task})
+        return job
+
+    def expire(self):
+        expired = time.time() - self.ttl
+        for job in [job for job in self.jobs.values() if job.done and job.finished < expired]:
+            del self.jobs[job.id]
+
+    async def shutdown(self):
+        tasks = [job.task for job in self.jobs.values() if not job.done]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> dict:
+        active = sum(not job.done for job in self.jobs.values())
+        return {
+            "active": active,
+            "retained": len(self.jobs) - active,
+            "completed": self.completed,
+            "failed": self.failed,
+            "cancelled": self.cancelled,
+        }
@@ -0,0 +1,88 @@
+import itertools
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable
+
+# Queued queries are embedded before queued documents so a bulk import doesn't stall recalls
+QUERY_PRIORITY = 0
+DOCUMENT_PRIORITY = 1
+
+
+class MicroBatcher:
+    """
+    Collects texts from every caller for up to `max_wait` seconds or `max_batch_size`
+    texts, then hands them to `process_batch` in one go on a single worker thread.
+    Each caller gets back just the results for its own texts.
+    """
+
+    def __init__(
+        self,
+        process_batch: Callable[[list[str]], list],
+        max_batch_size: int = 32,
+        max_wait: float = 0.005,
+    ):
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.queue = queue.PriorityQueue()
+        # Keeps texts with the same priority in the order they were submitted
+        self.counter = itertools.count()
+        self.batches = 0
+        self.texts = 0
+        self._thread = None
+        self._thread_lock = threading.Lock()
+
+    def submit(self, texts: list[str], priority: int = DOCUMENT_PRIORITY) -> list[Future]:
+        self._start()
+        futures = []
+        for text in texts:
+            future = Future()
+            self.queue.put((priority, next(self.counter), text, future))
+            futures.append(future)
+        return futures
+
+    def run(self, texts: list[str], priority: int = DOCUMENT_PRIORITY) -> list:
+        """Submits the texts and waits for their results"""
+        return [future.result() for future in self.submit(texts, priority)]
+
+    def _start(self):
+        if self._thread is not None:
+            return
+        with self._thread_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._loop, name="memory-batcher", daemon=True
+                )
+                self._thread.start()
+
+    def _next_batch(self) -> list[tuple]:
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    batch.append(self.queue.get(timeout=remaining))
+                else:
+                    # Out of time, but take whatever is already waiting
+                    batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._next_batch()
+            texts = [text for _, _, text, _ in batch]
+            try:
+                results = self.process_batch(texts)
+            except Exception as e:
+                for _, _, _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            self.texts += len(texts)
+            for (_, _, _, future), result in zip(batch, results):
+                future.set_result(result)
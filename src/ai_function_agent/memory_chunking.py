@@ -0,0 +1,49 @@
+from typing import Callable, Iterator, TextIO
+
+# Characters read from a document at a time, so huge files are never tokenized in one go
+READ_SIZE = 64 * 1024
+
+
+def split_block(text: str) -> tuple[str, str]:
+    """Splits off everything after the last whitespace so a word never straddles two blocks"""
+    cut = max(text.rfind(" "), text.rfind("\n"), text.rfind("\t"))
+    if cut <= 0:
+        return text, ""
+    return text[:cut], text[cut:]
+
+
+def iter_chunks(
+    fp: TextIO,
+    encode: Callable[[str], list[int]],
+    decode: Callable[[list[int]], str],
+    chunk_tokens: int,
+    overlap: int,
+    read_size: int = READ_SIZE,
+) -> Iterator[str]:
+    """
+    Yields the text of a document in windows of `chunk_tokens` tokens, each window sharing
+    `overlap` tokens with the one before it. Only a window's worth of tokens is kept around.
+    """
+    if not 0 <= overlap < chunk_tokens:
+        raise ValueError("The chunk overlap must be smaller than the chunk size")
+    step = chunk_tokens - overlap
+    tokens = []
+    carry = ""
+    emitted = False
+    while True:
+        block = fp.read(read_size)
+        if block:
+            text, carry = split_block(carry + block)
+        else:
+            text, carry = carry, ""
+        if text:
+            tokens += encode(text)
+        while len(tokens) >= chunk_tokens:
+            yield decode(tokens[:chunk_tokens])
+            tokens = tokens[step:]
+            emitted = True
+        if not block:
+            break
+    # Whatever's left, unless it's only the overlap that's already in the last chunk
+    if tokens and (not emitted or len(tokens) > overlap):
+        yield decode(tokens)
@@ -0,0 +1,185 @@
+import glob
+import json
+import mmap
+import os
+import threading
+from collections import OrderedDict
+
+from ai_function_agent.memory_index import fsync_path
+
+
+class DocumentStore:
+    """
+    The text of every memory in one append-only data file, read back through a memory map
+    with an LRU of recently read documents in front, instead of opening a file per memory.
+
+    `documents.jsonl` lists where each document starts and how long it is. The text is
+    written before its entry, so a crash can only ever leave unreferenced bytes behind.
+    Removing or replacing a document just appends a new entry.
+
+    `compact` (run whenever the memory index is compacted) rewrites both files with only the
+    live documents. The text goes to a new data file, then a new entry list naming that file
+    on its first line is renamed over the old one, so a crash leaves either the old pair or
+    the new one. Data files nothing points to are deleted when the store is opened.
+    """
+
+    def __init__(self, directory: str, max_cached: int = 1024):
+        self.directory = directory
+        self.data_path = os.path.join(directory, "documents.dat")
+        self.entries_path = os.path.join(directory, "documents.jsonl")
+        self.max_cached = max_cached
+        self.lock = threading.Lock()
+        self.entries: dict[str, tuple[int, int]] = {}
+        self.cache: OrderedDict[str, str] = OrderedDict()
+        # Document lines in the entry list, beyond one per document they're garbage
+        self.entry_lines = 0
+        self._map = None
+        os.makedirs(directory, exist_ok=True)
+
+        if os.path.isfile(self.entries_path):
+            valid_length = 0
+            with open(self.entries_path, "rb") as fp:
+                for line in fp:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Torn last line from a crash mid append, the document never got stored
+                        break
+                    valid_length += len(line)
+                    if "data_file" in entry:
+                        # Written by compact, the data file the entries point into
+                        self.data_path = os.path.join(directory, entry["data_file"])
+                        continue
+                    self.entry_lines += 1
+                    if entry.get("removed"):
+                        self.entries.pop(entry["name"], None)
+                    else:
+                        self.entries[entry["name"]] = (entry["offset"], entry["length"])
+            if valid_length != os.path.getsize(self.entries_path):
+                with open(self.entries_path, "r+b") as fp:
+                    fp.truncate(valid_length)
+        # Left behind by a crash during compact, or by one right after it
+        for path in glob.glob(os.path.join(directory, "documents*.dat")) + glob.glob(
+            os.path.join(directory, "*.tmp")
+        ):
+            if os.path.abspath(path) != os.path.abspath(self.data_path):
+                os.remove(path)
+        self.data_file = open(self.data_path, "a+b")
+        self.data_file.seek(0, os.SEEK_END)
+        self.entries_file = open(self.entries_path, "a", encoding="utf-8")
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.entries
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def _write_entry(self, entry: dict):
+        self.entries_file.write(json.dumps(entry) + "\n")
+        self.entries_file.flush()
+        os.fsync(self.entries_file.fileno())
+        self.entry_lines += 1
+
+    def add(self, name: str, text: str):
+        self.add_many([(name, text)])
+
+    def add_many(self, documents: list[tuple[str, str]]):
+        """Stores (name, text) pairs with one sync of each file for all of them"""
+        with self.lock:
+            entries = []
+            for name, text in documents:
+                data = text.encode("utf-8")
+                entries.append({"name": name, "offset": self.data_file.tell(), "length": len(data)})
+                self.data_file.write(data)
+            self.data_file.flush()
+            os.fsync(self.data_file.fileno())
+            self.entries_file.write("".join(json.dumps(entry) + "\n" for entry in entries))
+            self.entries_file.flush()
+            os.fsync(self.entries_file.fileno())
+            self.entry_lines += len(entries)
+            for entry in entries:
+                self.entries[entry["name"]] = (entry["offset"], entry["length"])
+                self.cache.pop(entry["name"], None)
+
+    def remove(self, name: str):
+        with self.lock:
+            if name not in self.entries:
+                return
+            self._write_entry({"name": name, "removed": True})
+            del self.entries[name]
+            self.cache.pop(name, None)
+
+    def get(self, name: str) -> str | None:
+        with self.lock:
+            text = self.cache.get(name)
+            if text is not None:
+                self.cache.move_to_end(name)
+                return text
+            entry = self.entries.get(name)
+            if entry is None:
+                return None
+            offset, length = entry
+            if length == 0:
+                return ""
+            # The map only covers the file as it was when it was made, remap once it has grown
+            if self._map is None or offset + length > len(self._map):
+                if self._map is not None:
+                    self._map.close()
+                self._map = mmap.mmap(self.data_file.fileno(), 0, access=mmap.ACCESS_READ)
+            text = self._map[offset : offset + length].decode("utf-8")
+            self.cache[name] = text
+            while len(self.cache) > self.max_cached:
+                self.cache.popitem(last=False)
+            return text
+
+    def compact(self):
+        """Rewrites the data file and the entry list with only the live documents"""
+        with self.lock:
+            live_bytes = sum(length for _, length in self.entries.values())
+            self.data_file.seek(0, os.SEEK_END)
+            if self.data_file.tell() == live_bytes and self.entry_lines == len(self.entries):
+                return
+
+            # documents.dat, then documents.1.dat, documents.2.dat...
+            name = os.path.basename(self.data_path)
+            generation = int(name.split(".")[1]) + 1 if name.count(".") == 2 else 1
+            data_name = f"documents.{generation}.dat"
+            data_path = os.path.join(self.directory, data_name)
+            entries = {}
+            with open(data_path, "wb") as fp:
+                for name, (offset, length) in self.entries.items():
+                    self.data_file.seek(offset)
+                    entries[name] = (fp.tell(), length)
+                    fp.write(self.data_file.read(length))
+                fp.flush()
+                os.fsync(fp.fileno())
+            with open(self.entries_path + ".tmp", "w", encoding="utf-8") as fp:
+                fp.write(json.dumps({"data_file": data_name}) + "\n")
+                for name, (offset, length) in entries.items():
+                    fp.write(json.dumps({"name": name, "offset": offset, "length": length}) + "\n")
+                fp.flush()
+                os.fsync(fp.fileno())
+
+            if self._map is not None:
+                self._map.close()
+                self._map = None
+            self.data_file.close()
+            self.entries_file.close()
+            os.replace(self.entries_path + ".tmp", self.entries_path)
+            fsync_path(self.directory)
+            # Only the new entry list points to the new file, the old one can go
+            os.remove(self.data_path)
+            self.data_path = data_path
+            self.entries = entries
+            self.entry_lines = len(entries)
+            self.data_file = open(self.data_path, "a+b")
+            self.data_file.seek(0, os.SEEK_END)
+            self.entries_file = open(self.entries_path, "a", encoding="utf-8")
+
+    def close(self):
+        with self.lock:
+            if self._map is not None:
+                self._map.close()
+                self._map = None
+            self.data_file.close()
+            self.entries_file.close()
@@ -0,0 +1,206 @@
+import hashlib
+import os
+import threading
+import unicodedata
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+
+# Keys are sha256 digests, stored back to back in the key file in row order
+KEY_SIZE = 32
+
+
+def normalize_text(text: str) -> str:
+    """Texts that only differ in unicode form or whitespace embed the same way"""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+@contextmanager
+def file_lock(fp):
+    """Holds an exclusive lock on the open file, other processes wait for it"""
+    if os.name == "nt":
+        import msvcrt
+
+        fp.seek(0)
+        msvcrt.locking(fp.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            fp.seek(0)
+            msvcrt.locking(fp.fileno(), msvcrt.LK_UNLCK, 1)
+    else:
+        import fcntl
+
+        fcntl.flock(fp.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fp.fileno(), fcntl.LOCK_UN)
+
+
+class EmbeddingCache:
+    """
+    Remembers the vector for every text the engine has embedded, so re-indexing a file,
+    re-creating an identical memory or repeating a query skips the model entirely.
+
+    Vectors live in a memory-mapped float32 file, one row each, and the key file lists the
+    key of each row. A vector is written before its key, so a crash can only ever lose the
+    last entry, never point a key at the wrong row. Recently used vectors are also kept in
+    an LRU so hot queries don't touch the file at all.
+
+    Several processes (server workers) can share the directory. Appends hold a lock on the
+    `lock` file and take their rows from the size of the key file, and keys other processes
+    appended are picked up on a miss.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        model_name: str,
+        ndim: int = 768,
+        max_cached: int = 4096,
+        initial_capacity: int = 1024,
+    ):
+        self.model_name = model_name
+        self.ndim = ndim
+        self.max_cached = max_cached
+        self.vectors_path = os.path.join(directory, "vectors.f32")
+        self.keys_path = os.path.join(directory, "keys.bin")
+        self.lock = threading.Lock()
+        self.lru: OrderedDict[bytes, np.ndarray] = OrderedDict()
+        self.rows: dict[bytes, int] = {}
+        # How much of the key file has been read into rows
+        self.keys_read = 0
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+        self.lock_file = open(os.path.join(directory, "lock"), "a+b")
+
+        with file_lock(self.lock_file):
+            if os.path.isfile(self.keys_path):
+                # Nobody is appending while we hold the lock, so a partly written key is left
+                # over from a crash
+                size = os.path.getsize(self.keys_path)
+                if size % KEY_SIZE:
+                    with open(self.keys_path, "r+b") as fp:
+                        fp.truncate(size - size % KEY_SIZE)
+            self.keys_file = open(self.keys_path, "ab")
+            self._read_new_keys()
+
+            existing = 0
+            if os.path.isfile(self.vectors_path):
+                existing = os.path.getsize(self.vectors_path) // (ndim * 4)
+            self.capacity = max(initial_capacity, existing, len(self.rows))
+            self.vectors = self._open(self.capacity)
+
+    def _open(self, capacity: int) -> np.memmap:
+        """Maps the vector file, growing it to `capacity` rows first, only with the file lock held"""
+        mode = "r+" if os.path.isfile(self.vectors_path) else "w+"
+        if mode == "r+" and os.path.getsize(self.vectors_path) < capacity * self.ndim * 4:
+            with open(self.vectors_path, "r+b") as fp:
+                fp.truncate(capacity * self.ndim * 4)
+        return np.memmap(
+            self.vectors_path, dtype=np.float32, mode=mode, shape=(capacity, self.ndim)
+        )
+
+    def _read_new_keys(self):
+        """Adds the keys appended to the key file since it was last read, by any process"""
+        size = os.path.getsize(self.keys_path)
+        # Leave a key that's still being written for next time
+        size -= size % KEY_SIZE
+        if size <= self.keys_read:
+            return
+        with open(self.keys_path, "rb") as fp:
+            fp.seek(self.keys_read)
+            data = fp.read(size - self.keys_read)
+        first = self.keys_read // KEY_SIZE
+        for n in range(len(data) // KEY_SIZE):
+            self.rows[data[n * KEY_SIZE : (n + 1) * KEY_SIZE]] = first + n
+        self.keys_read = size
+
+    def _row(self, row: int) -> np.ndarray:
+        if row >= self.capacity:
+            # Another process grew the file since we mapped it
+            self.capacity = os.path.getsize(self.vectors_path) // (self.ndim * 4)
+            self.vectors = np.memmap(
+                self.vectors_path, dtype=np.float32, mode="r+", shape=(self.capacity, self.ndim)
+            )
+        return np.array(self.vectors[row])
+
+    def key(self, prefix: str, text: str) -> bytes:
+        data = "\0".join((self.model_name, prefix, normalize_text(text)))
+        return hashlib.sha256(data.encode()).digest()
+
+    def _remember(self, key: bytes, vector: np.ndarray):
+        self.lru[key] = vector
+        self.lru.move_to_end(key)
+        while len(self.lru) > self.max_cached:
+            self.lru.popitem(last=False)
+
+    def get(self, keys: list[bytes]) -> list[np.ndarray | None]:
+        """The cached vector for each key, or None"""
+        results = []
+        with self.lock:
+            if any(key not in self.lru and key not in self.rows for key in keys):
+                self._read_new_keys()
+            for key in keys:
+                vector = self.lru.get(key)
+                if vector is not None:
+                    self.lru.move_to_end(key)
+                elif key in self.rows:
+                    vector = self._row(self.rows[key])
+                    self._remember(key, vector)
+                if vector is None:
+                    self.misses += 1
+                else:
+                    self.hits += 1
+                results.append(vector)
+        return results
+
+    def put(self, keys: list[bytes], vectors: list[np.ndarray]):
+        with self.lock, file_lock(self.lock_file):
+            # Another process may have added some of them, and its rows come before ours
+            self._read_new_keys()
+            new = {}
+            for key, vector in zip(keys, vectors):
+                if key not in self.rows:
+                    new[key] = vector
+            new = list(new.items())
+            if not new:
+                return
+            start = self.keys_read // KEY_SIZE
+            needed = start + len(new)
+            if needed > self.capacity:
+                self.vectors.flush()
+                while self.capacity < needed:
+                    self.capacity *= 2
+                self.vectors = self._open(self.capacity)
+            for row, (key, vector) in enumerate(new, start):
+                self.vectors[row] = vector
+            self.vectors.flush()
+            for key, vector in new:
+                self.keys_file.write(key)
+            self.keys_file.flush()
+            os.fsync(self.keys_file.fileno())
+            for row, (key, vector) in enumerate(new, start):
+                self.rows[key] = row
+                self._remember(key, np.asarray(vector, dtype=np.float32))
+            self.keys_read += len(new) * KEY_SIZE
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.rows),
+                "in_memory": len(self.lru),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    def close(self):
+        with self.lock:
+            self.vectors.flush()
+            self.keys_file.close()
+            self.lock_file.close()
@@ -0,0 +1,434 @@
+import atexit
+import glob
+import itertools
+import json
+import os
+import threading
+import time
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from transformers import AutoModel, AutoTokenizer
+
+from ai_function_agent.config import join_path
+from ai_function_agent.memory_batcher import (
+    DOCUMENT_PRIORITY,
+    QUERY_PRIORITY,
+    MicroBatcher,
+)
+from ai_function_agent.memory_chunking import iter_chunks
+from ai_function_agent.memory_embedding_cache import EmbeddingCache
+from ai_function_agent.memory_docstore import DocumentStore
+from ai_function_agent.memory_index import MemoryIndex
+from ai_function_agent.memory_lexical import BM25Index, reciprocal_rank_fusion
+
+MODEL_NAME = "nomic-ai/modernbert-embed-base"
+# Documents are embedded in windows of this many tokens, overlapping so nothing gets cut in half
+CHUNK_TOKENS = 512
+CHUNK_OVERLAP = 64
+# Chunks are embedded and added to the index this many at a time while a file is read
+INDEX_BATCH_SIZE = 64
+# How many documents each of the vector and BM25 searches put forward for fusing
+HYBRID_CANDIDATES = 20
+# New memories at least this similar (cosine) to an existing one are reported as duplicates
+DUPLICATE_THRESHOLD = 0.95
+DOCUMENT_PREFIX = "search_document: "
+QUERY_PREFIX = "search_query: "
+
+
+def mean_norm_pooling(model_output, attention_mask):
+    token_embeddings = model_output[0]
+    input_mask_expanded = (
+        attention_mask.unsqueeze(-1).expand(token_embeddings.size()).float()
+    )
+    return F.normalize(
+        torch.sum(token_embeddings * input_mask_expanded, 1)
+        / torch.clamp(input_mask_expanded.sum(1), min=1e-9),
+        p=2,
+        dim=1,
+    )
+
+
+class MemoryEngine:
+    """
+    Owns the text embedding model, the usearch index and the metadata mapping index keys
+    to memory files. Used directly by the memory tool, or by the memory service when
+    several server workers need to share one copy.
+
+    Each memory file is split into overlapping chunks with a vector each. `chunks` maps an
+    index key to the file it came from and `documents` maps a file to its keys.
+    """
+
+    def __init__(
+        self,
+        memory_dir: str = join_path("memory"),
+        model_name: str = MODEL_NAME,
+        max_batch_size: int = 32,
+        max_batch_wait: float = 0.005,
+        chunk_tokens: int = CHUNK_TOKENS,
+        chunk_overlap: int = CHUNK_OVERLAP,
+        view_index: bool = True,
+        duplicate_threshold: float = DUPLICATE_THRESHOLD,
+    ):
+        self.memory_dir = memory_dir
+        self.model_name = model_name
+        self.chunk_tokens = chunk_tokens
+        self.chunk_overlap = chunk_overlap
+        self.duplicate_threshold = duplicate_threshold
+        # Guards loading and moving the model, the index has its own lock
+        self.lock = threading.RLock()
+        # Memories are created, updated, forgotten and indexed one at a time, so a duplicate
+        # check can't race another write and a file can't be removed while it's being indexed
+        self.write_lock = threading.RLock()
+        # Fast tokenizers don't like being used from several threads at once
+        self.tokenizer_lock = threading.Lock()
+        self.tokenizer = None
+        self.text_embed_model = None
+        self.onloaded = False
+        # Embedding requests from every thread are batched into shared forward passes
+        self.batcher = MicroBatcher(self.embed_batch, max_batch_size, max_batch_wait)
+        self.embedding_cache = EmbeddingCache(
+            os.path.join(memory_dir, "embedding_cache"), model_name
+        )
+
+        os.makedirs(os.path.join(memory_dir, "index"), exist_ok=True)
+        self.document_store = DocumentStore(os.path.join(memory_dir, "documents"))
+        # The document store only ever grows between compactions too, they're compacted together
+        self.index = MemoryIndex(
+            memory_dir, view=view_index, on_compact=self.document_store.compact
+        )
+        # Built from the document store the first time it's needed
+        self.lexical = None
+        self.lexical_lock = threading.Lock()
+
+    def load_model(self):
+        """Loads the text embedding model the first time it's needed"""
+        with self.lock:
+            if self.text_embed_model is None:
+                print("Loading text embedding model...")
+                self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+                self.text_embed_model = AutoModel.from_pretrained(self.model_name)
+
+    def onload(self):
+        """Onloads the Text Embedding model for GPU acceleration if available"""
+        self.load_model()
+        with self.lock:
+            if torch.cuda.is_available() and not self.onloaded:
+                print("Onloading text embedding model to GPU...")
+                self.text_embed_model.cuda()
+                self.onloaded = True
+
+    def offload(self):
+        """Offloads the Text Embedding model to save VRAM"""
+        with self.lock:
+            if self.onloaded:
+                print("Offloading text embedding model to CPU...")
+                self.text_embed_model.cpu()
+                self.onloaded = False
+
+    def embed_batch(self, texts: list[str]) -> list[np.ndarray]:
+        """
+        Embeds already prefixed texts (search_document: / search_query:). Texts are grouped
+        by token length (powers of two) and each group is padded and run separately, so one
+        long document doesn't make every short query in the batch pay for its padding.
+        """
+        self.load_model()
+        with self.tokenizer_lock:
+            encoded = self.tokenizer(texts, truncation=True)
+        lengths = [len(ids) for ids in encoded["input_ids"]]
+        by_length = sorted(range(len(texts)), key=lengths.__getitem__)
+        vectors = [None] * len(texts)
+        with torch.no_grad():
+            for _, bucket in itertools.groupby(
+                by_length, key=lambda n: (lengths[n] - 1).bit_length()
+            ):
+                bucket = list(bucket)
+                with self.tokenizer_lock:
+                    features = self.tokenizer.pad(
+                        {key: [encoded[key][n] for n in bucket] for key in encoded.keys()},
+                        return_tensors="pt",
+                    )
+                if self.onloaded and torch.cuda.is_available():
+                    features = {k: v.cuda() for k, v in features.items()}
+                output = self.text_embed_model(**features)
+                pooled = mean_norm_pooling(output, features["attention_mask"]).cpu()
+                for n, vector in zip(bucket, pooled.numpy()):
+                    vectors[n] = vector
+        return vectors
+
+    def embed(
+        self, texts: list[str], prefix: str = DOCUMENT_PREFIX, priority: int = DOCUMENT_PRIORITY
+    ) -> np.ndarray:
+        """
+        Embeds texts with the given prefix, returns one row per text. Texts embedded before
+        come from the embedding cache, the rest go through the shared micro-batcher.
+        """
+        keys = [self.embedding_cache.key(prefix, text) for text in texts]
+        vectors = self.embedding_cache.get(keys)
+        missing = [n for n, vector in enumerate(vectors) if vector is None]
+        if missing:
+            # Identical texts in one call only get embedded once
+            unique = {}
+            for n in missing:
+                unique.setdefault(keys[n], n)
+            results = self.batcher.run([prefix + texts[n] for n in unique.values()], priority)
+            self.embedding_cache.put(list(unique), results)
+            by_key = dict(zip(unique, results))
+            for n in missing:
+                vectors[n] = by_key[keys[n]]
+        return np.stack(vectors)
+
+    def stats(self) -> dict:
+        return {
+            "documents": len(self.index.documents),
+            "stored_documents": len(self.document_store),
+            "chunks": len(self.index.chunks),
+            "wal_records": self.index.wal_records,
+            "embedding_cache": self.embedding_cache.stats(),
+            "batches": self.batcher.batches,
+            "batched_texts": self.batcher.texts,
+        }
+
+    def save(self):
+        """Compacts the index's write-ahead log into the index file, and the document store"""
+        self.index.compact()
+
+    def close(self):
+        self.index.close()
+        self.document_store.close()
+        self.embedding_cache.close()
+
+    def document_text(self, path: str) -> str | None:
+        text = self.document_store.get(path)
+        if text is None and os.path.isfile(path):
+            # Memories indexed before the document store only have their file
+            with open(path, "r") as fp:
+                text = fp.read()
+            self.document_store.add(path, text)
+        return text
+
+    def lexical_index(self) -> BM25Index:
+        with self.lexical_lock:
+            if self.lexical is None:
+                lexical = BM25Index()
+                for path in list(self.index.documents):
+                    text = self.document_text(path)
+                    if text is not None:
+                        lexical.add(path, text)
+                self.lexical = lexical
+            return self.lexical
+
+    def encode(self, text: str) -> list[int]:
+        with self.tokenizer_lock:
+            return self.tokenizer(text, add_special_tokens=False, verbose=False)["input_ids"]
+
+    def decode(self, tokens: list[int]) -> str:
+        with self.tokenizer_lock:
+            return self.tokenizer.decode(tokens)
+
+    def document_chunks(self, fp):
+        """Yields the chunks of an open document, sized to fit the model with the document prefix"""
+        limit = self.tokenizer.model_max_length - len(self.encode(DOCUMENT_PREFIX)) - 2
+        chunk_tokens = max(1, min(self.chunk_tokens, limit))
+        overlap = min(self.chunk_overlap, chunk_tokens // 2)
+        yield from iter_chunks(fp, self.encode, self.decode, chunk_tokens, overlap)
+
+    def add_chunks(self, chunks: list[tuple[str, str]]):
+        """Embeds (path, chunk text) pairs and adds them to the index"""
+        vectors = self.embed([text for _, text in chunks], DOCUMENT_PREFIX)
+        self.index.add([path for path, _ in chunks], vectors)
+
+    def remove_document(self, path: str):
+        """Drops every chunk of a document from the indexes"""
+        self.index.remove(path)
+        self.document_store.remove(path)
+        with self.lexical_lock:
+            if self.lexical is not None:
+                self.lexical.remove(path)
+
+    def index_files(self, paths: list, onload_model=True) -> list[str]:
+        """
+        Moves the files into the index folder, then reads them chunk by chunk and embeds the
+        chunks in batches, so big files (or lots of small ones) share forward passes.
+        """
+        if onload_model:
+            self.onload()
+        else:
+            self.load_model()
+
+        with self.write_lock:
+            return self._index_files(paths)
+
+    def _index_files(self, paths: list) -> list[str]:
+        new_paths = []
+        pending = []
+        for path in paths:
+            new_path = os.path.join(os.path.dirname(path), "index", os.path.basename(path))
+            os.makedirs(os.path.dirname(new_path), exist_ok=True)
+            # Replaces the indexed file when a memory is updated
+            os.replace(path, new_path)
+            new_paths.append(new_path)
+            self.remove_document(new_path)
+            with open(new_path, "r") as fp:
+                for chunk in self.document_chunks(fp):
+                    pending.append((new_path, chunk))
+                    if len(pending) >= INDEX_BATCH_SIZE:
+                        self.add_chunks(pending)
+                        pending = []
+                fp.seek(0)
+                text = fp.read()
+            self.document_store.add(new_path, text)
+            with self.lexical_lock:
+                if self.lexical is not None:
+                    self.lexical.add(new_path, text)
+        if pending:
+            self.add_chunks(pending)
+        return new_paths
+
+    def index_file(self, path, onload_model=True) -> str:
+        return self.index_files([path], onload_model)[0]
+
+    def index_memory(self) -> str:
+        """
+        Indexes all text files in the 'memory' directory by embedding their contents into vectors and adding them to an index.
+
+        This function processes each text file in the 'memory' directory, uses `index_files` to embed them chunk
+        by chunk, and adds the embeddings to the index. After processing all files, it compacts the index and metadata.
+        """
+        self.onload()
+        file_paths = glob.glob(os.path.join(self.memory_dir, "*.txt"))
+        print(f"Processing {len(file_paths)} files...")
+        self.index_files(file_paths, onload_model=False)
+        self.save()
+        self.offload()
+        return f"Indexed {len(file_paths)} new memory files"
+
+    def find_document(self, queries, n_docs=1, onload_model=True) -> list[list[tuple[str, float]]]:
+        """
+        Returns the best (path, score) documents for each query. The vector search and BM25
+        each rank their candidates and the two rankings are merged with reciprocal rank fusion.
+        """
+        if onload_model:
+            self.onload()
+        else:
+            self.load_model()
+        doc_embeddings = self.embed(queries, QUERY_PREFIX, QUERY_PRIORITY)
+        lexical = self.lexical_index()
+        candidates = max(n_docs, HYBRID_CANDIDATES)
+        matches = []
+        for query, vector in zip(queries, doc_embeddings):
+            rankings = [
+                [path for path, _ in self.index.search_documents(vector, candidates)],
+                [path for path, _ in lexical.search(query, candidates)],
+            ]
+            matches.append(reciprocal_rank_fusion(rankings, n_docs))
+        return matches
+
+    def recall_memory(self, query: str, n_docs: int = 1) -> str:
+        print(f"Retrieving documents from memory with query: {query}")
+        matches = self.find_document([query], n_docs=n_docs)
+        documents = []
+        for _matches in matches:
+            for path, _ in _matches:
+                text = self.document_text(path)
+                if text is not None:
+                    documents.append({"id": memory_id(path), "text": text})
+        return json.dumps(documents, indent=2)
+
+    def memory_path(self, memory_id: str) -> str:
+        """Where the indexed file of a memory lives, the id is its file name without .txt"""
+        name = os.path.basename(memory_id.strip())
+        if not name.endswith(".txt"):
+            name += ".txt"
+        return os.path.join(self.memory_dir, "index", name)
+
+    def find_duplicate(self, memory_text: str) -> tuple[str, float] | None:
+        """The most similar existing memory if it's at least `duplicate_threshold` similar"""
+        self.onload()
+        vector = self.embed([memory_text], DOCUMENT_PREFIX)[0]
+        matches = self.index.search_documents(vector, 1)
+        if matches:
+            path, distance = matches[0]
+            similarity = 1 - distance
+            if similarity >= self.duplicate_threshold:
+                return path, similarity
+        return None
+
+    def write_memory(self, memory_id: str, memory_text: str) -> str:
+        """Writes the memory into the memory directory and indexes it, replacing any old version"""
+        file_path = os.path.join(self.memory_dir, f"{memory_id}.txt")
+        with open(file_path, "w") as fp:
+            fp.write(memory_text)
+        return self.index_file(file_path, onload_model=True)
+
+    def create_memory(self, memory_text: str) -> str:
+        print("Creating new memory...")
+        with self.write_lock:
+            return self._create_memory(memory_text)
+
+    def _create_memory(self, memory_text: str) -> str:
+        duplicate = self.find_duplicate(memory_text)
+        if duplicate is not None:
+            path, similarity = duplicate
+            print(f"Not creating a duplicate of {path} ({similarity:.2f} similar)")
+            return json.dumps(
+                {
+                    "error": "A memory like this already exists, use update_memory to change it",
+                    "id": memory_id(path),
+                    "text": self.document_text(path),
+                }
+            )
+
+        # Create a new text file in the memory directory with the memory_text and index it
+        new_path = self.write_memory(f"memory_{time.time_ns()}", memory_text)
+        print(f"Created new memory and indexed to: {new_path}")
+        return f"New memory {memory_id(new_path)} created and indexed at: {new_path}"
+
+    def forget_memory(self, memory_id: str) -> str:
+        with self.write_lock:
+            return self._forget_memory(memory_id)
+
+    def _forget_memory(self, memory_id: str) -> str:
+        path = self.memory_path(memory_id)
+        if path not in self.index.documents and not os.path.isfile(path):
+            return json.dumps({"error": f"There is no memory with the id {memory_id}"})
+        print(f"Forgetting memory {path}...")
+        self.remove_document(path)
+        if os.path.isfile(path):
+            os.remove(path)
+        return f"Memory {memory_id} has been forgotten"
+
+    def update_memory(self, memory_id: str, memory_text: str) -> str:
+        with self.write_lock:
+            return self._update_memory(memory_id, memory_text)
+
+    def _update_memory(self, memory_id: str, memory_text: str) -> str:
+        path = self.memory_path(memory_id)
+        if path not in self.index.documents and not os.path.isfile(path):
+            return json.dumps({"error": f"There is no memory with the id {memory_id}"})
+        print(f"Updating memory {path}...")
+        self.write_memory(os.path.splitext(os.path.basename(path))[0], memory_text)
+        return f"Memory {memory_id} has been updated"
+
+
+def memory_id(path: str) -> str:
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+engine = None
+engine_lock = threading.Lock()
+
+
+def get_engine(**kwargs) -> MemoryEngine:
+    """
+    The process wide MemoryEngine, so every importer shares one model and index.
+    Keyword arguments are passed to MemoryEngine by whoever creates it first.
+    """
+    global engine
+    with engine_lock:
+        if engine is None:
+            engine = MemoryEngine(**kwargs)
+            # Compact the index's write-ahead log on the way out
+            atexit.register(engine.close)
+        return engine
@@ -0,0 +1,267 @@
+import base64
+import json
+import os
+import threading
+from typing import Callable, Optional
+
+import numpy as np
+from usearch.index import Index
+
+# Compact the write-ahead log into the index file after this many records
+COMPACT_EVERY = 256
+# How many chunks to search per requested document, since several can belong to the same one
+RECALL_OVERSAMPLE = 4
+
+
+def fsync_path(path: str):
+    """Flushes a file, or the entries of a directory, to disk"""
+    if os.path.isdir(path) and os.name == "nt":
+        # Windows can't open a directory to fsync it
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class MemoryIndex:
+    """
+    The usearch index of memory chunks plus the maps from chunk keys to memory files.
+
+    The index file is only written when the log is compacted. In between, every addition and
+    removal is appended to a write-ahead log (`wal.jsonl`), one fsynced JSON line each, and
+    applied to `delta`, the vectors added since, which are searched exhaustively alongside the
+    `base` index from the file. Building the HNSW graph is the slow part of adding to usearch,
+    so it's only paid once, when the delta is compacted into the base.
+
+    Compacting merges the two into a new index file and metadata file, each written to a
+    temporary file, fsynced and renamed over the old one. The log is only emptied once the
+    directory holding the renames is fsynced too. Replaying the log is idempotent, so a crash
+    at any point leaves something that loads back to the same state.
+
+    Keys come from `next_key`, which is stored with the metadata and only ever goes up, so a
+    removed chunk's key is never handed out again. With `view` the base index is memory-mapped
+    instead of loaded into RAM.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        ndim: int = 768,
+        view: bool = True,
+        compact_every: int = COMPACT_EVERY,
+        on_compact: Optional[Callable[[], None]] = None,
+    ):
+        self.ndim = ndim
+        self.view = view
+        self.compact_every = compact_every
+        # Compacts whatever else grows with every change, the document store
+        self.on_compact = on_compact
+        self.index_path = os.path.join(directory, "index.usearch")
+        self.metadata_path = os.path.join(directory, "metadata.json")
+        self.wal_path = os.path.join(directory, "wal.jsonl")
+        self.lock = threading.RLock()
+        self.chunks: dict[str, str] = {}
+        self.documents: dict[str, list[int]] = {}
+        self.wal_records = 0
+        self.next_key = 0
+
+        self.base = self._open_base()
+        self.delta: dict[int, np.ndarray] = {}
+        self._delta_matrix = None
+        if os.path.isfile(self.metadata_path):
+            with open(self.metadata_path, "r") as fp:
+                metadata = json.load(fp)
+            # Older indexes only stored one key per file
+            self.chunks = metadata.get("chunks", metadata)
+            self.documents = metadata.get("documents", {})
+            self.next_key = metadata.get("next_key", 0)
+            if "documents" not in metadata:
+                for key, path in self.chunks.items():
+                    self.documents.setdefault(path, []).append(int(key))
+        self.next_key = max(
+            [self.next_key, len(self.base)] + [int(key) + 1 for key in self.chunks]
+        )
+        self._replay()
+        self.wal_file = open(self.wal_path, "a", encoding="utf-8")
+
+    def _open_base(self) -> Index:
+        base = Index(ndim=self.ndim)
+        if os.path.isfile(self.index_path):
+            if self.view:
+                base.view(self.index_path)
+            else:
+                base.load(self.index_path)
+        return base
+
+    def _replay(self):
+        """Applies the records logged since the last compaction"""
+        if not os.path.isfile(self.wal_path):
+            return
+        valid_length = 0
+        with open(self.wal_path, "rb") as fp:
+            for line in fp:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # Torn last line from a crash mid append, it never happened
+                    break
+                self._apply(record)
+                self.wal_records += 1
+                valid_length += len(line)
+        if valid_length != os.path.getsize(self.wal_path):
+            with open(self.wal_path, "r+b") as fp:
+                fp.truncate(valid_length)
+
+    def _apply(self, record: dict):
+        if record["op"] == "add":
+            keys = np.array(record["keys"], dtype=np.uint64)
+            vectors = np.frombuffer(
+                base64.b64decode(record["vectors"]), dtype=np.float32
+            ).reshape(len(keys), self.ndim)
+            new = [n for n, key in enumerate(keys.tolist()) if str(key) not in self.chunks]
+            # After a crash mid compaction the key can already be in the new index file
+            for n in new:
+                if int(keys[n]) not in self.delta and keys[n] not in self.base:
+                    self.delta[int(keys[n])] = vectors[n]
+                    self._delta_matrix = None
+            for n in new:
+                key = int(keys[n])
+                self.chunks[str(key)] = record["paths"][n]
+                self.documents.setdefault(record["paths"][n], []).append(key)
+            if len(keys):
+                self.next_key = max(self.next_key, int(keys.max()) + 1)
+        elif record["op"] == "remove":
+            for key in self.documents.pop(record["path"], []):
+                self.chunks.pop(str(key), None)
+                # Removed keys in the base index are skipped by searches until the next compaction
+                if self.delta.pop(key, None) is not None:
+                    self._delta_matrix = None
+
+    def _log(self, record: dict):
+        self.wal_file.write(json.dumps(record) + "\n")
+        self.wal_file.flush()
+        os.fsync(self.wal_file.fileno())
+        self.wal_records += 1
+
+    def add(self, paths: list[str], vectors: np.ndarray):
+        """Adds one vector per path under newly allocated keys"""
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        with self.lock:
+            keys = list(range(self.next_key, self.next_key + len(paths)))
+            record = {
+                "op": "add",
+                "keys": keys,
+                "paths": paths,
+                "vectors": base64.b64encode(vectors.tobytes()).decode(),
+            }
+            self._log(record)
+            self._apply(record)
+            self._maybe_compact()
+
+    def remove(self, path: str):
+        """Removes every chunk of a document"""
+        with self.lock:
+            if path not in self.documents:
+                return
+            record = {"op": "remove", "path": path}
+            self._log(record)
+            self._apply(record)
+            self._maybe_compact()
+
+    def _maybe_compact(self):
+        if self.wal_records >= self.compact_every:
+            self.compact()
+
+    def search(self, vector: np.ndarray, count: int) -> list[tuple[int, float]]:
+        """The closest (key, distance) pairs from both indexes, removed chunks included"""
+        with self.lock:
+            results = []
+            if len(self.base):
+                matches = self.base.search(vector, min(count, len(self.base)))
+                results += zip(matches.keys.tolist(), matches.distances.tolist())
+            if self.delta:
+                results += self._search_delta(vector, count)
+            results.sort(key=lambda item: item[1])
+            return results[:count]
+
+    def _search_delta(self, vector: np.ndarray, count: int) -> list[tuple[int, float]]:
+        if self._delta_matrix is None:
+            matrix = np.stack(list(self.delta.values()))
+            matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+            self._delta_matrix = (np.array(list(self.delta), dtype=np.uint64), matrix)
+        keys, matrix = self._delta_matrix
+        # Cosine distance, same as the base index
+        distances = 1 - matrix @ (vector / max(np.linalg.norm(vector), 1e-12))
+        if count < len(keys):
+            top = np.argpartition(distances, count)[:count]
+        else:
+            top = np.arange(len(keys))
+        return list(zip(keys[top].tolist(), distances[top].tolist()))
+
+    def search_documents(self, vector: np.ndarray, n_docs: int) -> list[tuple[str, float]]:
+        """
+        Searches the chunks and merges the hits into documents ranked by their best chunk,
+        searching deeper until there are enough distinct documents or nothing left to find.
+        """
+        count = n_docs * RECALL_OVERSAMPLE
+        while True:
+            total = len(self)
+            best = {}
+            for key, distance in self.search(vector, count):
+                # Chunks that were removed stay in the index file until it's compacted
+                path = self.chunks.get(str(key))
+                if path is not None and path not in best:
+                    best[path] = distance
+            if len(best) >= n_docs or count >= total:
+                return sorted(best.items(), key=lambda item: item[1])[:n_docs]
+            count *= 2
+
+    def __len__(self) -> int:
+        """How many keys a search can return, including removed chunks not compacted away yet"""
+        return len(self.base) + len(self.delta)
+
+    def compact(self):
+        """Writes the base and delta indexes and the metadata out as new files and empties the log"""
+        with self.lock:
+            full = Index(ndim=self.ndim)
+            if os.path.isfile(self.index_path):
+                full.load(self.index_path)
+            removed = [key for key in np.array(full.keys).tolist() if str(key) not in self.chunks]
+            if removed:
+                full.remove(np.array(removed, dtype=np.uint64))
+            keys = [key for key in self.delta if key not in full]
+            if keys:
+                full.add(np.array(keys, dtype=np.uint64), np.stack([self.delta[key] for key in keys]))
+
+            full.save(self.index_path + ".tmp")
+            fsync_path(self.index_path + ".tmp")
+            # Search the copy in RAM while the file is swapped, Windows can't replace a mapped file
+            self.base = full
+            self.delta = {}
+            self._delta_matrix = None
+            os.replace(self.index_path + ".tmp", self.index_path)
+            with open(self.metadata_path + ".tmp", "w") as fp:
+                json.dump(
+                    {"next_key": self.next_key, "chunks": self.chunks, "documents": self.documents},
+                    fp,
+                )
+                fp.flush()
+                os.fsync(fp.fileno())
+            os.replace(self.metadata_path + ".tmp", self.metadata_path)
+            # The log may only go once both renames are on disk
+            fsync_path(os.path.dirname(self.index_path) or ".")
+            self.wal_file.truncate(0)
+            self.wal_file.seek(0)
+            self.wal_records = 0
+            if self.view:
+                self.base = self._open_base()
+            if self.on_compact is not None:
+                self.on_compact()
+
+    def close(self):
+        with self.lock:
+            if self.wal_records:
+                self.compact()
+            self.wal_file.close()
@@ -0,0 +1,126 @@
+import heapq
+import math
+import re
+import threading
+from collections import Counter
+
+import numpy as np
+
+TOKEN_PATTERN = re.compile(r"\w+")
+# Rank constant for reciprocal rank fusion, 60 is what the original paper settled on
+RRF_K = 60
+
+
+def tokenize(text: str) -> list[str]:
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class BM25Index:
+    """
+    An inverted index scoring documents with Okapi BM25, updated one document at a time.
+    Catches what embeddings are bad at: exact names, ids and numbers.
+
+    Posting lists are kept as dicts so documents can be added and removed cheaply, and turned
+    into numpy arrays the first time a term is searched after it changed, so scoring a common
+    term doesn't mean a Python loop over every document it's in.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.lock = threading.Lock()
+        # term -> {document id: term frequency}
+        self.postings: dict[str, dict[int, int]] = {}
+        self.lengths: dict[int, int] = {}
+        # The terms of each document, so removing one doesn't mean scanning every posting list
+        self.terms: dict[int, list[str]] = {}
+        # term -> (document ids, term frequencies), dropped whenever the posting list changes
+        self._arrays: dict[str, tuple[np.ndarray, np.ndarray]] = {}
+        # Document lengths by id, removed documents are left as 0
+        self._length_array = np.zeros(1024, dtype=np.float32)
+        self.total_length = 0
+        self.ids: dict[str, int] = {}
+        self.names: dict[int, str] = {}
+        self._next_id = 0
+
+    def __len__(self) -> int:
+        return len(self.lengths)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.ids
+
+    def add(self, name: str, text: str):
+        counts = Counter(tokenize(text))
+        with self.lock:
+            self._remove(name)
+            doc_id = self._next_id
+            self._next_id += 1
+            self.ids[name] = doc_id
+            self.names[doc_id] = name
+            for term, count in counts.items():
+                self.postings.setdefault(term, {})[doc_id] = count
+                self._arrays.pop(term, None)
+            self.terms[doc_id] = list(counts)
+            length = sum(counts.values())
+            self.lengths[doc_id] = length
+            self.total_length += length
+            if doc_id >= len(self._length_array):
+                self._length_array = np.resize(self._length_array, 2 * len(self._length_array))
+            self._length_array[doc_id] = length
+
+    def remove(self, name: str):
+        with self.lock:
+            self._remove(name)
+
+    def _remove(self, name: str):
+        doc_id = self.ids.pop(name, None)
+        if doc_id is None:
+            return
+        del self.names[doc_id]
+        self.total_length -= self.lengths.pop(doc_id)
+        self._length_array[doc_id] = 0
+        for term in self.terms.pop(doc_id):
+            self._arrays.pop(term, None)
+            del self.postings[term][doc_id]
+            if not self.postings[term]:
+                del self.postings[term]
+
+    def search(self, query: str, n_docs: int) -> list[tuple[str, float]]:
+        """The best (name, score) documents for the query, highest score first"""
+        with self.lock:
+            if not self.lengths:
+                return []
+            n = len(self.lengths)
+            average_length = self.total_length / n
+            scores = np.zeros(self._next_id, dtype=np.float32)
+            for term in set(tokenize(query)):
+                docs = self.postings.get(term)
+                if not docs:
+                    continue
+                if term not in self._arrays:
+                    self._arrays[term] = (
+                        np.fromiter(docs.keys(), dtype=np.int64, count=len(docs)),
+                        np.fromiter(docs.values(), dtype=np.float32, count=len(docs)),
+                    )
+                doc_ids, tfs = self._arrays[term]
+                idf = math.log((n - len(docs) + 0.5) / (len(docs) + 0.5) + 1)
+                norm = self.k1 * (
+                    1 - self.b + self.b * self._length_array[doc_ids] / average_length
+                )
+                scores[doc_ids] += idf * tfs * (self.k1 + 1) / (tfs + norm)
+            matched = np.flatnonzero(scores)
+            if len(matched) > n_docs:
+                matched = matched[np.argpartition(-scores[matched], n_docs)[:n_docs]]
+            best = sorted(matched.tolist(), key=lambda doc_id: -scores[doc_id])
+            return [(self.names[doc_id], float(scores[doc_id])) for doc_id in best]
+
+
+def reciprocal_rank_fusion(
+    rankings: list[list[str]], n_docs: int, k: int = RRF_K
+) -> list[tuple[str, float]]:
+    """Merges ranked lists of documents, a document scores 1 / (k + rank) from every list it's in"""
+    scores = {}
+    for ranking in rankings:
+        for rank, name in enumerate(ranking, 1):
+            scores[name] = scores.get(name, 0.0) + 1 / (k + rank)
+    return heapq.nlargest(n_docs, scores.items(), key=lambda item: item[1])
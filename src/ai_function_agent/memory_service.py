@@ -0,0 +1,239 @@
+"""
+A small HTTP service that owns the memory embedding model and index.
+
+With several web server workers, each one importing the memory tool would load its own copy
+of the model and keep its own index, all saving over the same files. Instead the memory tool
+can talk to this service, which one worker starts as a subprocess the first time it's needed.
+Binding the port doubles as the lock, so if several workers race to start it, only one wins.
+
+Run it by hand with `python -m ai_function_agent.memory_service --port 8770`.
+"""
+import argparse
+import http.client
+import json
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Engine methods the service exposes, called with the json body as keyword arguments. Requests
+# are handled on their own threads, the engine's write lock makes the changes one at a time
+METHODS = ("create_memory", "recall_memory", "index_memory", "forget_memory", "update_memory")
+
+
+class MemoryServiceServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 64
+
+
+def make_handler(engine):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send_json(self, status: int, data: dict):
+            payload = json.dumps(data).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            if self.path == "/health":
+                self._send_json(200, {"status": "ok", "pid": os.getpid()})
+            elif self.path == "/stats":
+                self._send_json(200, engine.stats())
+            else:
+                self._send_json(404, {"error": "Not found"})
+
+        def do_POST(self):
+            method = self.path.strip("/")
+            length = int(self.headers.get("Content-Length", 0))
+            try:
+                kwargs = json.loads(self.rfile.read(length) or b"{}")
+            except json.JSONDecodeError:
+                self._send_json(400, {"error": "Invalid JSON"})
+                return
+            if method not in METHODS:
+                self._send_json(404, {"error": f"Unknown method {method}"})
+                return
+            try:
+                result = getattr(engine, method)(**kwargs)
+            except Exception as e:
+                self._send_json(500, {"error": str(e)})
+                return
+            self._send_json(200, {"result": result})
+
+    return Handler
+
+
+def serve(host: str, port: int, duplicate_threshold: float = None):
+    try:
+        server = MemoryServiceServer((host, port), None)
+    except OSError as e:
+        # Someone else already started the service
+        print(f"Memory service not started, {host}:{port} is in use ({e})")
+        return
+
+    from ai_function_agent.memory_engine import get_engine
+
+    kwargs = {}
+    if duplicate_threshold is not None:
+        kwargs["duplicate_threshold"] = duplicate_threshold
+    engine = get_engine(**kwargs)
+    # Load the model before answering health checks so clients only see a ready service
+    engine.load_model()
+    server.RequestHandlerClass = make_handler(engine)
+    print(f"Memory service listening on {host}:{port}")
+    # Make terminate() run the cleanup below
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.serve_forever()
+    finally:
+        engine.close()
+        server.server_close()
+
+
+class MemoryServiceError(Exception):
+    pass
+
+
+class MemoryServiceClient:
+    """
+    Talks to the memory service, starting it as a subprocess if nobody has yet.
+    Has the same tool methods as MemoryEngine so the memory tool can use either.
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 8770,
+        startup_timeout: float = 300,
+        request_timeout: float = 300,
+        duplicate_threshold: float = None,
+    ):
+        self.host = host
+        self.port = port
+        self.startup_timeout = startup_timeout
+        self.request_timeout = request_timeout
+        # Passed on to the service if this client is the one to start it
+        self.duplicate_threshold = duplicate_threshold
+        self.process = None
+        self._start_lock = threading.Lock()
+        # One keep-alive connection per thread, http.client connections aren't thread safe
+        self._local = threading.local()
+
+    def is_running(self) -> bool:
+        try:
+            connection = http.client.HTTPConnection(self.host, self.port, timeout=2)
+            connection.request("GET", "/health")
+            ok = connection.getresponse().status == 200
+            connection.close()
+            return ok
+        except (OSError, http.client.HTTPException):
+            return False
+
+    def ensure_running(self):
+        if self.is_running():
+            return
+        with self._start_lock:
+            if self.is_running():
+                return
+            if self.process is None or self.process.poll() is not None:
+                print("Starting the memory service...")
+                command = [
+                    sys.executable,
+                    "-m",
+                    "ai_function_agent.memory_service",
+                    "--host",
+                    self.host,
+                    "--port",
+                    str(self.port),
+                ]
+                if self.duplicate_threshold is not None:
+                    command += ["--duplicate-threshold", str(self.duplicate_threshold)]
+                self.process = subprocess.Popen(command)
+            deadline = time.monotonic() + self.startup_timeout
+            while not self.is_running():
+                if time.monotonic() > deadline:
+                    raise MemoryServiceError("Timed out waiting for the memory service")
+                time.sleep(0.25)
+
+    def stop(self):
+        """Stops the service if this client started it"""
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            self.process.wait()
+
+    def get_connection(self) -> http.client.HTTPConnection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = http.client.HTTPConnection(
+                self.host, self.port, timeout=self.request_timeout
+            )
+            self._local.connection = connection
+        return connection
+
+    def call(self, method: str, **kwargs):
+        body = json.dumps(kwargs)
+        headers = {"Content-Type": "application/json"}
+        for attempt in range(2):
+            connection = self.get_connection()
+            try:
+                connection.request("POST", f"/{method}", body, headers)
+                response = connection.getresponse()
+                data = json.loads(response.read())
+                break
+            except TimeoutError:
+                # The call may still be running in the service, don't run it twice
+                connection.close()
+                self._local.connection = None
+                raise
+            except (OSError, http.client.HTTPException):
+                # The service restarted or the keep-alive connection went stale
+                connection.close()
+                self._local.connection = None
+                if attempt == 1:
+                    raise
+                self.ensure_running()
+        if response.status != 200:
+            raise MemoryServiceError(data.get("error", f"HTTP {response.status}"))
+        return data["result"]
+
+    def create_memory(self, memory_text: str) -> str:
+        return self.call("create_memory", memory_text=memory_text)
+
+    def recall_memory(self, query: str, n_docs: int = 1) -> str:
+        return self.call("recall_memory", query=query, n_docs=n_docs)
+
+    def index_memory(self) -> str:
+        return self.call("index_memory")
+
+    def forget_memory(self, memory_id: str) -> str:
+        return self.call("forget_memory", memory_id=memory_id)
+
+    def update_memory(self, memory_id: str, memory_text: str) -> str:
+        return self.call("update_memory", memory_id=memory_id, memory_text=memory_text)
+
+    def stats(self) -> dict:
+        connection = http.client.HTTPConnection(self.host, self.port, timeout=self.request_timeout)
+        try:
+            connection.request("GET", "/stats")
+            return json.loads(connection.getresponse().read())
+        finally:
+            connection.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8770)
+    parser.add_argument("--duplicate-threshold", type=float, default=None)
+    args = parser.parse_args()
+    serve(args.host, args.port, args.duplicate_threshold)
@@ -0,0 +1,205 @@
+import bisect
+import threading
+
+from ai_function_agent.tracing import Span
+
+# Seconds, from validating arguments up to slow inference and tools
+DURATION_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120,
+)
+SIZE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576)
+ROUND_BUCKETS = (1, 2, 3, 4, 5, 6, 8, 10, 15, 20)
+
+
+def escape_label(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    labels = [f'{name}="{escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        labels.append(extra)
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+
+def format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values: dict[tuple, float] = {}
+
+    def inc(self, *label_values, amount: float = 1):
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def samples(self) -> list[str]:
+        return [
+            f"{self.name}{format_labels(self.labels, label_values)} {format_value(value)}"
+            for label_values, value in sorted(self.values.items())
+        ]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, *label_values):
+        self.values[label_values] = value
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(
+        self, name: str, help: str, labels: tuple[str, ...] = (), buckets: tuple = DURATION_BUCKETS
+    ):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(sorted(buckets))
+        # Per label values: the count in each bucket (not cumulative) plus +Inf, and the sum
+        self.values: dict[tuple, tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, *label_values):
+        if label_values not in self.values:
+            self.values[label_values] = ([0] * (len(self.buckets) + 1), [0.0])
+        counts, total = self.values[label_values]
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        total[0] += value
+
+    def samples(self) -> list[str]:
+        lines = []
+        for label_values, (counts, total) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                le = f'le="{bound if bound == "+Inf" else format_value(bound)}"'
+                lines.append(
+                    f"{self.name}_bucket{format_labels(self.labels, label_values, le)} {cumulative}"
+                )
+            labels = format_labels(self.labels, label_values)
+            lines.append(f"{self.name}_sum{labels} {format_value(total[0])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class AgentMetrics:
+    """
+    Tracer listener turning the spans of the agent loop into Prometheus metrics: how long each
+    stage takes, how long each tool takes and how big its arguments and results are, tokens
+    used by inference and how many inference rounds turns need. Waiting for the scheduler is
+    the `queue_wait` stage, prompts it refused count as its errors. Each completion sent to a
+    backend is a `backend_request`, also counted per backend. `render` gives them in the
+    Prometheus text format. Spans end on worker threads too, hence the lock.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stage_seconds = Histogram(
+            "agent_stage_duration_seconds", "Time spent in each stage of a turn", ("stage",)
+        )
+        self.stage_errors = Counter(
+            "agent_stage_errors_total", "Stages that ended with an exception", ("stage",)
+        )
+        self.tool_seconds = Histogram(
+            "agent_tool_duration_seconds", "Time taken by each tool call", ("tool",)
+        )
+        self.tool_argument_bytes = Histogram(
+            "agent_tool_argument_bytes", "Size of the arguments of tool calls", ("tool",), SIZE_BUCKETS
+        )
+        self.tool_result_bytes = Histogram(
+            "agent_tool_result_bytes", "Size of the results of tool calls", ("tool",), SIZE_BUCKETS
+        )
+        self.tokens = Counter(
+            "agent_tokens_total", "Tokens reported by the backend's completions", ("type",)
+        )
+        self.turn_rounds = Histogram(
+            "agent_turn_inference_rounds", "Inference rounds needed to finish a turn", (), ROUND_BUCKETS
+        )
+        self.queued = Gauge("agent_scheduler_queued", "Turns waiting for the scheduler")
+        self.running = Gauge("agent_scheduler_running", "Turns the scheduler let run")
+        self.backend_seconds = Histogram(
+            "agent_backend_request_duration_seconds",
+            "Time taken by completions, per backend",
+            ("backend",),
+        )
+        self.backend_errors = Counter(
+            "agent_backend_errors_total", "Completions that failed, per backend", ("backend",)
+        )
+        self.backend_outstanding = Gauge(
+            "agent_backend_outstanding", "Completions in flight, per backend", ("backend",)
+        )
+        self.backend_up = Gauge(
+            "agent_backend_up",
+            "1 if the backend is taking completions (healthy, circuit closed)",
+            ("backend",),
+        )
+        self.metrics = [
+            self.stage_seconds,
+            self.stage_errors,
+            self.tool_seconds,
+            self.tool_argument_bytes,
+            self.tool_result_bytes,
+            self.tokens,
+            self.turn_rounds,
+            self.queued,
+            self.running,
+            self.backend_seconds,
+            self.backend_errors,
+            self.backend_outstanding,
+            self.backend_up,
+        ]
+
+    def __call__(self, span: Span):
+        attributes = span.attributes
+        with self.lock:
+            self.stage_seconds.observe(span.duration, span.name)
+            if "error" in attributes:
+                self.stage_errors.inc(span.name)
+            if span.name == "tool":
+                tool = attributes.get("tool", "")
+                self.tool_seconds.observe(span.duration, tool)
+                if "argument_bytes" in attributes:
+                    self.tool_argument_bytes.observe(attributes["argument_bytes"], tool)
+                if "result_bytes" in attributes:
+                    self.tool_result_bytes.observe(attributes["result_bytes"], tool)
+            elif span.name == "inference":
+                for kind in ("prompt", "completion"):
+                    tokens = attributes.get(f"{kind}_tokens")
+                    if tokens:
+                        self.tokens.inc(kind, amount=tokens)
+            elif span.name == "turn" and "rounds" in attributes:
+                self.turn_rounds.observe(attributes["rounds"])
+            elif span.name == "backend_request":
+                backend = attributes.get("backend", "")
+                self.backend_seconds.observe(span.duration, backend)
+                if "error" in attributes:
+                    self.backend_errors.inc(backend)
+
+    def set_scheduler(self, stats: dict):
+        """Updates the gauges from TurnScheduler.stats"""
+        with self.lock:
+            self.queued.set(stats["queued"])
+            self.running.set(stats["running"])
+
+    def set_backends(self, stats: dict):
+        """Updates the gauges from BackendRouter.stats"""
+        with self.lock:
+            for backend, backend_stats in stats.items():
+                self.backend_outstanding.set(backend_stats["outstanding"], backend)
+                up = backend_stats["healthy"] and not backend_stats["circuit_open"]
+                self.backend_up.set(int(up), backend)
+
+    def render(self) -> str:
+        lines = []
+        with self.lock:
+            for metric in self.metrics:
+                lines.append(f"# HELP {metric.name} {metric.help}")
+                lines.append(f"# TYPE {metric.name} {metric.kind}")
+                lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,64 @@
+import inspect
+import zlib
+from datetime import datetime
+
+# Local backends (llama.cpp, vLLM) only reuse their KV cache for a prompt that starts with
+# exactly the same bytes as one they've seen, so nothing in here may change between requests.
+# Anything that does, like the date, goes into the message it belongs to instead.
+SYSTEM_PROMPT = inspect.cleandoc(
+    """
+    You are JARVIS, a helpful and witty assistant.
+    You help a user with their tasks by using any of the functions available to you and your replies should always aim to be short but informative.
+    When a user refers to themselves in a prompt to create or recall a memory in the first person, change it to refer to 'The User'.
+    If you cannot answer a prompt based on information you have available, use your tools to find more information.
+    Every prompt from the user ends with the date and time it was sent.
+    """
+)
+system_message = {"role": "system", "content": SYSTEM_PROMPT}
+
+
+def user_message(prompt: str) -> dict:
+    """A user message stamped with the time it was sent, see render_messages"""
+    return {
+        "role": "user",
+        "content": prompt,
+        "date": datetime.today().strftime("%Y-%m-%d %H:%M:%S"),
+    }
+
+
+def render_messages(messages: list) -> list:
+    """
+    The messages as they are sent to the backend, with each user message's date written into
+    its content. A message renders the same every time, so earlier turns never change.
+    """
+    rendered = []
+    for message in messages:
+        if "date" in message:
+            message = message.copy()
+            date = message.pop("date")
+            message["content"] = f"{message['content']}\n\n(Sent {date})"
+        rendered.append(message)
+    return rendered
+
+
+class CacheHints:
+    """
+    Extra request fields that tell the backend how to cache prompts, for the backends that take
+    them. With `"llama.cpp"` every request asks for its prompt to be cached (`cache_prompt`)
+    and every conversation is pinned to one of the server's `slots` (`id_slot`), so turns of
+    the same conversation land on the slot that already holds the start of it. vLLM reuses
+    prefixes on its own (`--enable-prefix-caching`) and needs no hints.
+    """
+
+    def __init__(self, backend: str | None = None, slots: int = 1):
+        self.backend = backend
+        self.slots = max(1, slots)
+
+    def extra_body(self, conversation_id: str | None = None) -> dict | None:
+        if self.backend != "llama.cpp":
+            return None
+        body = {"cache_prompt": True}
+        if conversation_id is not None:
+            # crc32 rather than hash(), so every worker process picks the same slot
+            body["id_slot"] = zlib.crc32(conversation_id.encode()) % self.slots
+        return body
@@ -0,0 +1,267 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import AsyncIterator, Optional
+
+import httpx
+import openai
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+from ai_function_agent.tracing import span
+
+# Errors that say nothing about the request itself, worth trying another backend for
+FAILOVER_ERRORS = (
+    openai.APIConnectionError,
+    openai.InternalServerError,
+    openai.RateLimitError,
+)
+HEALTH_CHECK_TIMEOUT = 5
+
+
+class Backend:
+    """One OpenAI compatible server the router can send completions to"""
+
+    def __init__(
+        self,
+        name: str,
+        client: AsyncOpenAI,
+        model_name: str,
+        weight: float = 1.0,
+        capacity: Optional[int] = None,
+    ):
+        self.name = name
+        self.client = client
+        self.model_name = model_name
+        self.weight = weight
+        # Completions it should get at once before the others are preferred, None for no limit
+        self.capacity = capacity
+        self.outstanding = 0
+        self.requests = 0
+        self.errors = 0
+        self.total_latency = 0.0
+        self.healthy = True
+        self.consecutive_failures = 0
+        # The circuit is open (no traffic) until then, then one trial request may go through
+        self.open_until = 0.0
+        self.trial_in_flight = False
+
+    @property
+    def load(self) -> float:
+        return self.outstanding / self.weight
+
+    @property
+    def saturated(self) -> bool:
+        return self.capacity is not None and self.outstanding >= self.capacity
+
+    def available(self, now: float) -> bool:
+        if not self.healthy:
+            return False
+        if self.open_until == 0.0:
+            return True
+        return now >= self.open_until and not self.trial_in_flight
+
+    def stats(self) -> dict:
+        completed = self.requests - self.outstanding
+        return {
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "errors": self.errors,
+            "average_latency": self.total_latency / completed if completed else 0.0,
+            "healthy": self.healthy,
+            "circuit_open": self.open_until != 0.0,
+        }
+
+
+class BackendRouter:
+    """
+    Spreads completions over several backends, see `backends` in the config.
+
+    A conversation keeps going to the backend it used last, so its prompt prefix is still in
+    that backend's cache, unless that backend is unavailable or at its `capacity`. Otherwise
+    the backend with the fewest completions in flight for its `weight` is picked. Connection
+    errors, 5xx and 429 answers fail over to the next backend. After `failure_threshold` of
+    them in a row a backend's circuit opens and it gets no traffic for `cooldown` seconds,
+    then a single trial completion decides if it closes again. Every `health_interval` seconds
+    the backends' model lists are fetched in the background, backends that don't answer are
+    skipped until they do. If no backend is available the least loaded one is tried anyway.
+
+    The clients belong to the event loop they are first used on.
+    """
+
+    def __init__(
+        self,
+        backends: list[Backend],
+        failure_threshold: int = 3,
+        cooldown: float = 30,
+        health_interval: float = 15,
+        max_sticky: int = 4096,
+    ):
+        self.backends = backends
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.health_interval = health_interval
+        self.max_sticky = max_sticky
+        self.sticky: OrderedDict[str, Backend] = OrderedDict()
+        self._health_task: Optional[asyncio.Task] = None
+
+    def pick(self, conversation_id: Optional[str], exclude: list[Backend] = ()) -> Backend:
+        now = time.monotonic()
+        candidates = [backend for backend in self.backends if backend not in exclude]
+        available = [backend for backend in candidates if backend.available(now)] or candidates
+        sticky = self.sticky.get(conversation_id) if conversation_id else None
+        if sticky in available and not sticky.saturated:
+            backend = sticky
+        else:
+            unsaturated = [backend for backend in available if not backend.saturated]
+            backend = min(unsaturated or available, key=lambda backend: backend.load)
+        if conversation_id:
+            self.sticky[conversation_id] = backend
+            self.sticky.move_to_end(conversation_id)
+            while len(self.sticky) > self.max_sticky:
+                self.sticky.popitem(last=False)
+        return backend
+
+    def _started(self, backend: Backend):
+        backend.outstanding += 1
+        backend.requests += 1
+        if backend.open_until != 0.0:
+            backend.trial_in_flight = True
+
+    def _finished(self, backend: Backend, start: float, failed: Optional[bool]):
+        """`failed` is None when the request ended in a way that says nothing about the backend"""
+        backend.outstanding -= 1
+        backend.trial_in_flight = False
+        backend.total_latency += time.monotonic() - start
+        if failed is None:
+            return
+        if not failed:
+            backend.consecutive_failures = 0
+            backend.open_until = 0.0
+            return
+        backend.errors += 1
+        backend.consecutive_failures += 1
+        if backend.consecutive_failures >= self.failure_threshold:
+            if backend.open_until == 0.0:
+                failures = backend.consecutive_failures
+                print(f"Backend {backend.name} failed {failures} times in a row, pausing it")
+            backend.open_until = time.monotonic() + self.cooldown
+
+    async def create(self, conversation_id: Optional[str] = None, **kwargs):
+        """
+        `chat.completions.create` on the backend picked for the conversation, failing over to
+        the others. The model defaults to the backend's. With `stream=True` the chunks come
+        back as an async iterator, a backend can only be failed over until its stream starts.
+        """
+        self._ensure_health_checks()
+        tried = []
+        while True:
+            backend = self.pick(conversation_id, tried)
+            tried.append(backend)
+            self._started(backend)
+            start = time.monotonic()
+            backend_span = span("backend_request", backend=backend.name)
+            backend_span.__enter__()
+            try:
+                response = await backend.client.chat.completions.create(
+                    **dict({"model": backend.model_name}, **kwargs)
+                )
+            except BaseException as e:
+                failed = isinstance(e, FAILOVER_ERRORS)
+                self._finished(backend, start, True if failed else None)
+                backend_span.__exit__(type(e), e, e.__traceback__)
+                if failed and len(tried) < len(self.backends):
+                    print(f"Backend {backend.name} failed ({e!r}), trying another one")
+                    continue
+                raise
+            if kwargs.get("stream"):
+                return self._stream(backend, start, backend_span, response)
+            self._finished(backend, start, False)
+            backend_span.__exit__(None, None, None)
+            return response
+
+    async def _stream(self, backend: Backend, start: float, backend_span, stream) -> AsyncIterator:
+        try:
+            async for chunk in stream:
+                yield chunk
+        except BaseException as e:
+            self._finished(backend, start, True if isinstance(e, FAILOVER_ERRORS) else None)
+            backend_span.__exit__(type(e), e, e.__traceback__)
+            raise
+        self._finished(backend, start, False)
+        backend_span.__exit__(None, None, None)
+
+    def _ensure_health_checks(self):
+        if self.health_interval and len(self.backends) > 1:
+            if self._health_task is None or self._health_task.done():
+                self._health_task = asyncio.get_running_loop().create_task(self._health_loop())
+
+    async def _health_loop(self):
+        while True:
+            await asyncio.sleep(self.health_interval)
+            await asyncio.gather(*(self.check_health(backend) for backend in self.backends))
+
+    async def check_health(self, backend: Backend):
+        try:
+            await asyncio.wait_for(backend.client.models.list(), HEALTH_CHECK_TIMEOUT)
+        except Exception as e:
+            if backend.healthy:
+                print(f"Backend {backend.name} failed its health check: {e!r}")
+            backend.healthy = False
+        else:
+            backend.healthy = True
+
+    async def aclose(self):
+        if self._health_task is not None:
+            self._health_task.cancel()
+            self._health_task = None
+        for backend in self.backends:
+            await backend.client.close()
+
+    def stats(self) -> dict:
+        return {backend.name: backend.stats() for backend in self.backends}
+
+
+def create_router(config: dict, max_connections: int = 32) -> BackendRouter:
+    """
+    Builds the router from `backends` in the config, a list of {"api_url", "api_key",
+    "model_name", "weight", "capacity"}, or from `api_url` alone like older configs have
+    """
+    backend_configs = config.get("backends") or [
+        {"api_url": config.get("api_url"), "api_key": config.get("api_key")}
+    ]
+    backends = []
+    for backend_config in backend_configs:
+        name = backend_config.get("name", backend_config.get("api_url"))
+        weight = float(backend_config.get("weight", 1))
+        if weight <= 0:
+            raise ValueError(f"The weight of backend {name} must be above 0, not {weight}")
+        # Every backend gets its own connection pool, shared by every conversation
+        client = AsyncOpenAI(
+            base_url=backend_config.get("api_url"),
+            api_key=backend_config.get("api_key", config.get("api_key")),
+            http_client=DefaultAsyncHttpxClient(
+                limits=httpx.Limits(
+                    max_connections=max_connections,
+                    max_keepalive_connections=max_connections,
+                )
+            ),
+            # The router fails over instead of retrying the same backend
+            max_retries=0 if len(backend_configs) > 1 else 2,
+        )
+        capacity = backend_config.get("capacity")
+        backends.append(
+            Backend(
+                name,
+                client,
+                backend_config.get("model_name", config.get("model_name")),
+                weight=weight,
+                capacity=int(capacity) if capacity is not None else None,
+            )
+        )
+    router_config = config.get("router", {})
+    return BackendRouter(
+        backends,
+        failure_threshold=int(router_config.get("failure_threshold", 3)),
+        cooldown=float(router_config.get("cooldown", 30)),
+        health_interval=float(router_config.get("health_interval", 15)),
+    )
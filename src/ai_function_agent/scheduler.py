@@ -0,0 +1,130 @@
+import asyncio
+import math
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+
+
+class QueueFullError(Exception):
+    def __init__(self, retry_after: int):
+        self.retry_after = retry_after
+        super().__init__(f"Too many prompts waiting, try again in {retry_after}s")
+
+
+class TurnScheduler:
+    """
+    Admission control for the turns of the web server. At most `max_concurrent` turns run at
+    once (match it to the slots of the backend, more just makes it thrash), and turns of the
+    same conversation run strictly one after another so they never race on loading and
+    saving it.
+
+    Turns that can't start wait in a queue per conversation, and freed up slots go round robin
+    over the conversations, so one conversation sending a burst of prompts doesn't hold up the
+    others. Once `max_queue` turns are waiting new ones are refused with a QueueFullError
+    saying how long to wait, estimated from how long turns have been taking. Only used from
+    the event loop.
+    """
+
+    def __init__(self, max_concurrent: int = 4, max_queue: int = 64):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.running: set[str] = set()
+        # Conversation id -> (future, time queued) of its waiting turns, in round robin order
+        self.waiting: OrderedDict[str, deque[tuple[asyncio.Future, float]]] = OrderedDict()
+        self.queued = 0
+        self.started = 0
+        self.rejected = 0
+        self.wait_time = 0.0
+        # Moving average of how long turns take, for Retry-After
+        self.turn_time = 1.0
+        self._started_at: dict[str, float] = {}
+
+    @property
+    def full(self) -> bool:
+        return self.queued >= self.max_queue
+
+    def retry_after(self) -> int:
+        """Seconds until a slot is likely to open up for a turn queued behind everyone waiting"""
+        turns_ahead = self.queued / self.max_concurrent + 1
+        return max(1, math.ceil(turns_ahead * self.turn_time))
+
+    async def acquire(self, conversation_id: str):
+        """Waits until a turn of the conversation may start, raises QueueFullError if the queue is full"""
+        future = asyncio.get_running_loop().create_future()
+        entry = (future, time.monotonic())
+        self.waiting.setdefault(conversation_id, deque()).append(entry)
+        self.queued += 1
+        self._dispatch()
+        if not future.done() and self.queued > self.max_queue:
+            self._remove(conversation_id, entry)
+            self.rejected += 1
+            raise QueueFullError(self.retry_after())
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was handed over just as the caller went away, pass it on
+                self.release(conversation_id)
+            else:
+                self._remove(conversation_id, entry)
+            raise
+
+    def release(self, conversation_id: str):
+        """Ends the running turn of the conversation and starts the next turns that may go"""
+        self.running.discard(conversation_id)
+        started_at = self._started_at.pop(conversation_id, None)
+        if started_at is not None:
+            self.turn_time = 0.8 * self.turn_time + 0.2 * (time.monotonic() - started_at)
+        self._dispatch()
+
+    @asynccontextmanager
+    async def turn(self, conversation_id: str):
+        await self.acquire(conversation_id)
+        try:
+            yield
+        finally:
+            self.release(conversation_id)
+
+    def _start(self, conversation_id: str, waited: float):
+        self.running.add(conversation_id)
+        self._started_at[conversation_id] = time.monotonic()
+        self.started += 1
+        self.wait_time += waited
+
+    def _remove(self, conversation_id: str, entry: tuple):
+        queue = self.waiting.get(conversation_id)
+        if queue is not None and entry in queue:
+            queue.remove(entry)
+            self.queued -= 1
+            if not queue:
+                del self.waiting[conversation_id]
+
+    def _dispatch(self):
+        while len(self.running) < self.max_concurrent:
+            conversation_id = next(
+                (key for key in self.waiting if key not in self.running), None
+            )
+            if conversation_id is None:
+                return
+            queue = self.waiting.pop(conversation_id)
+            future, queued_at = queue.popleft()
+            self.queued -= 1
+            if queue:
+                # Back of the line for its next turn
+                self.waiting[conversation_id] = queue
+            if future.done():
+                # Cancelled, its task just hasn't taken it out of the queue yet
+                continue
+            self._start(conversation_id, time.monotonic() - queued_at)
+            future.set_result(None)
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrent": self.max_concurrent,
+            "running": len(self.running),
+            "queued": self.queued,
+            "max_queue": self.max_queue,
+            "started": self.started,
+            "rejected": self.rejected,
+            "average_wait": self.wait_time / self.started if self.started else 0.0,
+        }
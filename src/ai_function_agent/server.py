@@ -1,124 +1,125 @@
-import glob
-import inspect
-import json
+import asyncio
 import os
-from datetime import datetime
-from importlib import util
-from typing import Optional
+import sys
+from contextlib import asynccontextmanager
+from functools import partial
+from typing import AsyncIterator, Callable, Optional
 import uuid
 
 from fastapi import FastAPI, HTTPException
-from openai import OpenAI
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from openai import NOT_GIVEN
 from openai.types.chat.chat_completion import Choice
 from openai.types.chat.chat_completion_message_tool_call import (
     ChatCompletionMessageToolCall,
 )
+from openai.types.completion_usage import CompletionUsage
+from starlette.background import BackgroundTask
 import uvicorn
 
-# Initialize FastAPI app
-app = FastAPI()
+from ai_function_agent.config import config, join_path
+from ai_function_agent.context_window import create_context_window
+from ai_function_agent.conversation_cache import ConversationCache
+from ai_function_agent.conversation_store import create_conversation_store
+from ai_function_agent.jobs import Job, JobManager, TooManyJobsError
+from ai_function_agent.metrics import AgentMetrics
+from ai_function_agent.prompts import CacheHints, render_messages, system_message, user_message
+from ai_function_agent.router import create_router
+from ai_function_agent.scheduler import QueueFullError, TurnScheduler
+from ai_function_agent.streaming import ChatStreamAccumulator, format_sse
+from ai_function_agent.tool_executor import ToolExecutor
+from ai_function_agent.tool_http import http_client
+from ai_function_agent.tool_prefetch import ToolPrefetcher
+from ai_function_agent.tool_registry import Tool, ToolRegistry
+from ai_function_agent.tracing import NoopSpan, Span, span, tracer
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    await job_manager.shutdown()
+    await router.aclose()
+    await http_client.aclose()
+    tool_executor.shutdown(wait=False)
+    conversation_cache.close()
+    conversation_store.close()
+
 
-# Determine script location and define join_path lambda
-__location__ = os.path.dirname(os.path.realpath(__file__))
-join_path = lambda x: os.path.join(__location__, x)
+# Initialize FastAPI app
+app = FastAPI(lifespan=lifespan)
 
 # Set conversations directory using join_path
 CONVERSATIONS_DIR = join_path("conversations")
 os.makedirs(CONVERSATIONS_DIR, exist_ok=True)
 
-# Load or create configuration
-config_path = join_path("config.json")
-if not os.path.exists(config_path):
-    with open(config_path, "w") as fp:
-        config = {
-            "model_name": "Qwen",
-            "api_url": "http://localhost:8080/v1",
-            "api_key": "EMPTY",
-            "load_user_funcs": False,
-            "web_server": {"host": "127.0.0.1", "port": 8000, "reload": False},
-        }
-        json.dump(config, fp, indent=4)
-        print(f"\nNEW CONFIG FILE CREATED FOR EDITING: {config_path}")
-else:
-    with open(config_path, "r") as fp:
-        config = json.load(fp)
-
-# Set up OpenAI client
-client = OpenAI(base_url=config.get("api_url"), api_key=config.get("api_key"))
-
-
-# Function to import modules from glob pattern
-def glob_import(glob_str: str) -> tuple[dict, list]:
-    function_library = {}
-    functions = []
-    file_paths = glob.glob(glob_str)
-    for file_path in file_paths:
-        module_name = os.path.splitext(os.path.basename(file_path))[0]
-        spec = util.spec_from_file_location(module_name, file_path)
-        module = util.module_from_spec(spec)
-        spec.loader.exec_module(module)
-        if hasattr(module, "function"):
-            fn = module.function
-            if isinstance(fn, list):
-                for fnc in fn:
-                    function_library[fnc.__name__] = fnc
-            else:
-                function_library[fn.__name__] = fn
-        if hasattr(module, "function_spec"):
-            func_spec = module.function_spec
-            if isinstance(func_spec, list):
-                functions.extend(func_spec)
-            else:
-                functions.append(func_spec)
-    return function_library, functions
+# Completions go to the backends in the config (or just `api_url`) through the router, see
+# router.py. Each backend's connection pool is shared by every conversation
+router = create_router(config, max_connections=int(config.get("max_connections", 32)))
 
 
-# Import system and user functions
-system_function_library, TOOLS = glob_import(join_path("functions/system/*.py"))
-function_library = system_function_library
-functions = TOOLS
+# Conversations only ever get appended to, see conversation_store.py for the backends
+conversation_store = create_conversation_store(
+    config.get("conversation_store", "jsonl"), CONVERSATIONS_DIR
+)
+# Hot conversations stay in memory and are written to the store in the background
+conversation_cache_config = config.get("conversation_cache", {})
+conversation_cache = ConversationCache(
+    conversation_store,
+    max_conversations=int(conversation_cache_config.get("max_conversations", 256)),
+    max_bytes=int(float(conversation_cache_config.get("max_mb", 64)) * 1024 * 1024),
+    flush_interval=float(conversation_cache_config.get("flush_interval", 1.0)),
+)
+
+
+# Keeps what is sent for each inference under a token budget, stored conversations stay complete
+context_window = create_context_window(config.get("context_window", {}))
 
+
+# Import system and user functions
+tool_registry = ToolRegistry()
+tool_registry.load(join_path("functions/system/*.py"))
 if config.get("load_user_funcs"):
-    user_function_library, USER_TOOLS = glob_import(join_path("functions/user/*.py"))
-    function_library.update(user_function_library)
-    functions.extend(USER_TOOLS)
-
-# Define system message
-system_prompt = inspect.cleandoc(
-    f"""
-    You are JARVIS, a helpful and witty assistant. 
-    You help a user with their tasks by using any of the functions available to you and your replies should always aim to be short but informative.
-    When a user refers to themselves in a prompt to create or recall a memory in the first person, change it to refer to 'The User'.
-    If you cannot answer a prompt based on information you have available, use your tools to find more information.
-    The current date is {datetime.today().strftime('%Y-%m-%d %H:%M:%S')}
-    """
+    tool_registry.load(join_path("functions/user/*.py"))
+
+# Blocking tools run on a bounded thread pool, ones marked "heavy" in their options on their own
+tool_executor = ToolExecutor(
+    tool_registry.options,
+    io_workers=int(config.get("tool_workers", 8)),
+    heavy_workers=int(config.get("heavy_tool_workers", 1)),
+    default_timeout=config.get("tool_timeout"),
 )
-system_message = {"role": "system", "content": system_prompt}
-
+# Starts side effect free tools while streamed completions are still coming in
+tool_prefetcher = ToolPrefetcher(
+    tool_registry, tool_executor, enabled=config.get("tool_prefetch", True)
+)
+# Shared by the network tools (weather, search), see tool_http.py
+http_client.configure(**config.get("tool_http", {}))
 
-# Helper functions
-def is_valid_tool_call(tool_call: ChatCompletionMessageToolCall) -> bool:
-    fn_name = tool_call.function.name
-    fn_args = json.loads(tool_call.function.arguments)
-    fnc = function_library.get(fn_name)
-    if not fnc:
-        return False
-    params = inspect.signature(fnc).parameters
-    fnc_args = params.keys()
-    model_args = fn_args.keys()
-    extra = [arg for arg in model_args if arg not in fnc_args]
-    if len(extra) != 0:
-        return False
-    missing = fnc_args - model_args
-    if len(missing) == 0:
-        return list(params.keys()) == list(fn_args.keys())
-    for key in missing:
-        param = params.get(key)
-        if param.default == inspect.Parameter.empty:
-            return False
-    return True
+# Which prompt caching hints to send the backend, if any
+prompt_cache_config = config.get("prompt_cache", {})
+cache_hints = CacheHints(
+    prompt_cache_config.get("hints"), int(prompt_cache_config.get("slots", 1))
+)
+# Limits how many turns run at once, queuing the rest fairly across conversations
+scheduler_config = config.get("scheduler", {})
+scheduler = TurnScheduler(
+    max_concurrent=int(scheduler_config.get("max_concurrent", 4)),
+    max_queue=int(scheduler_config.get("max_queue", 64)),
+)
+# Turns run in the background for /prompt?background=true
+jobs_config = config.get("jobs", {})
+job_manager = JobManager(
+    ttl=float(jobs_config.get("ttl", 3600)), max_jobs=int(jobs_config.get("max_jobs", 1000))
+)
+# Prometheus metrics for GET /metrics, made from the spans every turn records. With them
+# disabled nothing listens to the spans, so they cost next to nothing
+agent_metrics = AgentMetrics()
+metrics_enabled = config.get("metrics", {}).get("enabled", True)
+if metrics_enabled:
+    tracer.add_listener(agent_metrics)
 
 
+# Helper functions
 def format_tool_message(tool_call: ChatCompletionMessageToolCall, fn_res: str) -> dict:
     resp = {"role": "tool", "name": tool_call.function.name, "content": fn_res}
     if tool_call.id:
@@ -141,108 +142,482 @@ def format_assistant_message(choice: Choice) -> tuple[dict, str]:
     return resp, reasoning
 
 
-def execute_functions(choice: Choice) -> list:
+def validate_tool_calls(tool_calls: list) -> list[tuple[Tool | None, dict | None, str | None]]:
+    """Parses and validates the arguments of every tool call once, see ToolRegistry.validate"""
+    with span("validation"):
+        return [
+            tool_registry.validate(tool_call.function.name, tool_call.function.arguments)
+            for tool_call in tool_calls
+        ]
+
+
+def get_valid_calls(validated: list) -> dict[int, tuple]:
+    """Maps the position of every valid tool call to the (name, function, args) to run"""
+    return {
+        n: (tool.name, tool, fn_args)
+        for n, (tool, fn_args, error) in enumerate(validated)
+        if error is None
+    }
+
+
+def format_tool_messages(
+    tool_calls: list, validated: list, fn_results: dict[int, str]
+) -> list:
+    # Tool messages go back in the order the model asked for them, invalid calls get told what was wrong
     tool_call_messages = []
-    tool_calls = choice.message.tool_calls
-    for tool_call in tool_calls:
-        fnc = function_library.get(tool_call.function.name)
-        if fnc and is_valid_tool_call(tool_call):
-            fn_args = json.loads(tool_call.function.arguments)
-            fn_res = fnc(**fn_args)
-            if not isinstance(fn_res, str):
-                fn_res = str(fn_res)
-            tool_call_messages.append(format_tool_message(tool_call, fn_res))
+    for n, tool_call in enumerate(tool_calls):
+        if n in fn_results:
+            tool_call_messages.append(format_tool_message(tool_call, fn_results[n]))
         else:
-            tool_call_messages.append(
-                format_tool_message(
-                    tool_call,
-                    "This function either does not exist, or the parameters provided were invalid.",
-                )
-            )
+            tool_call_messages.append(format_tool_message(tool_call, validated[n][2]))
     return tool_call_messages
 
 
+async def execute_functions(choice: Choice) -> list:
+    tool_calls = choice.message.tool_calls
+    # Validate every call first, then run the valid ones concurrently
+    validated = validate_tool_calls(tool_calls)
+    valid_calls = get_valid_calls(validated)
+    fn_results = await tool_executor.run_all(list(valid_calls.values()))
+    fn_results = dict(zip(valid_calls.keys(), fn_results))
+    return format_tool_messages(tool_calls, validated, fn_results)
+
+
+async def summarize(request: list) -> str:
+    """Asks the model for a summary of a conversation, see ContextWindow.prepare"""
+    response = await router.create(
+        messages=request,
+        max_tokens=context_window.summary_tokens,
+    )
+    return response.choices[0].message.content
+
+
+def record_usage(inference_span: Span | NoopSpan, usage: CompletionUsage | None):
+    """Adds the token usage a completion reported, if any, to its inference span"""
+    if usage is not None:
+        inference_span.set("prompt_tokens", usage.prompt_tokens)
+        inference_span.set("completion_tokens", usage.completion_tokens)
+
+
+async def prepare_messages(conversation_id: str, messages: list) -> list:
+    """The messages to send for the next inference of a conversation"""
+    with span("context_window"):
+        return await context_window.prepare_async(
+            render_messages(messages), conversation_id, tool_registry.specs, summarize
+        )
+
+
 # Conversation management functions
 def generate_conversation_id() -> str:
     return str(uuid.uuid4())
 
 
 def load_conversation(conversation_id: str) -> list:
-    file_path = os.path.join(CONVERSATIONS_DIR, f"{conversation_id}.json")
-    if not os.path.exists(file_path):
+    messages = conversation_cache.get(conversation_id)
+    if messages is None:
         raise HTTPException(status_code=404, detail="Conversation not found")
-    with open(file_path, "r") as f:
-        messages = json.load(f)
-        for message in messages:
-            message.pop("reasoning", "")
+    return messages
+
+
+async def fetch_conversation(conversation_id: str) -> list:
+    """Loads a conversation, only going to a worker thread if it isn't cached"""
+    with span("conversation_load"):
+        messages = conversation_cache.get_cached(conversation_id)
+        if messages is None:
+            messages = await asyncio.to_thread(load_conversation, conversation_id)
         return messages
 
 
-def save_conversation(conversation_id: str, messages: list):
-    file_path = os.path.join(CONVERSATIONS_DIR, f"{conversation_id}.json")
-    with open(file_path, "w") as f:
-        json.dump(messages, f, indent=2)
+def save_conversation(conversation_id: str, new_messages: list):
+    """Appends the messages added during a turn to the stored conversation"""
+    with span("conversation_save"):
+        conversation_cache.append(conversation_id, new_messages)
 
 
-# FastAPI endpoints
-@app.post("/prompt")
-async def send_prompt(prompt: str, conversation_id: Optional[str] = None):
-    """Creates or continues a conversation thread. To create a thread, do not include a conversation_id. To continue one, include the conversation_id returned after your first message"""
+async def start_turn(prompt: str, conversation_id: str, new: bool) -> tuple[list, int]:
+    """
+    Starts a new conversation or loads an existing one, and appends the user's prompt.
+    Also returns the index of the first message that isn't saved yet.
+    """
     if not prompt:
         raise HTTPException(status_code=400, detail="Prompt cannot be empty")
 
     # Start new conversation or load existing one
-    if conversation_id is None:
-        conversation_id = generate_conversation_id()
+    if new:
         messages = [system_message]
+        first_unsaved = 0
     else:
-        messages = load_conversation(conversation_id)
+        messages = await fetch_conversation(conversation_id)
+        first_unsaved = len(messages)
 
     # Append user's prompt
-    messages.append({"role": "user", "content": prompt})
+    messages.append(user_message(prompt))
+    return messages, first_unsaved
+
+
+async def stream_turn(conversation_id: str, messages: list, first_unsaved: int):
+    """Runs the tool loop with streamed completions, yielding server-sent events as things happen"""
+    yield format_sse("start", {"conversation_id": conversation_id})
+    with span("turn") as turn_span:
+        finished = False
+        rounds = 0
+        while not finished:
+            rounds += 1
+            accumulator = ChatStreamAccumulator()
+            prefetch = tool_prefetcher.round()
+            # Calls started early are cancelled if the reply doesn't end up making them, and if
+            # the round fails or the client goes away before they're done
+            try:
+                try:
+                    payload = await prepare_messages(conversation_id, messages)
+                    with span("inference", round=rounds) as inference_span:
+                        # Usage is only asked for while tracing, not every backend supports it
+                        stream_options = (
+                            {"include_usage": True} if inference_span.recording else NOT_GIVEN
+                        )
+                        stream = await router.create(
+                            conversation_id,
+                            messages=payload,
+                            tools=tool_registry.specs,
+                            tool_choice="auto",
+                            extra_body=cache_hints.extra_body(conversation_id),
+                            stream_options=stream_options,
+                            stream=True,
+                        )
+                        async for chunk in stream:
+                            for event, data in accumulator.add(chunk):
+                                yield format_sse(event, data)
+                            prefetch.observe(accumulator.tool_calls)
+                        record_usage(inference_span, accumulator.usage)
+                except Exception as e:
+                    print(e)
+                    print(messages)
+                    yield format_sse("error", {"detail": str(e)})
+                    return
+                choice = accumulator.to_choice()
+                assistant_message, reasoning = format_assistant_message(choice)
+                messages.append(assistant_message)
+                copied_assistant_message = assistant_message.copy()
+                copied_assistant_message["reasoning"] = reasoning
+                yield format_sse("message", copied_assistant_message)
+
+                if choice.finish_reason != "tool_calls":
+                    finished = True
+                    continue
+                tool_calls = choice.message.tool_calls
+                validated = validate_tool_calls(tool_calls)
+                valid_calls = get_valid_calls(validated)
+                prefetched = prefetch.take(valid_calls)
+                for n in valid_calls:
+                    yield format_sse(
+                        "tool_call_start",
+                        {
+                            "id": tool_calls[n].id,
+                            "name": tool_calls[n].function.name,
+                            "arguments": tool_calls[n].function.arguments,
+                        },
+                    )
+                fn_results = {}
+                async for n, fn_res in tool_executor.run_as_completed(valid_calls, prefetched):
+                    fn_results[n] = fn_res
+                    yield format_sse(
+                        "tool_call_end",
+                        {
+                            "id": tool_calls[n].id,
+                            "name": tool_calls[n].function.name,
+                            "content": fn_res,
+                        },
+                    )
+                func_responses = format_tool_messages(tool_calls, validated, fn_results)
+                messages.extend(func_responses)
+                for func_response in func_responses:
+                    yield format_sse("message", func_response)
+            finally:
+                prefetch.discard()
+        turn_span.set("rounds", rounds)
+
+    await asyncio.to_thread(
+        save_conversation, conversation_id, messages[first_unsaved:]
+    )
+    yield format_sse("done", {"conversation_id": conversation_id})
+
+
+async def run_prompt(prompt: str, conversation_id: str, new: bool, job: Job = None) -> dict:
+    """
+    Runs a whole turn, returns the conversation_id and the messages added to the conversation.
+    A background job gets the new messages as soon as there are any.
+    """
+    messages, first_unsaved = await start_turn(prompt, conversation_id, new)
     new_messages = []
+    if job is not None:
+        new_messages = job.new_messages
     # Process AI response and tool calls
-    finished = False
-    while not finished:
-        try:
-            choices = client.chat.completions.create(
-                model=config["model_name"],
-                messages=messages,
-                tools=functions,
-                tool_choice="auto",
-            ).choices
-        except Exception as e:
-            print(e)
-            print(messages)
-            raise e
-        choice = choices[0]
-        assistant_message, reasoning = format_assistant_message(choice)
-        messages.append(assistant_message)
-        # Re-attach the reasoning field (removed for inference step) for the API response
-        copied_assistant_message = assistant_message.copy()
-        copied_assistant_message["reasoning"] = reasoning
-        new_messages.append(copied_assistant_message)
-
-        if choice.finish_reason != "tool_calls":
-            finished = True
-            continue
-        func_responses = execute_functions(choice)
-        messages.extend(func_responses)
-        new_messages.extend(func_responses)
-
-    # Save updated conversation (without reasoning included)
-    save_conversation(conversation_id, messages)
+    with span("turn") as turn_span:
+        finished = False
+        rounds = 0
+        while not finished:
+            rounds += 1
+            try:
+                payload = await prepare_messages(conversation_id, messages)
+                with span("inference", round=rounds) as inference_span:
+                    response = await router.create(
+                        conversation_id,
+                        messages=payload,
+                        tools=tool_registry.specs,
+                        tool_choice="auto",
+                        extra_body=cache_hints.extra_body(conversation_id),
+                    )
+                    record_usage(inference_span, response.usage)
+                choices = response.choices
+            except Exception as e:
+                print(e)
+                print(messages)
+                raise e
+            choice = choices[0]
+            assistant_message, reasoning = format_assistant_message(choice)
+            messages.append(assistant_message)
+            # Re-attach the reasoning field (removed for inference step) for the API response
+            copied_assistant_message = assistant_message.copy()
+            copied_assistant_message["reasoning"] = reasoning
+            new_messages.append(copied_assistant_message)
+
+            if choice.finish_reason != "tool_calls":
+                finished = True
+                continue
+            func_responses = await execute_functions(choice)
+            messages.extend(func_responses)
+            new_messages.extend(func_responses)
+        turn_span.set("rounds", rounds)
+
+    # Save the new messages (without reasoning included)
+    await asyncio.to_thread(
+        save_conversation, conversation_id, messages[first_unsaved:]
+    )
 
     return {"conversation_id": conversation_id, "new_messages": new_messages}
 
 
+# New conversations whose first turn isn't over yet -> set once it is
+first_turns: dict[str, asyncio.Event] = {}
+
+
+def claim_conversation_id(conversation_id: Optional[str]) -> tuple[str, bool]:
+    """
+    The conversation the turn runs in and whether it's new. A new conversation gets its id
+    before the turn is scheduled, and prompts sent with it while its first turn hasn't saved
+    it yet (the id is in the stream's start event and the job) wait for that turn.
+    """
+    if conversation_id is None:
+        conversation_id = generate_conversation_id()
+        first_turns[conversation_id] = asyncio.Event()
+        return conversation_id, True
+    return conversation_id, False
+
+
+def first_turn_over(conversation_id: str):
+    first_turn = first_turns.pop(conversation_id, None)
+    if first_turn is not None:
+        first_turn.set()
+
+
+def queue_full(error: QueueFullError) -> HTTPException:
+    return HTTPException(
+        status_code=429, detail=str(error), headers={"Retry-After": str(error.retry_after)}
+    )
+
+
+async def admit_turn(key: str, new: bool):
+    """Waits for the scheduler to let the turn start, refusing it with a 429 if the queue is full"""
+    try:
+        with span("queue_wait"):
+            first_turn = None if new else first_turns.get(key)
+            if first_turn is not None:
+                await first_turn.wait()
+            await scheduler.acquire(key)
+    except BaseException as e:
+        # Refused or the client went away, follow-up prompts can't wait on this turn anymore
+        if new:
+            first_turn_over(key)
+        if isinstance(e, QueueFullError):
+            raise queue_full(e)
+        raise
+
+
+@asynccontextmanager
+async def scheduled_turn(conversation_id: str, new: bool):
+    await admit_turn(conversation_id, new)
+    try:
+        yield
+    finally:
+        scheduler.release(conversation_id)
+        first_turn_over(conversation_id)
+
+
+def release_once(key: str) -> Callable[[], None]:
+    released = False
+
+    def release():
+        nonlocal released
+        if not released:
+            released = True
+            scheduler.release(key)
+            first_turn_over(key)
+
+    return release
+
+
+async def run_job(job: Job, new: bool):
+    with span("queue_wait"):
+        first_turn = None if new else first_turns.get(job.conversation_id)
+        if first_turn is not None:
+            await first_turn.wait()
+        await scheduler.acquire(job.conversation_id)
+    try:
+        job.status = "running"
+        await run_prompt(job.prompt, job.conversation_id, new, job)
+    finally:
+        scheduler.release(job.conversation_id)
+
+
+async def release_when_done(events: AsyncIterator[str], release: Callable[[], None]):
+    try:
+        async for event in events:
+            yield event
+    finally:
+        release()
+
+
+# FastAPI endpoints
+# Documented in the OpenAPI spec, see queue_full
+QUEUE_FULL_RESPONSE = {
+    429: {"description": "Too many prompts waiting, try again after the Retry-After header's seconds"}
+}
+
+
+@app.post(
+    "/prompt",
+    responses={
+        **QUEUE_FULL_RESPONSE,
+        202: {"description": "With background=true, the job running the turn"},
+    },
+)
+async def send_prompt(
+    prompt: str, conversation_id: Optional[str] = None, background: bool = False
+):
+    """Creates or continues a conversation thread. To create a thread, do not include a conversation_id. To continue one, include the conversation_id returned after your first message. Answers 429 with Retry-After when too many prompts are waiting. With background=true the turn runs as a job and its job_id is returned right away, see /jobs/{job_id}"""
+    if background and not prompt:
+        raise HTTPException(status_code=400, detail="Prompt cannot be empty")
+    conversation_id, new = claim_conversation_id(conversation_id)
+    if background:
+        try:
+            if scheduler.full:
+                raise queue_full(QueueFullError(scheduler.retry_after()))
+            try:
+                job = job_manager.submit(prompt, conversation_id, partial(run_job, new=new))
+            except TooManyJobsError as e:
+                # A job's room frees up once a running one finishes, about when a turn slot does
+                raise HTTPException(
+                    status_code=429,
+                    detail=str(e),
+                    headers={"Retry-After": str(scheduler.retry_after())},
+                )
+        except HTTPException:
+            first_turn_over(conversation_id)
+            raise
+        # Also covers jobs cancelled before they ever ran
+        job.task.add_done_callback(lambda task: first_turn_over(conversation_id))
+        return JSONResponse(job.to_dict(), status_code=202)
+
+    async with scheduled_turn(conversation_id, new):
+        result = await run_prompt(prompt, conversation_id, new)
+    with span("serialization"):
+        return JSONResponse(result)
+
+
+@app.post("/prompt/stream", responses=QUEUE_FULL_RESPONSE)
+async def stream_prompt(prompt: str, conversation_id: Optional[str] = None):
+    """Same as /prompt, but streams the turn back as server-sent events: start, reasoning and content deltas, tool_call_start/tool_call_end, each finished message and done with the conversation_id"""
+    conversation_id, new = claim_conversation_id(conversation_id)
+    await admit_turn(conversation_id, new)
+    release = release_once(conversation_id)
+    try:
+        messages, first_unsaved = await start_turn(prompt, conversation_id, new)
+    except BaseException:
+        release()
+        raise
+    return StreamingResponse(
+        release_when_done(stream_turn(conversation_id, messages, first_unsaved), release),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        # The stream never starts if the client is gone before it does
+        background=BackgroundTask(release),
+    )
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Status of a background job: queued, running, done, failed or cancelled, with the messages its turn added so far"""
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """Cancels a background job that hasn't finished, nothing from its turn is saved"""
+    job = await job_manager.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+
 @app.get("/conversation/{conversation_id}")
 async def get_conversation(conversation_id: str):
     """Retrieves a conversation in its entirety from the local conversation history"""
-    messages = load_conversation(conversation_id)
+    messages = await fetch_conversation(conversation_id)
     return {"conversation_id": conversation_id, "messages": messages}
 
 
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus metrics for the stages of every turn: inference, tools, conversation loading and saving"""
+    if not metrics_enabled:
+        raise HTTPException(status_code=404, detail="Metrics are disabled in the config")
+    agent_metrics.set_scheduler(scheduler.stats())
+    agent_metrics.set_backends(router.stats())
+    return PlainTextResponse(agent_metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+def memory_stats() -> Optional[dict]:
+    """The memory engine's counters (index, embedding cache) if the memory tool loaded it here"""
+    # Don't import the engine (and torch) just to report on it, with the memory service
+    # enabled it reports these on its own /stats
+    memory_engine = sys.modules.get("ai_function_agent.memory_engine")
+    if memory_engine is None or memory_engine.engine is None:
+        return None
+    return memory_engine.engine.stats()
+
+
+@app.get("/stats")
+async def get_stats():
+    """Reports counters for the server's caches (conversations, tool results, embeddings), the context window, tool prefetching, the turn scheduler, background jobs and the LLM backends"""
+    stats = {
+        "conversation_cache": conversation_cache.stats(),
+        "context_window": context_window.stats(),
+        "tool_cache": tool_executor.cache.stats(),
+        "tool_prefetch": tool_prefetcher.stats(),
+        "tool_http": http_client.stats(),
+        "scheduler": scheduler.stats(),
+        "jobs": job_manager.stats(),
+        "backends": router.stats(),
+    }
+    memory = memory_stats()
+    if memory is not None:
+        stats["memory"] = memory
+    return stats
+
+
 def start():
     web_server_config = config.get("web_server", {})
     host = web_server_config.get("host", "127.0.0.1")
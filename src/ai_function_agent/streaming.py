@@ -0,0 +1,83 @@
+import json
+
+from openai.types.chat.chat_completion import Choice
+from openai.types.chat.chat_completion_chunk import ChatCompletionChunk
+
+from ai_function_agent.tracing import span
+
+
+class ChatStreamAccumulator:
+    """Rebuilds a complete Choice out of the chunks of a `stream=True` completion.
+
+    `add` returns the events worth forwarding to a client as they arrive: content
+    deltas, and reasoning deltas for backends that stream the reasoning separately
+    (`reasoning` or llama.cpp's `reasoning_content`). Token usage is kept if the backend
+    sends it (`stream_options={"include_usage": True}`).
+    """
+
+    def __init__(self):
+        self.content: list[str] = []
+        self.reasoning: list[str] = []
+        self.tool_calls: dict[int, dict] = {}
+        self.finish_reason = None
+        self.usage = None
+
+    def add(self, chunk: ChatCompletionChunk) -> list[tuple[str, dict]]:
+        events = []
+        if chunk.usage is not None:
+            self.usage = chunk.usage
+        for choice in chunk.choices:
+            # We only ever ask for one choice
+            if choice.index != 0:
+                continue
+            delta = choice.delta
+            extra = delta.model_extra or {}
+            reasoning = extra.get("reasoning") or extra.get("reasoning_content")
+            if reasoning:
+                self.reasoning.append(reasoning)
+                events.append(("reasoning", {"delta": reasoning}))
+            if delta.content:
+                self.content.append(delta.content)
+                events.append(("content", {"delta": delta.content}))
+            for tool_call_delta in delta.tool_calls or []:
+                tool_call = self.tool_calls.setdefault(
+                    tool_call_delta.index,
+                    {
+                        "id": "",
+                        "type": "function",
+                        "function": {"name": "", "arguments": ""},
+                    },
+                )
+                if tool_call_delta.id:
+                    tool_call["id"] = tool_call_delta.id
+                if tool_call_delta.function:
+                    if tool_call_delta.function.name:
+                        tool_call["function"]["name"] += tool_call_delta.function.name
+                    if tool_call_delta.function.arguments:
+                        tool_call["function"][
+                            "arguments"
+                        ] += tool_call_delta.function.arguments
+            if choice.finish_reason:
+                self.finish_reason = choice.finish_reason
+        return events
+
+    def to_choice(self) -> Choice:
+        message = {"role": "assistant", "content": "".join(self.content) or None}
+        if self.reasoning:
+            message["reasoning"] = "".join(self.reasoning)
+        if self.tool_calls:
+            message["tool_calls"] = [
+                self.tool_calls[index] for index in sorted(self.tool_calls)
+            ]
+        return Choice.model_validate(
+            {
+                "index": 0,
+                "finish_reason": self.finish_reason or "stop",
+                "message": message,
+            }
+        )
+
+
+def format_sse(event: str, data: dict) -> str:
+    with span("serialization"):
+        return f"event: {event}\ndata: {json.dumps(data)}\n\n"
@@ -0,0 +1,118 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable
+
+DEFAULT_TTL = 300
+DEFAULT_MAX_SIZE = 256
+
+
+def retrieve_exception(task: asyncio.Task):
+    # Everyone waiting on a failed call may have gone, don't warn that nobody saw the exception
+    if not task.cancelled():
+        task.exception()
+
+
+class ToolCacheStats:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        # Calls that waited for an identical call already running instead of making their own
+        self.coalesced = 0
+        self.evictions = 0
+
+    def to_dict(self) -> dict:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "hit_rate": (self.hits + self.coalesced) / lookups if lookups else 0.0,
+        }
+
+
+class ToolResultCache:
+    """
+    Results of tools that opted in with `"cache"` in their `function_options`, kept for `ttl`
+    seconds, at most `max_size` per tool (least recently used go first).
+
+    While a call is running, identical calls wait for its result instead of making their own,
+    so a burst of the same request only reaches the upstream service once. Failed and timed
+    out calls aren't cached. Only used from the event loop (the CLI's `tool_loop` or the web
+    server's), calls in flight are tracked per loop in case it's used from another one.
+    """
+
+    def __init__(self):
+        self.entries: dict[str, OrderedDict[str, tuple[float, str]]] = {}
+        self.counters: dict[str, ToolCacheStats] = {}
+        self._loop = None
+        self._in_flight: dict[tuple[str, str], asyncio.Task] = {}
+
+    def get(self, fn_name: str, key: str) -> str | None:
+        entries = self.entries.get(fn_name)
+        if not entries or key not in entries:
+            return None
+        expires, result = entries[key]
+        if expires < time.monotonic():
+            del entries[key]
+            return None
+        entries.move_to_end(key)
+        return result
+
+    def put(self, fn_name: str, key: str, result: str, options: dict):
+        entries = self.entries.setdefault(fn_name, OrderedDict())
+        entries[key] = (time.monotonic() + float(options.get("ttl", DEFAULT_TTL)), result)
+        entries.move_to_end(key)
+        max_size = int(options.get("max_size", DEFAULT_MAX_SIZE))
+        while len(entries) > max_size:
+            entries.popitem(last=False)
+            self.counters[fn_name].evictions += 1
+
+    async def get_or_run(
+        self, fn_name: str, key: str, options: dict, run: Callable[[], Awaitable[str]]
+    ) -> str:
+        stats = self.counters.setdefault(fn_name, ToolCacheStats())
+        result = self.get(fn_name, key)
+        if result is not None:
+            stats.hits += 1
+            return result
+
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self._in_flight = {}
+        in_flight = self._in_flight.get((fn_name, key))
+        if in_flight is not None:
+            stats.coalesced += 1
+            return await asyncio.shield(in_flight)
+
+        stats.misses += 1
+        # The call runs as its own task, so the caller that started it going away (a client
+        # disconnecting) doesn't cancel it for the others waiting on it
+        task = loop.create_task(self._run(fn_name, key, options, run))
+        task.add_done_callback(retrieve_exception)
+        self._in_flight[(fn_name, key)] = task
+        return await asyncio.shield(task)
+
+    async def _run(
+        self, fn_name: str, key: str, options: dict, run: Callable[[], Awaitable[str]]
+    ) -> str:
+        try:
+            result = await run()
+            self.put(fn_name, key, result, options)
+            return result
+        finally:
+            self._in_flight.pop((fn_name, key), None)
+
+    def clear(self, fn_name: str | None = None):
+        if fn_name is None:
+            self.entries.clear()
+        else:
+            self.entries.pop(fn_name, None)
+
+    def stats(self) -> dict:
+        return {
+            fn_name: dict(stats.to_dict(), size=len(self.entries.get(fn_name, ())))
+            for fn_name, stats in self.counters.items()
+        }
@@ -1,130 +1,89 @@
-import glob
-import inspect
+import asyncio
 import json
 import os
-from datetime import datetime
-from importlib import util
-from typing import Callable
+import threading
 
-from openai import OpenAI
-from openai.types.chat.chat_completion import Choice
+from openai.types.chat.chat_completion import ChatCompletion, Choice
 from openai.types.chat.chat_completion_message_tool_call import (
     ChatCompletionMessageToolCall,
 )
 
-__location__ = os.path.dirname(os.path.realpath(__file__))
-
-join_path = lambda x: os.path.join(__location__, x)
-
-
-config_path = join_path("config.json")
-
-if not os.path.exists(config_path):
-    # User's config file doesn't exist, create one
-    with open(config_path, "w") as fp:
-        config = {
-            "model_name": "Qwen",
-            "api_url": "http://localhost:8080/v1",
-            "api_key": "EMPTY",
-            "load_user_funcs": False,
-        }
-        json.dump(config, fp, indent=4)
-        print(f"\nNEW CONFIG FILE CREATED FOR EDITING: {config_path}")
-else:
-    # Load the user's config file
-    with open(join_path("config.json"), "r") as fp:
-        config = json.load(fp)
-
-# Set up OpenAI API client
-client = OpenAI(base_url=config.get("api_url"), api_key=config.get("api_key"))
-
-
-def glob_import(glob_str: str) -> tuple[list[dict], dict]:
-    function_spec: list = []
-    functions: dict = {}
-    gui_file_paths = glob.glob(glob_str)
-
-    for file_path in gui_file_paths:
-        module_name = os.path.splitext(os.path.basename(file_path))[0]
-        spec = util.spec_from_file_location(module_name, file_path)
-        module = util.module_from_spec(spec)
-        spec.loader.exec_module(module)
-        if getattr(module, "function"):
-            fn = getattr(module, "function")
-            if isinstance(fn, list):
-                for fnc in fn:
-                    fn_name = fnc.__name__
-                    functions[fn_name] = fnc
-            else:
-                fn_name = fn.__name__
-                functions[fn_name] = fn
-        if getattr(module, "function_spec"):
-            func_spec = getattr(module, "function_spec")
-            if isinstance(func_spec, list):
-                function_spec.extend(func_spec)
-            else:
-                function_spec.append(func_spec)
-
-    return functions, function_spec
+from ai_function_agent.config import config, join_path
+from ai_function_agent.context_window import create_context_window
+from ai_function_agent.prompts import CacheHints, render_messages, system_message, user_message
+from ai_function_agent.router import BackendRouter, create_router
+from ai_function_agent.tool_executor import ToolExecutor
+from ai_function_agent.tool_http import http_client
+from ai_function_agent.tool_registry import Tool, ToolRegistry
+from ai_function_agent.tracing import span
+
+# Keeps what is sent for each inference under a token budget, the chat history stays complete
+context_window = create_context_window(config.get("context_window", {}))
+# Which prompt caching hints to send the backend, if any
+prompt_cache_config = config.get("prompt_cache", {})
+cache_hints = CacheHints(
+    prompt_cache_config.get("hints"), int(prompt_cache_config.get("slots", 1))
+)
+
+# Built by setup() when the CLI starts rather than on import
+router: BackendRouter = None
+tool_registry: ToolRegistry = None
+tool_executor: ToolExecutor = None
+tool_loop: asyncio.AbstractEventLoop = None
+
+
+def setup():
+    """Builds the router, the tools and the event loop they run on"""
+    global router, tool_registry, tool_executor, tool_loop
+    # Completions go to the backends in the config (or just `api_url`) through the router, see
+    # router.py. Its clients are async, they run on tool_loop
+    router = create_router(config)
+
+    # Import all system functions
+    tool_registry = ToolRegistry()
+    tool_registry.load(join_path("functions/system/*.py"))
+
+    # Tool calls from one assistant turn run concurrently on these thread pools
+    tool_executor = ToolExecutor(
+        tool_registry.options,
+        io_workers=int(config.get("tool_workers", 8)),
+        heavy_workers=int(config.get("heavy_tool_workers", 1)),
+        default_timeout=config.get("tool_timeout"),
+    )
+    # Async tools share pooled connections, which belong to one event loop, so every turn runs
+    # its tool calls on the same one, running in the background
+    tool_loop = asyncio.new_event_loop()
+    threading.Thread(target=tool_loop.run_forever, name="tool-loop", daemon=True).start()
+    http_client.configure(**config.get("tool_http", {}))
+
+    if config.get("load_user_funcs"):
+        load_user_funcs()
 
 
 def load_user_funcs():
-    global system_function_library, function_library, functions
     print("Loading user functions...")
-    user_function_library, USER_TOOLS = glob_import(join_path("functions/user/*.py"))
-    function_library = system_function_library | user_function_library
-    functions.extend(USER_TOOLS)
+    tool_registry.load(join_path("functions/user/*.py"))
     print("User functions loaded!")
 
 
-# Import all system functions
-system_function_library, TOOLS = glob_import(join_path("functions/system/*.py"))
-function_library = system_function_library
-
-functions = []
-functions.extend(TOOLS)
-
-if config.get("load_user_funcs"):
-    load_user_funcs()
-
-
-def is_valid_tool_call(tool_call: ChatCompletionMessageToolCall) -> bool:
-    fn_name = tool_call.function.name
-    fn_args = json.loads(tool_call.function.arguments)
-    # Checks if the function exists
-    fnc = get_actual_function(fn_name)
-    if not fnc:
-        return False
-    params = inspect.signature(fnc).parameters
-    fnc_args = params.keys()
-    model_args = fn_args.keys()
-
-    # Check for extra arguments we aren't expecting
-    extra = [arg for arg in model_args if arg not in fnc_args]
-    if len(extra) != 0:
-        return False
-
-    # See if any arguments are missing
-    missing = fnc_args - model_args
-    # No args are missing
-    if len(missing) == 0:
-        # Check that the keys match
-        return list(params.keys()) == list(fn_args.keys())
-    # Check if the "missing" parameters have no default value
-    for key in missing:
-        param = params.get(key)
-        if param.default == inspect.Parameter.empty:
-            return False
-    return True
-
-
-def print_func_calls(choice: Choice):
+def validate_tool_calls(choice: Choice) -> list[tuple[Tool | None, dict | None, str | None]]:
+    """Parses and validates the arguments of every tool call once, see ToolRegistry.validate"""
+    with span("validation"):
+        return [
+            tool_registry.validate(tool_call.function.name, tool_call.function.arguments)
+            for tool_call in choice.message.tool_calls
+        ]
+
+
+def print_func_calls(choice: Choice, validated: list):
     print("\nFunctions to call (invalid functions will be ignored!): ")
     tool_calls = choice.message.tool_calls
-    for tool_call in tool_calls:
+    for tool_call, (_, _, error) in zip(tool_calls, validated):
         print(f"\n{tool_call.function.name}")
         print(f"    Args: {tool_call.function.arguments}")
-        print(f"    Valid: {('Y' if is_valid_tool_call(tool_call) else 'N')}")
+        print(f"    Valid: {('Y' if error is None else 'N')}")
+        if error is not None:
+            print(f"    Error: {error}")
         print("\n")
 
 
@@ -145,33 +104,45 @@ def format_assistant_message(choice: Choice) -> dict:
     return resp
 
 
-def get_actual_function(func_name: str) -> Callable | None:
-    return function_library.get(func_name)
-
-
-def execute_functions(choice: Choice) -> list:
-    tool_call_messages = []
+def execute_functions(choice: Choice, validated: list) -> list:
     tool_calls = choice.message.tool_calls
     print("Executing functions...\n")
-    for tool_call in tool_calls:
-        fnc = get_actual_function(tool_call.function.name)
-        if fnc:
-            if is_valid_tool_call(tool_call):
-                fn_args = json.loads(tool_call.function.arguments)
-                fn_res = fnc(**fn_args)
-                if not isinstance(fn_res, str):
-                    fn_res = str(fn_res)
-                tool_call_messages.append(format_tool_message(tool_call, fn_res))
-            else:
-                tool_call_messages.append(
-                    format_tool_message(
-                        tool_call,
-                        "This function either does not exist, or the parameters provided were invalid.",
-                    )
-                )
+    # Run all the valid calls concurrently
+    valid_calls = {
+        n: (tool.name, tool, fn_args)
+        for n, (tool, fn_args, error) in enumerate(validated)
+        if error is None
+    }
+    fn_results = asyncio.run_coroutine_threadsafe(
+        tool_executor.run_all(list(valid_calls.values())), tool_loop
+    ).result()
+    fn_results = dict(zip(valid_calls.keys(), fn_results))
+
+    # Keep the tool messages in the order the model asked for them, invalid calls get told what was wrong
+    tool_call_messages = []
+    for n, tool_call in enumerate(tool_calls):
+        if n in fn_results:
+            tool_call_messages.append(format_tool_message(tool_call, fn_results[n]))
+        else:
+            tool_call_messages.append(format_tool_message(tool_call, validated[n][2]))
     return tool_call_messages
 
 
+def complete(conversation_key: str | None = None, **kwargs) -> ChatCompletion:
+    """Gets a completion through the router, on the event loop its clients belong to"""
+    return asyncio.run_coroutine_threadsafe(
+        router.create(conversation_key, **kwargs), tool_loop
+    ).result()
+
+
+def summarize(request: list) -> str:
+    """Asks the model for a summary of the conversation, see ContextWindow.prepare"""
+    return complete(
+        messages=request,
+        max_tokens=context_window.summary_tokens,
+    ).choices[0].message.content
+
+
 def print_help():
     print("help")
     print("    Shows this text")
@@ -185,22 +156,47 @@ def print_help():
     )
 
 
-def main():
-    system_prompt = inspect.cleandoc(
-        f"""
-        You are JARVIS, a helpful and witty assistant. 
-        You help a user with their tasks by using any of the functions available to you and your replies should always aim to be short but informative.
-        When a user refers to themselves in a prompt to create or recall a memory in the first person, change it to refer to 'The User'.
-        If you cannot answer a prompt based on information you have available, use your tools to find more information.
-        The current date is {datetime.today().strftime('%Y-%m-%d %H:%M:%S')}
-        """
-    )
+def run_turn(messages: list, conversation_key: str = "cli"):
+    """Runs inference and the tools the model asks for until it answers, adding to messages"""
+    with span("turn") as turn_span:
+        finished = False
+        rounds = 0
+        while not finished:
+            rounds += 1
+            # Do initial inference to let the AI select function calls
+            with span("context_window"):
+                payload = context_window.prepare(
+                    render_messages(messages), conversation_key, tool_registry.specs, summarize
+                )
+            with span("inference", round=rounds):
+                choices = complete(
+                    conversation_key,
+                    messages=payload,
+                    tools=tool_registry.specs,
+                    tool_choice="auto",
+                    extra_body=cache_hints.extra_body(conversation_key),
+                ).choices
+            choice = choices[0]
+            assistant_messages = format_assistant_message(choice)
+            # Add AI response/function call requests to context
+            messages.append(assistant_messages)
+            # If there are no function calls, this will break the loop after this conversation turn
+            if choice.finish_reason != "tool_calls":
+                if choice.message.content:
+                    print(choice.message.content)
+                finished = True
+                continue
+            # Print all function calls the model is requesting
+            validated = validate_tool_calls(choice)
+            print_func_calls(choice, validated)
+            # Execute functions and add their responses to the context
+            func_responses = execute_functions(choice, validated)
+            messages.extend(func_responses)
+        turn_span.set("rounds", rounds)
 
-    system_message = {
-        "role": "system",
-        "content": system_prompt,
-    }
 
+def main():
+    setup()
     print("Type 'help' for chat commands")
 
     messages = []
@@ -222,6 +218,7 @@ def main():
                 # clears the chat history and terminal
                 messages.clear()
                 messages.append(system_message)
+                context_window.forget("cli")
                 os.system("cls" if os.name == "nt" else "clear")
                 continue
             if prompt == "load":
@@ -231,34 +228,10 @@ def main():
                 exit("Exiting...")
 
             # Add the prompt to the context
-            messages.append({"role": "user", "content": prompt})
+            messages.append(user_message(prompt))
 
             print("Prompting the backend for function calls...")
-
-            finished = False
-            while not finished:
-                # Do initial inference to let the AI select function calls
-                choices = client.chat.completions.create(
-                    model=config["model_name"],
-                    messages=messages,
-                    tools=functions,
-                    tool_choice="auto",
-                ).choices
-                choice = choices[0]
-                assistant_messages = format_assistant_message(choice)
-                # Add AI response/function call requests to context
-                messages.append(assistant_messages)
-                # If there are no function calls, this will break the loop after this conversation turn
-                if choice.finish_reason != "tool_calls":
-                    if choice.message.content:
-                        print(choice.message.content)
-                    finished = True
-                    continue
-                # Print all function calls the model is requesting
-                print_func_calls(choice)
-                # Execute functions and add their responses to the context
-                func_responses = execute_functions(choice)
-                messages.extend(func_responses)
+            run_turn(messages)
 
         except (KeyboardInterrupt, Exception) as e:
             print(e)
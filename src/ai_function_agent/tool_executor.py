@@ -0,0 +1,180 @@
+import asyncio
+import functools
+import inspect
+import json
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable
+
+from ai_function_agent.tool_cache import ToolResultCache
+from ai_function_agent.tracing import span
+
+
+class ToolTimeoutError(Exception):
+    pass
+
+
+class ToolExecutor:
+    """Runs tool functions off the event loop.
+
+    Most tools block on network or disk, so they run on a bounded thread pool, and async tools
+    (`async def`) are awaited on the event loop. Tools
+    marked with `"executor": "heavy"` in their module's `function_options` get their own,
+    smaller pool so they can't starve the lighter tools.
+
+    The options can also limit how many calls to a tool run at once (`"max_concurrency"`)
+    and how long a call may take (`"timeout"` in seconds, `None` to wait forever).
+    A timed out call keeps its worker thread until it returns, the model just stops
+    waiting for it. A call that raises is reported to the model the same way.
+
+    Tools whose results only depend on their arguments can have them cached for a while with
+    `"cache": {"ttl": seconds, "max_size": entries, "key": "function_name"}`, see
+    ToolResultCache. Calls are cached by their arguments, or by what the module's function
+    named by `"key"` returns for them (to round coordinates, for example).
+    """
+
+    def __init__(
+        self,
+        function_options: dict,
+        io_workers: int = 8,
+        heavy_workers: int = 1,
+        default_timeout: float | None = None,
+    ):
+        self.function_options = function_options
+        self.default_timeout = default_timeout
+        self.io_executor = ThreadPoolExecutor(
+            max_workers=io_workers, thread_name_prefix="tool-io"
+        )
+        self.heavy_executor = ThreadPoolExecutor(
+            max_workers=heavy_workers, thread_name_prefix="tool-heavy"
+        )
+        # asyncio primitives belong to one loop (the CLI's tool_loop or the web server's), they
+        # are made again if the executor is used from another one
+        self._loop = None
+        self._semaphores: dict[str, asyncio.Semaphore] = {}
+        # Shared by every conversation
+        self.cache = ToolResultCache()
+
+    def get_executor(self, fn_name: str) -> ThreadPoolExecutor:
+        options = self.function_options.get(fn_name, {})
+        if options.get("executor") == "heavy":
+            return self.heavy_executor
+        return self.io_executor
+
+    def get_semaphore(self, fn_name: str) -> asyncio.Semaphore | None:
+        max_concurrency = self.function_options.get(fn_name, {}).get("max_concurrency")
+        if not max_concurrency:
+            return None
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self._semaphores = {}
+        if fn_name not in self._semaphores:
+            self._semaphores[fn_name] = asyncio.Semaphore(max_concurrency)
+        return self._semaphores[fn_name]
+
+    async def resolve(self, fn_name: str, fnc: Callable) -> Callable:
+        """The function behind a tool, importing its module on a worker thread if it isn't yet"""
+        if getattr(fnc, "loaded", True):
+            return getattr(fnc, "function", fnc)
+        # Don't import the tool's module on the event loop
+        return await asyncio.get_running_loop().run_in_executor(
+            self.get_executor(fn_name), lambda: fnc.function
+        )
+
+    async def _call(self, fn_name: str, fnc: Callable, fn_args: dict):
+        loop = asyncio.get_running_loop()
+        timeout = self.function_options.get(fn_name, {}).get(
+            "timeout", self.default_timeout
+        )
+        if getattr(fnc, "is_async", False) or inspect.iscoroutinefunction(fnc):
+            # Async tools do their I/O on the event loop, cancelled cleanly when they time out
+            function = await self.resolve(fn_name, fnc)
+            future = function(**fn_args)
+        else:
+            future = loop.run_in_executor(
+                self.get_executor(fn_name), functools.partial(fnc, **fn_args)
+            )
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            raise ToolTimeoutError(f"The function {fn_name} timed out after {timeout} seconds.")
+
+    async def cache_key(self, fn_name: str, fnc: Callable, fn_args: dict, options: dict) -> str:
+        key = fn_args
+        if options.get("key"):
+            function = await self.resolve(fn_name, fnc)
+            key = function.__globals__[options["key"]](**fn_args)
+        return json.dumps(key, sort_keys=True, default=str)
+
+    async def run(self, fn_name: str, fnc: Callable, fn_args: dict) -> str:
+        with span("tool", tool=fn_name) as tool_span:
+            if tool_span.recording:
+                tool_span.set("argument_bytes", len(json.dumps(fn_args, default=str)))
+            result = await self._run_cached(fn_name, fnc, fn_args)
+            tool_span.set("result_bytes", len(result))
+            return result
+
+    async def _run_cached(self, fn_name: str, fnc: Callable, fn_args: dict) -> str:
+        try:
+            options = self.function_options.get(fn_name, {}).get("cache")
+            if options is None or options is False:
+                return await self._run(fn_name, fnc, fn_args)
+            if options is True:
+                options = {}
+            try:
+                key = await self.cache_key(fn_name, fnc, fn_args, options)
+            except Exception as e:
+                print(f"Not caching {fn_name}, could not make a cache key: {e}")
+                return await self._run(fn_name, fnc, fn_args)
+            return await self.cache.get_or_run(
+                fn_name, key, options, lambda: self._run(fn_name, fnc, fn_args)
+            )
+        except ToolTimeoutError as e:
+            return str(e)
+        except Exception as e:
+            print(f"The function {fn_name} failed: {e!r}")
+            return f"The function {fn_name} failed: {e}"
+
+    async def _run(self, fn_name: str, fnc: Callable, fn_args: dict) -> str:
+        semaphore = self.get_semaphore(fn_name)
+        if semaphore is None:
+            fn_res = await self._call(fn_name, fnc, fn_args)
+        else:
+            async with semaphore:
+                fn_res = await self._call(fn_name, fnc, fn_args)
+        if not isinstance(fn_res, str):
+            fn_res = str(fn_res)
+        return fn_res
+
+    async def run_all(self, calls: list[tuple[str, Callable, dict]]) -> list[str]:
+        """Runs (name, function, args) calls concurrently, results come back in the same order"""
+        return await asyncio.gather(*(self.run(*call) for call in calls))
+
+    async def run_as_completed(
+        self,
+        calls: dict[int, tuple[str, Callable, dict]],
+        prefetched: dict[int, Awaitable[str]] = None,
+    ):
+        """
+        Runs keyed (name, function, args) calls concurrently, yielding (key, result) as each one
+        finishes. Calls already started (see ToolPrefetcher) are awaited instead of run again.
+        """
+        prefetched = prefetched or {}
+
+        async def run_keyed(key, call):
+            if key in prefetched:
+                return key, await prefetched[key]
+            return key, await self.run(*call)
+
+        tasks = [asyncio.ensure_future(run_keyed(key, call)) for key, call in calls.items()]
+        try:
+            for next_result in asyncio.as_completed(tasks):
+                yield await next_result
+        finally:
+            # The caller stopped early (the client went away), don't leave the calls running
+            for task in tasks:
+                task.cancel()
+
+    def shutdown(self, wait: bool = True):
+        self.io_executor.shutdown(wait=wait, cancel_futures=True)
+        self.heavy_executor.shutdown(wait=wait, cancel_futures=True)
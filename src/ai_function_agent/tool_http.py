@@ -0,0 +1,133 @@
+import asyncio
+import random
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import httpx
+
+# Responses worth trying again, the server is overloaded or a proxy in front of it is
+RETRY_STATUSES = {429, 502, 503, 504}
+USER_AGENT = "Mozilla/5.0 (compatible; ai-function-agent)"
+# Never wait longer than this between retries, whatever Retry-After says
+MAX_RETRY_DELAY = 30
+
+
+class ToolHTTPClient:
+    """
+    The async HTTP client tools share, so their requests reuse pooled keep-alive connections
+    instead of paying for DNS, TCP and TLS on every call.
+
+    Every request has a `timeout`, is retried up to `retries` times on connection errors,
+    timeouts and the statuses in RETRY_STATUSES (waiting `backoff` seconds, doubling each
+    time, or what Retry-After asks for), and at most `per_host` requests go to the same host
+    at once. httpx clients belong to the event loop they were first used on, so a new one is
+    made if the loop changes.
+    """
+
+    def __init__(
+        self,
+        timeout: float = 10,
+        retries: int = 2,
+        backoff: float = 0.5,
+        per_host: int = 4,
+        max_connections: int = 32,
+    ):
+        self.configure(timeout, retries, backoff, per_host, max_connections)
+        self._client = None
+        self._loop = None
+        self._host_semaphores: dict[str, asyncio.Semaphore] = {}
+        self.requests = 0
+        self.retried = 0
+
+    def configure(
+        self,
+        timeout: float = 10,
+        retries: int = 2,
+        backoff: float = 0.5,
+        per_host: int = 4,
+        max_connections: int = 32,
+    ):
+        """Changes the settings, takes effect for the next client made"""
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.per_host = per_host
+        self.max_connections = max_connections
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        if self._client is None or loop is not self._loop:
+            self._loop = loop
+            self._host_semaphores = {}
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                headers={"User-Agent": USER_AGENT},
+                follow_redirects=True,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                ),
+            )
+        return self._client
+
+    def host_semaphore(self, url: str) -> asyncio.Semaphore:
+        host = urlsplit(url).netloc
+        if host not in self._host_semaphores:
+            self._host_semaphores[host] = asyncio.Semaphore(self.per_host)
+        return self._host_semaphores[host]
+
+    def retry_delay(self, attempt: int, response: httpx.Response | None = None) -> float:
+        if response is not None and "Retry-After" in response.headers:
+            retry_after = response.headers["Retry-After"]
+            try:
+                return min(MAX_RETRY_DELAY, max(0.0, float(retry_after)))
+            except ValueError:
+                try:
+                    when = parsedate_to_datetime(retry_after)
+                    delay = (when - datetime.now(timezone.utc)).total_seconds()
+                    return min(MAX_RETRY_DELAY, max(0.0, delay))
+                except (TypeError, ValueError):
+                    pass
+        # Exponential backoff with jitter, so retries from several calls don't line up
+        return self.backoff * 2**attempt * random.uniform(0.5, 1.0)
+
+    async def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        client = self.client
+        attempt = 0
+        while True:
+            self.requests += 1
+            try:
+                async with self.host_semaphore(url):
+                    response = await client.request(method, url, **kwargs)
+            except httpx.TransportError:
+                # Connection errors and timeouts
+                if attempt >= self.retries:
+                    raise
+                delay = self.retry_delay(attempt)
+            else:
+                if response.status_code not in RETRY_STATUSES or attempt >= self.retries:
+                    return response
+                delay = self.retry_delay(attempt, response)
+            attempt += 1
+            self.retried += 1
+            await asyncio.sleep(delay)
+
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("POST", url, **kwargs)
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def stats(self) -> dict:
+        return {"requests": self.requests, "retried": self.retried}
+
+
+# Configured from `tool_http` in the config by the CLI and the web server
+http_client = ToolHTTPClient()
@@ -0,0 +1,99 @@
+import asyncio
+
+from ai_function_agent.tool_executor import ToolExecutor
+from ai_function_agent.tool_registry import ToolRegistry
+
+
+class ToolPrefetcher:
+    """
+    Starts tool calls while a streamed completion is still coming in, as soon as a call's
+    arguments are complete, so the tool runs while the model finishes its reply (the rest of
+    its calls, or the end of a long reasoning block) instead of after it.
+
+    Only tools marked `"side_effect_free": True` in their `function_options` are started
+    early, since a call the model ends up not making can't be taken back. Once the completion
+    is done the early calls that match a final call exactly (same position, tool and
+    arguments) stand in for it, the others are cancelled and their results thrown away.
+    """
+
+    def __init__(self, registry: ToolRegistry, executor: ToolExecutor, enabled: bool = True):
+        self.registry = registry
+        self.executor = executor
+        self.enabled = enabled
+        self.started = 0
+        self.used = 0
+        self.discarded = 0
+
+    def eligible(self, fn_name: str) -> bool:
+        return self.enabled and bool(
+            self.registry.options.get(fn_name, {}).get("side_effect_free")
+        )
+
+    def round(self) -> "PrefetchRound":
+        return PrefetchRound(self)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "started": self.started,
+            "used": self.used,
+            "discarded": self.discarded,
+        }
+
+
+class PrefetchRound:
+    """The calls started early during one streamed completion, see ToolPrefetcher"""
+
+    def __init__(self, prefetcher: ToolPrefetcher):
+        self.prefetcher = prefetcher
+        # Position of the tool call -> (name, arguments, task running it)
+        self.calls: dict[int, tuple[str, dict, asyncio.Task]] = {}
+        # Handed out by take(), for discard() to cancel if they're never awaited
+        self.taken: list[asyncio.Task] = []
+
+    def observe(self, tool_calls: dict[int, dict]):
+        """Starts the calls in ChatStreamAccumulator.tool_calls whose arguments just became complete"""
+        for index, tool_call in tool_calls.items():
+            if index in self.calls:
+                continue
+            name = tool_call["function"]["name"]
+            arguments = tool_call["function"]["arguments"]
+            # Arguments can't be complete before the object is closed, skip parsing until then
+            if not arguments.rstrip().endswith("}") or not self.prefetcher.eligible(name):
+                continue
+            tool, fn_args, error = self.prefetcher.registry.validate(name, arguments)
+            if error is not None:
+                # Most likely a nested object that was closed, not the arguments themselves
+                continue
+            task = asyncio.ensure_future(self.prefetcher.executor.run(name, tool, fn_args))
+            self.calls[index] = (name, fn_args, task)
+            self.prefetcher.started += 1
+
+    def take(self, valid_calls: dict[int, tuple]) -> dict[int, asyncio.Task]:
+        """
+        Returns the early calls standing in for the final (name, function, args) calls, by
+        position, and cancels the ones that don't match any
+        """
+        matched = {}
+        for index, (name, fn_args, task) in self.calls.items():
+            call = valid_calls.get(index)
+            if call is not None and call[0] == name and call[2] == fn_args:
+                matched[index] = task
+                self.taken.append(task)
+                self.prefetcher.used += 1
+            else:
+                task.cancel()
+                self.prefetcher.discarded += 1
+        self.calls = {}
+        return matched
+
+    def discard(self):
+        """
+        Cancels every early call still running, for when the completion doesn't end in tool
+        calls or the round is over. Calls handed out by take() are done by then unless the
+        round was cut short.
+        """
+        self.take({})
+        for task in self.taken:
+            task.cancel()
+        self.taken = []
@@ -0,0 +1,281 @@
+import ast
+import builtins
+import glob
+import inspect
+import json
+import os
+import threading
+from importlib import util
+from typing import Callable, Optional
+
+from ai_function_agent.tool_validation import (
+    ArgumentValidator,
+    format_validation_error,
+)
+
+# Annotations a signature read from source can be checked against
+AST_ANNOTATIONS = {
+    name: getattr(builtins, name) for name in ("str", "int", "float", "bool", "list", "dict")
+}
+
+
+class ToolModule:
+    """A tool module that is only imported the first time one of its tools is called"""
+
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        self.module = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        with self._lock:
+            if self.module is None:
+                module_name = os.path.splitext(os.path.basename(self.file_path))[0]
+                print(f"Loading tool module {module_name}...")
+                spec = util.spec_from_file_location(module_name, self.file_path)
+                module = util.module_from_spec(spec)
+                spec.loader.exec_module(module)
+                self.module = module
+        return self.module
+
+    def get_function(self, name: str) -> Callable:
+        module = self.load()
+        fns = module.function if isinstance(module.function, list) else [module.function]
+        for fn in fns:
+            if fn.__name__ == name:
+                return fn
+        raise AttributeError(f"{self.file_path} has no function {name}")
+
+
+class Tool:
+    def __init__(
+        self,
+        name: str,
+        function: Callable | None,
+        spec: dict,
+        signature: inspect.Signature | None = None,
+        module: ToolModule | None = None,
+        is_async: bool | None = None,
+    ):
+        self.name = name
+        self._function = function
+        self.spec = spec
+        self.module = module
+        # Async tools are awaited on the event loop instead of running on a worker thread
+        self.is_async = inspect.iscoroutinefunction(function) if is_async is None else is_async
+        # Compiled once here instead of inspecting the function on every call
+        self.validator = ArgumentValidator(name, signature or function, spec)
+
+    @property
+    def function(self) -> Callable:
+        if self._function is None:
+            self._function = self.module.get_function(self.name)
+        return self._function
+
+    @property
+    def loaded(self) -> bool:
+        return self._function is not None
+
+    def __call__(self, **kwargs):
+        # Called on the executor's worker thread, so a lazy import never blocks the event loop
+        return self.function(**kwargs)
+
+
+def resolve_annotation(node: ast.expr | None):
+    """Turns a simple annotation (`int`, `str | None`, `Optional[int]`) back into a type"""
+    if node is None:
+        return inspect.Parameter.empty
+    if isinstance(node, ast.Name):
+        return AST_ANNOTATIONS.get(node.id, inspect.Parameter.empty)
+    if isinstance(node, ast.BinOp) and isinstance(node.op, ast.BitOr):
+        types = [node.left, node.right]
+        if any(isinstance(n, ast.Constant) and n.value is None for n in types):
+            other = [n for n in types if not (isinstance(n, ast.Constant) and n.value is None)]
+            inner = resolve_annotation(other[0])
+            if inner is not inspect.Parameter.empty:
+                return Optional[inner]
+    if (
+        isinstance(node, ast.Subscript)
+        and isinstance(node.value, ast.Name)
+        and node.value.id == "Optional"
+    ):
+        inner = resolve_annotation(node.slice)
+        if inner is not inspect.Parameter.empty:
+            return Optional[inner]
+    return inspect.Parameter.empty
+
+
+def signature_from_ast(node: ast.FunctionDef | ast.AsyncFunctionDef) -> inspect.Signature:
+    """Rebuilds what the argument validator needs from a function's source"""
+    args = node.args
+    params = []
+    positional = args.posonlyargs + args.args
+    defaults = [inspect.Parameter.empty] * (len(positional) - len(args.defaults)) + args.defaults
+    for n, (arg, default) in enumerate(zip(positional, defaults)):
+        kind = (
+            inspect.Parameter.POSITIONAL_ONLY
+            if n < len(args.posonlyargs)
+            else inspect.Parameter.POSITIONAL_OR_KEYWORD
+        )
+        params.append((arg, kind, default))
+    if args.vararg:
+        params.append((args.vararg, inspect.Parameter.VAR_POSITIONAL, inspect.Parameter.empty))
+    for arg, default in zip(args.kwonlyargs, args.kw_defaults):
+        params.append((arg, inspect.Parameter.KEYWORD_ONLY, default or inspect.Parameter.empty))
+    if args.kwarg:
+        params.append((args.kwarg, inspect.Parameter.VAR_KEYWORD, inspect.Parameter.empty))
+
+    parameters = []
+    for arg, kind, default in params:
+        if isinstance(default, ast.AST):
+            # Only whether there is a default (and if it's None) matters for validation
+            default = default.value if isinstance(default, ast.Constant) else ...
+        annotation = resolve_annotation(arg.annotation)
+        parameters.append(inspect.Parameter(arg.arg, kind, default=default, annotation=annotation))
+    return inspect.Signature(parameters)
+
+
+def read_tool_manifest(file_path: str) -> tuple[dict, list, dict, set] | None:
+    """
+    Reads `function_spec`, `function_options`, the signatures of the `function`s and which of
+    them are async from a tool module's source without importing it. Returns None if any of
+    them isn't written out literally, in which case the module has to be imported to find out.
+    """
+    with open(file_path, "r", encoding="utf-8") as fp:
+        tree = ast.parse(fp.read(), file_path)
+
+    definitions = {}
+    values = {}
+    for node in tree.body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            definitions[node.name] = node
+        elif isinstance(node, ast.Assign) and len(node.targets) == 1:
+            target = node.targets[0]
+            if isinstance(target, ast.Name) and target.id in (
+                "function",
+                "function_spec",
+                "function_options",
+            ):
+                values[target.id] = node.value
+    if "function" not in values or "function_spec" not in values:
+        return None
+
+    try:
+        func_specs = ast.literal_eval(values["function_spec"])
+        options = {}
+        if "function_options" in values:
+            options = ast.literal_eval(values["function_options"])
+    except (ValueError, TypeError, SyntaxError):
+        return None
+    fn_nodes = values["function"]
+    fn_nodes = fn_nodes.elts if isinstance(fn_nodes, ast.List) else [fn_nodes]
+    signatures = {}
+    for fn_node in fn_nodes:
+        if not isinstance(fn_node, ast.Name) or fn_node.id not in definitions:
+            return None
+        signatures[fn_node.id] = signature_from_ast(definitions[fn_node.id])
+    async_functions = {
+        name for name in signatures if isinstance(definitions[name], ast.AsyncFunctionDef)
+    }
+    if not isinstance(func_specs, list):
+        func_specs = [func_specs]
+    return signatures, func_specs, options, async_functions
+
+
+def canonical_spec(spec: dict) -> dict:
+    """A copy of the spec with the keys of every object sorted"""
+    return json.loads(json.dumps(spec, sort_keys=True))
+
+
+class ToolRegistry:
+    """
+    Every tool the model can call. Tool modules define `function` (a function or list of them),
+    `function_spec` (the OpenAI tool spec or a list of them) and optionally `function_options`.
+
+    Modules are read without being imported, and only imported the first time one of their
+    tools is called, so heavy imports (torch, models) don't slow down startup. Modules whose
+    specs aren't plain literals are imported straight away. Set `lazy` to False to import
+    everything up front.
+    """
+
+    lazy = True
+
+    def __init__(self):
+        self.tools: dict[str, Tool] = {}
+        # Sent to the backend as `tools`. Kept sorted by name with the keys of every spec sorted,
+        # so the tool block of the prompt is byte for byte the same whatever order tools were
+        # loaded in, and the backend can reuse its cached prefix
+        self.specs: list[dict] = []
+        # Shared with the ToolExecutor, so it's only ever updated in place
+        self.options: dict[str, dict] = {}
+
+    def load(self, glob_str: str):
+        """Registers every tool module matching the glob"""
+        for file_path in sorted(glob.glob(glob_str)):
+            manifest = read_tool_manifest(file_path) if self.lazy else None
+            if manifest is None:
+                self.load_module(file_path)
+                continue
+            signatures, func_specs, options, async_functions = manifest
+            module = ToolModule(file_path)
+            for func_spec in func_specs:
+                name = func_spec["function"]["name"]
+                if name not in signatures:
+                    print(f"Skipping {name} in {file_path}, there is no function with that name")
+                    continue
+                tool = Tool(
+                    name, None, func_spec, signatures[name], module, name in async_functions
+                )
+                self.register_tool(tool, options.get(name))
+
+    def load_module(self, file_path: str):
+        """Imports a tool module now and registers its tools"""
+        module = ToolModule(file_path).load()
+        if not hasattr(module, "function") or not hasattr(module, "function_spec"):
+            print(f"Skipping {file_path}, it has no function or function_spec")
+            return
+
+        fns = module.function if isinstance(module.function, list) else [module.function]
+        func_specs = module.function_spec
+        if not isinstance(func_specs, list):
+            func_specs = [func_specs]
+        fns = {fn.__name__: fn for fn in fns}
+        for func_spec in func_specs:
+            name = func_spec["function"]["name"]
+            if name not in fns:
+                print(f"Skipping {name} in {file_path}, there is no function with that name")
+                continue
+            self.register(
+                fns[name],
+                func_spec,
+                getattr(module, "function_options", {}).get(name),
+            )
+
+    def register(self, function: Callable, spec: dict, options: dict = None):
+        self.register_tool(Tool(spec["function"]["name"], function, spec), options)
+
+    def register_tool(self, tool: Tool, options: dict = None):
+        name = tool.name
+        tool.spec = canonical_spec(tool.spec)
+        self.tools[name] = tool
+        self.specs[:] = [self.tools[tool_name].spec for tool_name in sorted(self.tools)]
+        if options:
+            self.options[name] = options
+        else:
+            self.options.pop(name, None)
+
+    def get(self, name: str) -> Tool | None:
+        return self.tools.get(name)
+
+    def validate(self, name: str, arguments: str) -> tuple[Tool | None, dict | None, str | None]:
+        """
+        Looks up a tool and validates the arguments for a call to it.
+        Returns the tool and the parsed arguments, or the error to send back to the model.
+        """
+        tool = self.tools.get(name)
+        if tool is None:
+            return None, None, json.dumps({"error": f"The function {name} does not exist"})
+        fn_args, errors = tool.validator.validate(arguments)
+        if errors:
+            return tool, None, format_validation_error(name, errors)
+        return tool, fn_args, None
@@ -0,0 +1,193 @@
+import inspect
+import json
+import types
+import typing
+from typing import Any, Callable
+
+# Python types the model's json values can be checked against, by json schema type
+JSON_TYPES = {
+    "string": str,
+    "number": (int, float),
+    "integer": int,
+    "boolean": bool,
+    "array": list,
+    "object": dict,
+}
+
+
+class ArgumentError(Exception):
+    pass
+
+
+def unwrap_optional(annotation) -> tuple[Any, bool]:
+    """Turns `X | None` or `Optional[X]` into (X, True)"""
+    if typing.get_origin(annotation) in (typing.Union, types.UnionType):
+        args = [arg for arg in typing.get_args(annotation) if arg is not type(None)]
+        if len(args) == 1:
+            return args[0], True
+    return annotation, False
+
+
+def to_int(value):
+    if isinstance(value, bool):
+        raise ArgumentError("must be an integer")
+    if isinstance(value, int):
+        return value
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, str):
+        try:
+            return int(value.strip())
+        except ValueError:
+            try:
+                return to_int(float(value.strip()))
+            except ValueError:
+                pass
+    raise ArgumentError("must be an integer")
+
+
+def to_float(value):
+    if isinstance(value, bool):
+        raise ArgumentError("must be a number")
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        try:
+            return float(value.strip())
+        except ValueError:
+            pass
+    raise ArgumentError("must be a number")
+
+
+def to_str(value):
+    if isinstance(value, str):
+        return value
+    # Models like to send coordinates and ids as bare numbers
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    raise ArgumentError("must be a string")
+
+
+def to_bool(value):
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.strip().lower() in ("true", "false"):
+        return value.strip().lower() == "true"
+    raise ArgumentError("must be a boolean")
+
+
+COERCERS = {int: to_int, float: to_float, str: to_str, bool: to_bool}
+SCHEMA_COERCERS = {
+    "integer": to_int,
+    "string": to_str,
+    "boolean": to_bool,
+}
+
+
+def compile_coercer(json_type: str | None, param: inspect.Parameter | None) -> Callable:
+    """
+    Builds the function that checks and converts one argument. The function's annotation
+    wins over the schema type since it's what the code actually gets called with
+    (the specs say "number" for things like `results: int`).
+    """
+    annotation, optional = (None, False)
+    if param is not None and param.annotation is not inspect.Parameter.empty:
+        annotation, optional = unwrap_optional(param.annotation)
+    optional = optional or (param is not None and param.default is None)
+
+    coercer = COERCERS.get(annotation) or SCHEMA_COERCERS.get(json_type)
+    if coercer is None:
+        expected = JSON_TYPES.get(json_type)
+        if expected is None:
+            coercer = lambda value: value
+        else:
+
+            def coercer(value):
+                if isinstance(value, bool) and json_type != "boolean":
+                    raise ArgumentError(f"must be of type {json_type}")
+                if not isinstance(value, expected):
+                    raise ArgumentError(f"must be of type {json_type}")
+                return value
+
+    if optional:
+        required_coercer = coercer
+        coercer = lambda value: None if value is None else required_coercer(value)
+    return coercer
+
+
+class ArgumentValidator:
+    """
+    Checks a tool call's arguments against the tool's `function_spec` and signature.
+    Everything that can be worked out ahead of time is, so validating a call parses the
+    arguments once and runs one small function per argument.
+    """
+
+    def __init__(self, name: str, function: Callable | inspect.Signature, spec: dict):
+        self.name = name
+        # Lazily loaded tools only have the signature read from their source
+        if not isinstance(function, inspect.Signature):
+            function = inspect.signature(function)
+        params = function.parameters
+        schema = spec.get("function", {}).get("parameters", {})
+        properties = schema.get("properties", {})
+
+        self.accepts_kwargs = any(
+            param.kind == inspect.Parameter.VAR_KEYWORD for param in params.values()
+        )
+        named_params = {
+            key: param
+            for key, param in params.items()
+            if param.kind
+            not in (inspect.Parameter.VAR_POSITIONAL, inspect.Parameter.VAR_KEYWORD)
+        }
+        self.allowed = set(named_params)
+        if self.accepts_kwargs:
+            self.allowed |= set(properties)
+        self.required = [
+            key
+            for key, param in named_params.items()
+            if param.default is inspect.Parameter.empty
+        ]
+        self.required += [key for key in schema.get("required", []) if key not in self.required]
+        self.coercers = {
+            key: compile_coercer(
+                properties.get(key, {}).get("type"), named_params.get(key)
+            )
+            for key in self.allowed
+        }
+
+    def validate(self, arguments: str | dict) -> tuple[dict | None, list[str]]:
+        """Returns the parsed and coerced arguments, or None and what's wrong with them"""
+        if isinstance(arguments, str):
+            try:
+                arguments = json.loads(arguments) if arguments.strip() else {}
+            except json.JSONDecodeError as e:
+                return None, [f"The arguments are not valid JSON: {e}"]
+        if not isinstance(arguments, dict):
+            return None, ["The arguments must be a JSON object"]
+
+        errors = []
+        fn_args = {}
+        for key, value in arguments.items():
+            coercer = self.coercers.get(key)
+            if coercer is None:
+                errors.append(f"Unexpected argument '{key}'")
+                continue
+            try:
+                fn_args[key] = coercer(value)
+            except ArgumentError as e:
+                errors.append(f"Argument '{key}' {e}")
+        for key in self.required:
+            if key not in arguments:
+                errors.append(f"Missing required argument '{key}'")
+
+        if errors:
+            return None, errors
+        return fn_args, []
+
+
+def format_validation_error(name: str, errors: list[str]) -> str:
+    """The tool message sent back to the model so it can fix the call and try again"""
+    return json.dumps(
+        {"error": f"Invalid arguments for the function {name}", "details": errors}
+    )
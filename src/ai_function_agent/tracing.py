@@ -0,0 +1,79 @@
+import time
+from typing import Callable
+
+
+class Span:
+    """One timed stage of a turn, passed to every listener when it ends"""
+
+    __slots__ = ("tracer", "name", "attributes", "start", "duration")
+    # Attributes that take work to compute are only worth it for a recording span
+    recording = True
+
+    def __init__(self, tracer: "Tracer", name: str, attributes: dict):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+        self.start = 0.0
+        self.duration = 0.0
+
+    def set(self, key: str, value):
+        self.attributes[key] = value
+
+    def __enter__(self) -> "Span":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.duration = time.perf_counter() - self.start
+        if exc_type is not None:
+            self.attributes["error"] = exc_type.__name__
+        for listener in self.tracer.listeners:
+            listener(self)
+
+
+class NoopSpan:
+    """What `span` hands out while nobody is listening, so tracing costs next to nothing"""
+
+    __slots__ = ()
+    recording = False
+
+    def set(self, key: str, value):
+        pass
+
+    def __enter__(self) -> "NoopSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        pass
+
+
+NOOP_SPAN = NoopSpan()
+
+
+class Tracer:
+    """
+    Times the stages of the agent loop. Spans are only recorded while there is at least one
+    listener, a function that gets every finished Span.
+    """
+
+    def __init__(self):
+        self.listeners: list[Callable[[Span], None]] = []
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.listeners)
+
+    def add_listener(self, listener: Callable[[Span], None]):
+        self.listeners.append(listener)
+
+    def remove_listener(self, listener: Callable[[Span], None]):
+        self.listeners.remove(listener)
+
+    def span(self, name: str, **attributes) -> Span | NoopSpan:
+        if not self.listeners:
+            return NOOP_SPAN
+        return Span(self, name, attributes)
+
+
+tracer = Tracer()
+span = tracer.span